@@ -5,6 +5,7 @@ import pg_data_etl as pg
 
 import warnings
 from network_routing.accessibility.routable_network import RoutableNetwork
+from network_routing.database.instrumentation import instrument, profiling_enabled
 
 # Load environment variables
 load_dotenv(find_dotenv())
@@ -23,4 +24,9 @@ else:
 
 def pg_db_connection() -> pg.Database:
     db = pg.Database.from_uri(DATABASE_URL)
+
+    # Time every query when SQL_PROFILE=1
+    if profiling_enabled():
+        db = instrument(db)
+
     return db
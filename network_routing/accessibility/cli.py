@@ -49,6 +49,7 @@ from datetime import datetime
 from network_routing import pg_db_connection
 
 from .routable_network import RoutableNetwork, DoubleNetwork
+from .logic_grid import result_table_to_grid, write_grid
 
 
 def _execute_analysis_into_one_output(arguments: dict) -> RoutableNetwork:
@@ -499,6 +500,23 @@ def rrmp_lts():
     _ = _execute_analysis_into_one_output(arguments)
 
 
+@click.command()
+@click.argument("result_table")
+@click.option("--cell-size", default=100.0, help="Width of each grid cell, in meters")
+@click.option("--per-poi", is_flag=True, help="Keep one band per POI instead of the least minutes")
+@click.option("--output-dir", default="./data", help="Folder to save the grid file into")
+def grid_results(result_table, cell_size, per_poi, output_dir):
+    """Rasterize an existing RESULT_TABLE onto a grid"""
+
+    db = pg_db_connection()
+
+    grid, header = result_table_to_grid(db, result_table, cell_size, per_poi)
+
+    filepath = write_grid(f"{output_dir}/{result_table}_grid.npz", grid, header)
+
+    print(f"Wrote {header['width']} x {header['height']} grid to {filepath}")
+
+
 _all_commands = [
     sw_default,
     osm_access_score,
@@ -517,6 +535,7 @@ _all_commands = [
     rrmp_sw,
     rrmp_lts,
     eta_schools,
+    grid_results,
 ]
 
 for cmd in _all_commands:
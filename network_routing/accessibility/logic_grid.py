@@ -0,0 +1,217 @@
+"""
+logic_grid.py
+-------------
+
+This module contains functions that rasterize node-level accessibility results
+onto a fixed-resolution grid, and read/write that grid as a compact `.npz` file.
+
+Each file holds a `minutes` array (one band per POI, or a single band of the
+least minutes across all POIs) and a small JSON header with the grid's origin,
+cell size, shape, projection and band names.
+
+"""
+from __future__ import annotations
+
+import json
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+
+from pg_data_etl import Database
+
+
+def rasterize_minutes(
+    x: np.ndarray,
+    y: np.ndarray,
+    minutes: np.ndarray,
+    cell_size: float = 100,
+    bounds: tuple | None = None,
+) -> tuple[np.ndarray, dict]:
+    """
+    - Bin point values onto a grid, keeping the smallest value that lands in each cell
+
+    Arguments:
+        x (np.ndarray): x coordinate of each point
+        y (np.ndarray): y coordinate of each point
+        minutes (np.ndarray): one value per point, or a 2D array with one column per band
+        cell_size (float): width and height of each grid cell, in the units of the coordinates
+        bounds (tuple | None): optional `(xmin, ymin, xmax, ymax)`, defaults to the extent of the points
+
+    Returns:
+        np.ndarray: float32 grid shaped `(bands, rows, cols)`, with NaN for cells without a value
+        dict: header with the grid's `xmin`, `ymax`, `cell_size`, `width`, `height` and `bands`
+    """
+
+    minutes = np.asarray(minutes, dtype=np.float32)
+    if minutes.ndim == 1:
+        minutes = minutes[:, None]
+
+    if bounds is None:
+        bounds = (x.min(), y.min(), x.max(), y.max())
+
+    xmin, ymin, xmax, ymax = bounds
+
+    width = int(np.floor((xmax - xmin) / cell_size)) + 1
+    height = int(np.floor((ymax - ymin) / cell_size)) + 1
+
+    # Row 0 is the top of the grid, like an image or GeoTIFF
+    cols = np.floor((x - xmin) / cell_size).astype(np.int64)
+    rows = np.floor((ymax - y) / cell_size).astype(np.int64)
+
+    inside = (cols >= 0) & (cols < width) & (rows >= 0) & (rows < height)
+    cells = rows[inside] * width + cols[inside]
+    values = minutes[inside]
+
+    num_bands = minutes.shape[1]
+    grid = np.full((num_bands, height * width), np.inf, dtype=np.float32)
+
+    # NaN values would win every comparison, so leave them out
+    for band in range(num_bands):
+        has_value = ~np.isnan(values[:, band])
+        np.minimum.at(grid[band], cells[has_value], values[has_value, band])
+
+    grid[np.isinf(grid)] = np.nan
+
+    header = {
+        "xmin": float(xmin),
+        "ymax": float(ymax),
+        "cell_size": float(cell_size),
+        "width": width,
+        "height": height,
+    }
+
+    return grid.reshape(num_bands, height, width), header
+
+
+def rasterize_results(
+    node_gdf: gpd.GeoDataFrame,
+    result_df: pd.DataFrame,
+    cell_size: float = 100,
+    per_poi: bool = False,
+) -> tuple[np.ndarray, dict]:
+    """
+    - Rasterize node-level accessibility results onto a grid
+    - By default this uses the least minutes across every POI, like the `walk_time`
+    value in the gap webmap. Use `per_poi=True` to get one band per POI instead.
+
+    Arguments:
+        node_gdf (gpd.GeoDataFrame): network nodes, indexed by node ID
+        result_df (pd.DataFrame): analysis results indexed by node ID, with one `n_1_{poi_uid}` column per POI
+        cell_size (float): width and height of each grid cell, in the units of the node projection
+        per_poi (bool): flag to keep one band per POI instead of the least minutes across all of them
+
+    Returns:
+        np.ndarray: float32 grid shaped `(bands, rows, cols)`, with NaN for cells without a value
+        dict: grid header, including the `epsg` code and `bands` names
+    """
+
+    n1_columns = [col for col in result_df.columns if col.startswith("n_1_")]
+
+    # Line up the results with the node geometries, dropping nodes without a location
+    positions = node_gdf.index.get_indexer(result_df.index)
+    found = positions >= 0
+
+    geoms = node_gdf.geometry.values[positions[found]]
+    minutes = result_df[n1_columns].to_numpy(dtype=np.float32)[found]
+
+    if per_poi:
+        bands = [col[4:] for col in n1_columns]
+    else:
+        bands = ["least_minutes"]
+
+        # Like SQL's LEAST(), this skips nulls and is only null when every value is null
+        minutes = np.fmin.reduce(minutes, axis=1)
+
+    grid, header = rasterize_minutes(
+        geoms.x, geoms.y, minutes, cell_size, bounds=tuple(node_gdf.total_bounds)
+    )
+
+    header["epsg"] = node_gdf.crs.to_epsg() if node_gdf.crs else None
+    header["bands"] = bands
+
+    return grid, header
+
+
+def result_table_to_grid(
+    db: Database,
+    result_table: str,
+    cell_size: float = 100,
+    per_poi: bool = False,
+) -> tuple[np.ndarray, dict]:
+    """
+    - Rasterize an existing `*_results` geotable without re-running the analysis
+
+    Arguments:
+        db (Database): analysis database
+        result_table (str): name of the node-level result table, with one `n_1_*` column per POI
+        cell_size (float): width and height of each grid cell, in the units of the table's projection
+        per_poi (bool): flag to keep one band per POI instead of the least minutes across all of them
+
+    Returns:
+        np.ndarray: float32 grid shaped `(bands, rows, cols)`, with NaN for cells without a value
+        dict: grid header
+    """
+    n1_columns = [x for x in db.columns(result_table) if x.startswith("n_1_")]
+
+    query = f"""
+        SELECT row_number() over () AS node_id, {", ".join(n1_columns)}, geom
+        FROM {result_table}
+    """
+    gdf = db.gdf(query).set_index("node_id")
+
+    return rasterize_results(gdf[["geom"]], gdf[n1_columns], cell_size, per_poi)
+
+
+def write_grid(filepath: str | Path, grid: np.ndarray, header: dict) -> Path:
+    """
+    - Save a grid and its header to a compressed `.npz` file
+
+    Arguments:
+        filepath (str | Path): path to the output file
+        grid (np.ndarray): grid shaped `(bands, rows, cols)`
+        header (dict): grid header
+
+    Returns:
+        Path: path to the file that was written
+    """
+    filepath = Path(filepath)
+    filepath.parent.mkdir(parents=True, exist_ok=True)
+
+    np.savez_compressed(filepath, minutes=grid, header=json.dumps(header))
+
+    return filepath
+
+
+def read_grid(filepath: str | Path) -> tuple[np.ndarray, dict]:
+    """
+    - Read a grid and its header from a `.npz` file made by `write_grid()`
+
+    Arguments:
+        filepath (str | Path): path to the grid file
+
+    Returns:
+        np.ndarray: grid shaped `(bands, rows, cols)`
+        dict: grid header
+    """
+    with np.load(filepath) as data:
+        return data["minutes"], json.loads(str(data["header"]))
+
+
+def cell_centers(header: dict) -> tuple[np.ndarray, np.ndarray]:
+    """
+    - Get the x and y coordinates of every cell center, in the grid's projection
+
+    Arguments:
+        header (dict): grid header
+
+    Returns:
+        tuple: two arrays shaped `(rows, cols)`, for x and y
+    """
+    size = header["cell_size"]
+
+    xs = header["xmin"] + (np.arange(header["width"]) + 0.5) * size
+    ys = header["ymax"] - (np.arange(header["height"]) + 0.5) * size
+
+    return np.meshgrid(xs, ys)
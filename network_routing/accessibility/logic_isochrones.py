@@ -0,0 +1,337 @@
+"""
+logic_isochrones.py
+-------------------
+
+This module contains functions that turn network analysis results into isochrone polygons,
+using node geometries that are already in memory instead of sending node lists back to PostGIS
+
+"""
+from __future__ import annotations
+
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import shapely
+from shapely.ops import substring
+
+
+def _concave_hull_chunk(
+    multipoints: np.ndarray, node_counts: np.ndarray, ratio: float, buffer_meters: float
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    - Run the vectorized hull + buffer for one chunk of multipoint geometries
+    - Matches `st_buffer(st_collectionextract(st_concavehull(st_collect(geom), ratio), idx), buffer)`,
+    where `idx` is a point for 1 node, a line for 2 nodes, and a polygon otherwise
+
+    Returns:
+        tuple: the raw hulls, and the buffered polygons
+    """
+    hulls = shapely.concave_hull(multipoints, ratio=ratio)
+
+    # Anything that doesn't have the dimension ST_CollectionExtract would have pulled out
+    # (i.e. a line from 3+ collinear nodes) comes out of PostGIS as an empty polygon
+    expected_dimension = np.minimum(node_counts, 3) - 1
+    extracted = hulls.copy()
+    extracted[shapely.get_dimensions(hulls) != expected_dimension] = shapely.from_wkt(
+        "POLYGON EMPTY"
+    )
+
+    return hulls, shapely.buffer(extracted, buffer_meters)
+
+
+def _concave_hulls_threaded(
+    multipoints: np.ndarray,
+    node_counts: np.ndarray,
+    ratio: float,
+    buffer_meters: float,
+    workers: int,
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    - Split `_concave_hull_chunk()` across `workers` threads
+    """
+    if workers <= 1 or len(multipoints) <= 1:
+        return _concave_hull_chunk(multipoints, node_counts, ratio, buffer_meters)
+
+    chunks = np.array_split(np.arange(len(multipoints)), workers)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        results = list(
+            executor.map(
+                lambda c: _concave_hull_chunk(multipoints[c], node_counts[c], ratio, buffer_meters),
+                chunks,
+            )
+        )
+
+    return np.concatenate([r[0] for r in results]), np.concatenate([r[1] for r in results])
+
+
+def nested_concave_hulls(
+    node_gdf: gpd.GeoDataFrame,
+    banded_node_sets: dict,
+    ratio: float = 0.99,
+    buffer_meters: float = 45,
+    workers: int = 1,
+) -> gpd.GeoSeries:
+    """
+    - Build a buffered concave hull around each band of nodes, entirely in memory
+    - This uses the same GEOS concave hull algorithm as `ST_ConcaveHull` in PostGIS 3.3+
+    - The smallest band is hulled from its own nodes. Each larger band is hulled from only the
+    nodes it adds plus the vertices of the hull inside it, and is then unioned with the smaller
+    band's polygon. Every node is hulled once, so the cost stays close to that of the largest
+    band alone, and every band contains the ones inside it.
+
+    Arguments:
+        node_gdf (gpd.GeoDataFrame): network nodes, indexed by node ID
+        banded_node_sets (dict): key is any ID value (like a POI ID), value is a dict keyed on
+            the band, smallest first, with the node IDs at or below it, like `nested_node_sets()`
+        ratio (float): concave hull ratio, defaults to `0.99`
+        buffer_meters (float): distance to buffer each hull by, defaults to `45`
+        workers (int): number of threads to split the hull geometry work across, defaults to `1`
+
+    Returns:
+        gpd.GeoSeries: indexed on `(key, band)`, with one polygon for every band
+        that had at least one matching node
+    """
+
+    node_coords = shapely.get_coordinates(node_gdf.geometry.values)
+    bands = {key: list(b.items()) for key, b in banded_node_sets.items() if b}
+    num_levels = max((len(b) for b in bands.values()), default=0)
+
+    # Keyed on the ID, with the number of node IDs used so far, the number of nodes
+    # that matched, and the raw hull and buffered polygon of the last band
+    state = {}
+    polygons = {}
+
+    for level in range(num_levels):
+        keys, coords, group_ids, node_counts = [], [], [], []
+
+        for key, key_bands in bands.items():
+            if level >= len(key_bands):
+                continue
+
+            band, node_ids = key_bands[level]
+            num_used, num_nodes, hull, polygon = state.get(key, (0, 0, None, None))
+
+            # Bands are prefixes of one sorted list, so only the tail is new
+            idx = node_gdf.index.get_indexer(pd.Index(node_ids[num_used:]).unique())
+            idx = idx[idx >= 0]
+
+            if len(idx) == 0:
+                state[key] = (len(node_ids), num_nodes, hull, polygon)
+                if polygon is not None:
+                    polygons[(key, band)] = polygon
+                continue
+
+            points = node_coords[idx]
+            if hull is not None:
+                points = np.vstack([points, shapely.get_coordinates(hull)])
+
+            coords.append(points)
+            group_ids.append(np.full(len(points), len(keys)))
+            node_counts.append(num_nodes + len(idx))
+            keys.append((key, band, len(node_ids), polygon))
+
+        if not keys:
+            continue
+
+        multipoints = shapely.multipoints(np.concatenate(coords), indices=np.concatenate(group_ids))
+        node_counts = np.array(node_counts)
+
+        hulls, buffered = _concave_hulls_threaded(
+            multipoints, node_counts, ratio, buffer_meters, workers
+        )
+
+        for i, (key, band, num_used, smaller) in enumerate(keys):
+            polygon = buffered[i] if smaller is None else shapely.union(buffered[i], smaller)
+
+            state[key] = (num_used, node_counts[i], hulls[i], polygon)
+            polygons[(key, band)] = polygon
+
+    # Put the bands back in the order they came in
+    index = [(key, band) for key, b in bands.items() for band, _ in b if (key, band) in polygons]
+
+    return gpd.GeoSeries([polygons[k] for k in index], index=index, crs=node_gdf.crs)
+
+
+def nested_node_sets(node_ids: np.ndarray, minutes: np.ndarray, cutoffs: list) -> dict:
+    """
+    - Sort the nodes by travel time once, then take a prefix of the sorted list for every cutoff
+    - Because the sets are prefixes of the same list, each band contains every smaller band
+
+    Arguments:
+        node_ids (np.ndarray): node IDs
+        minutes (np.ndarray): travel time to each node, with NaN for unreachable nodes
+        cutoffs (list): cutoff values, in the same units as `minutes`
+
+    Returns:
+        dict: keyed on cutoff, with the array of node IDs that are at or below that cutoff
+    """
+    reachable = ~np.isnan(minutes)
+    order = np.argsort(minutes[reachable], kind="stable")
+
+    sorted_ids = node_ids[reachable][order]
+    sorted_minutes = minutes[reachable][order]
+
+    ends = np.searchsorted(sorted_minutes, cutoffs, side="right")
+
+    return {cutoff: sorted_ids[:end] for cutoff, end in zip(cutoffs, ends)}
+
+
+def concave_hull_isochrones(
+    node_gdf: gpd.GeoDataFrame,
+    result_df: pd.DataFrame,
+    cutoff_minutes: float | list,
+    ratio: float = 0.99,
+    buffer_meters: float = 45,
+    workers: int = 1,
+) -> gpd.GeoDataFrame:
+    """
+    - Turn node-level accessibility results into one isochrone per POI, for each cutoff
+    - When a list of cutoffs is provided, each POI's nodes are sorted once and every band
+    is a prefix of that sorted list. The hulls are built with `nested_concave_hulls()`,
+    so each band contains the ones inside it.
+
+    Arguments:
+        node_gdf (gpd.GeoDataFrame): network nodes, indexed by node ID
+        result_df (pd.DataFrame): analysis results indexed by node ID, with one `n_1_{poi_uid}` column per POI
+        cutoff_minutes (float | list): the number of minutes to use as threshold/cutoff, or a list of them
+        ratio (float): concave hull ratio, defaults to `0.99`
+        buffer_meters (float): distance to buffer each hull by, defaults to `45`
+        workers (int): number of threads to split the hull geometry work across, defaults to `1`
+
+    Returns:
+        gpd.GeoDataFrame: with a `poi_uid`, `minutes` and `geometry` column
+    """
+
+    cutoffs = sorted(set(np.atleast_1d(cutoff_minutes).tolist()))
+
+    n1_columns = [col for col in result_df.columns if col.startswith("n_1_")]
+
+    minutes = result_df[n1_columns].to_numpy(dtype=float)
+    node_ids = result_df.index.to_numpy()
+
+    node_sets = {
+        col[4:]: nested_node_sets(node_ids, minutes[:, i], cutoffs)
+        for i, col in enumerate(n1_columns)
+    }
+
+    hulls = nested_concave_hulls(node_gdf, node_sets, ratio, buffer_meters, workers)
+
+    return gpd.GeoDataFrame(
+        {
+            "poi_uid": [poi_uid for poi_uid, _ in hulls.index],
+            "minutes": [cutoff for _, cutoff in hulls.index],
+        },
+        geometry=hulls.values,
+        crs=node_gdf.crs,
+    )
+
+
+def _reach_fractions(
+    start_minutes: np.ndarray, end_minutes: np.ndarray, edge_minutes: np.ndarray, cutoff: float
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    - Get the share of each edge that can be reached from its start node and from its end node
+
+    Returns:
+        tuple: two arrays with values between 0 and 1, for the start and end of each edge
+    """
+    with np.errstate(divide="ignore", invalid="ignore"):
+        from_start = np.clip((cutoff - start_minutes) / edge_minutes, 0, 1)
+        from_end = np.clip((cutoff - end_minutes) / edge_minutes, 0, 1)
+
+    # Zero-length edges are all-or-nothing, and unreached nodes come through as NaN
+    zero_length = edge_minutes <= 0
+    from_start[zero_length] = (start_minutes[zero_length] <= cutoff).astype(float)
+    from_end[zero_length] = (end_minutes[zero_length] <= cutoff).astype(float)
+
+    return np.nan_to_num(from_start), np.nan_to_num(from_end)
+
+
+def edge_walksheds(
+    edge_gdf: gpd.GeoDataFrame,
+    result_df: pd.DataFrame,
+    cutoff_minutes: float,
+    buffer_meters: float = 45,
+    workers: int = 1,
+) -> tuple[gpd.GeoDataFrame, gpd.GeoDataFrame]:
+    """
+    - Build line and polygon walksheds for every POI from the network edges themselves
+    - Edges are kept in full when the cutoff covers them, and cut at the cutoff when only part
+    of the edge can be reached from one (or both) of its nodes
+    - The polygon version is a buffer of the line version, so it follows the network instead of
+    stretching across rivers, rail yards, etc. like a concave hull would
+
+    Arguments:
+        edge_gdf (gpd.GeoDataFrame): network edges with `start_id`, `end_id`, and `minutes` columns
+        result_df (pd.DataFrame): analysis results indexed by node ID, with one `n_1_{poi_uid}` column per POI
+        cutoff_minutes (float): the number of minutes to use as threshold/cutoff
+        buffer_meters (float): distance to buffer the walkshed lines by, defaults to `45`
+        workers (int): number of threads to split the buffer geometry work across, defaults to `1`
+
+    Returns:
+        tuple: two geodataframes with `poi_uid` and `geometry` columns, for lines and polygons
+    """
+
+    n1_columns = [col for col in result_df.columns if col.startswith("n_1_")]
+
+    minutes = result_df[n1_columns].to_numpy(dtype=float)
+
+    # Look up the position of every edge's start and end node once,
+    # then read each POI's minutes with array indexing
+    start_pos = result_df.index.get_indexer(edge_gdf["start_id"])
+    end_pos = result_df.index.get_indexer(edge_gdf["end_id"])
+    edge_minutes = edge_gdf["minutes"].to_numpy(dtype=float)
+    geoms = np.asarray(edge_gdf.geometry.values)
+
+    pieces = []
+    group_ids = []
+    keys = []
+
+    for i, col in enumerate(n1_columns):
+        # Nodes missing from the results have a position of -1, which lands on the trailing NaN
+        values = np.append(minutes[:, i], np.nan)
+
+        from_start, from_end = _reach_fractions(
+            values[start_pos], values[end_pos], edge_minutes, cutoff_minutes
+        )
+
+        whole = from_start + from_end >= 1
+        partial = ~whole & ((from_start > 0) | (from_end > 0))
+
+        poi_pieces = list(geoms[whole])
+
+        for idx in np.flatnonzero(partial):
+            if from_start[idx] > 0:
+                poi_pieces.append(substring(geoms[idx], 0, from_start[idx], normalized=True))
+            if from_end[idx] > 0:
+                poi_pieces.append(substring(geoms[idx], 1 - from_end[idx], 1, normalized=True))
+
+        if poi_pieces:
+            pieces += poi_pieces
+            group_ids.append(np.full(len(poi_pieces), len(keys)))
+            keys.append(col[4:])
+
+    if not keys:
+        empty = gpd.GeoDataFrame({"poi_uid": []}, geometry=[], crs=edge_gdf.crs)
+        return empty, empty.copy()
+
+    # Flatten any multipart pieces and collect them into one multilinestring per POI
+    parts, part_idx = shapely.get_parts(np.asarray(pieces), return_index=True)
+    parts_group = np.concatenate(group_ids)[part_idx]
+
+    lines = shapely.multilinestrings(parts, indices=parts_group)
+
+    if workers > 1 and len(keys) > 1:
+        chunks = np.array_split(np.arange(len(keys)), workers)
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            results = executor.map(lambda c: shapely.buffer(lines[c], buffer_meters), chunks)
+            polygons = np.concatenate(list(results))
+    else:
+        polygons = shapely.buffer(lines, buffer_meters)
+
+    line_gdf = gpd.GeoDataFrame({"poi_uid": keys}, geometry=lines, crs=edge_gdf.crs)
+    polygon_gdf = gpd.GeoDataFrame({"poi_uid": keys}, geometry=polygons, crs=edge_gdf.crs)
+
+    return line_gdf, polygon_gdf
@@ -1,14 +1,14 @@
 from __future__ import annotations
 
-from sqlalchemy import create_engine
 import pandas as pd
 import geopandas as gpd
 import pandana as pdna
 from shapely.geometry import LineString
-from geoalchemy2 import Geometry, WKTElement
 
 from pg_data_etl import Database
 
+from network_routing.database.bulk_import import import_geodataframe
+
 
 def qaqc_poi_assignment(
     db: Database,
@@ -51,24 +51,15 @@ def qaqc_poi_assignment(
     poi_node_pairs["flow"] = [
         LineString([row["geom_from"], row["geom_to"]]) for idx, row in poi_node_pairs.iterrows()
     ]
-    poi_node_pairs = poi_node_pairs.set_geometry("flow")
-
-    poi_node_pairs["geom"] = poi_node_pairs["flow"].apply(lambda x: WKTElement(x.wkt, srid=epsg))
-
-    for col in ["flow", "geom_from", "geom_to"]:
-        poi_node_pairs.drop(col, inplace=True, axis=1)
+    poi_node_pairs = gpd.GeoDataFrame(
+        poi_node_pairs.drop(columns=["geom_from", "geom_to"]), geometry="flow", crs=epsg
+    )
 
     sql_tablename = f"qa_{poi_uid_cleaned}"
 
-    engine = create_engine(db.uri)
-    poi_node_pairs.to_sql(
-        sql_tablename,
-        engine,
-        schema="qaqc",
-        if_exists="replace",
-        dtype={"geom": Geometry("LineString", srid=epsg)},
+    import_geodataframe(
+        db, poi_node_pairs, f"qaqc.{sql_tablename}", if_exists="replace", uid_col=None
     )
-    engine.dispose()
 
     return None
 
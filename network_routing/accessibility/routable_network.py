@@ -4,12 +4,17 @@ import pandas as pd
 
 from pg_data_etl import Database
 
+from network_routing.database.bulk_import import import_dataframe, import_geodataframe
+from network_routing.database.indexes import provision_indexes, table_indexes
+
 from .logic_prep import (
     assign_node_ids_to_network,
     add_travel_time_weights_to_network,
     construct_network,
 )
 from .logic_analyze import analyze_single_poi, get_unique_ids
+from .logic_isochrones import concave_hull_isochrones, edge_walksheds
+from .logic_grid import rasterize_results, write_grid
 
 from .logic_qaqc import clean_up_qaqc_tables, qaqc_poi_assignment, delete_all_qaqc_tables
 
@@ -40,6 +45,10 @@ class RoutableNetwork:
         num_pois (int): number of POIs to analyze when provided with groups (i.e. multiple features per ID), defaults to `3`
         poi_match_threshold (int): maximum allowable snapping distance between POI and node layers, defaults to `45`
         edge_table_where_query (str | None): optional extra filter for the edge network, e.g. `groupid in ('tag a', 'tag b')`
+        isochrone_minutes (float | list | None): if provided, isochrones at this cutoff (or nested bands for a list of cutoffs) are built in-memory and saved alongside the results
+        isochrone_workers (int): number of threads to use when building isochrones, defaults to `1`
+        grid_cell_size (float | None): if provided, the least minutes across all POIs are rasterized onto a grid with this cell size and saved to `grid_dir`
+        grid_dir (str): folder to save grid files into, defaults to `./data`
 
     Returns:
         RoutableNetwork: network model
@@ -61,6 +70,10 @@ class RoutableNetwork:
         num_pois: int = 3,
         poi_match_threshold: int = 45,
         edge_table_where_query: str | None = None,
+        isochrone_minutes: float | list | None = None,
+        isochrone_workers: int = 1,
+        grid_cell_size: float | None = None,
+        grid_dir: str = "./data",
     ):
         """
         Capture user input
@@ -91,6 +104,10 @@ class RoutableNetwork:
         self.epsg = epsg
         self.num_pois = num_pois
         self.poi_match_threshold = poi_match_threshold
+        self.isochrone_minutes = isochrone_minutes
+        self.isochrone_workers = isochrone_workers
+        self.grid_cell_size = grid_cell_size
+        self.grid_dir = grid_dir
 
         # Get all unique POI ID values
         self.poi_ids = get_unique_ids(db, poi_table_name, poi_id_column)
@@ -100,16 +117,26 @@ class RoutableNetwork:
         self.edge_gdf = None
         self.node_gdf = None
         self.poi_gdf = None
+        self.result_df = None
 
         # Clean out any old qaqc tables that may exist from before
         delete_all_qaqc_tables(self.db)
 
     def build_network(self):
         """
+        - Make sure the node, edge and POI tables have the indexes the analysis queries use
         - Confirm that necessary columns exist in the edge table. Add them if they don't exist
         - Build network and save to memory
         """
 
+        index_specs = (
+            table_indexes(self.node_table_name, keys=[self.node_id_column])
+            + table_indexes(self.edge_table_name, keys=["start_id", "end_id"])
+            + table_indexes(self.poi_table_name, text_keys=[self.poi_id_column])
+        )
+
+        provision_indexes(self.db, index_specs)
+
         # Lint the edge table to confirm we have the columns we need
         # Run appropriate processes to create the columns if necessary
 
@@ -123,6 +150,10 @@ class RoutableNetwork:
         if "minutes" not in edge_columns:
             add_travel_time_weights_to_network(self.db, self.edge_table_name, self.walking_mph)
 
+        # The start/end IDs only exist now if they were just assigned
+        if "start_id" not in edge_columns:
+            provision_indexes(self.db, index_specs)
+
         # Build the network and save to memory
 
         self.network, self.edge_gdf, self.node_gdf = construct_network(
@@ -197,13 +228,15 @@ class RoutableNetwork:
                 all_results.append(result_df)
 
         # Merge all results into a single dataframe
-        df_all_access_results = pd.concat(all_results, axis=1, sort=False)
+        df_all_access_results = self.store_results(all_results)
 
         # Write tabular result to postgres
-        self.db.import_dataframe(
+        import_dataframe(
+            self.db,
             df_all_access_results,
             f"{self.output_schema}.{self.output_table_name}_table",
-            df_import_kwargs={"if_exists": "replace", "index_label": "node_id"},
+            if_exists="replace",
+            index_label="node_id",
         )
 
         # Generate geospatial version of results using node geometries
@@ -217,9 +250,106 @@ class RoutableNetwork:
         sql_tablename = f"{self.output_schema}.{self.output_table_name}_results"
         self.db.gis_make_geotable_from_query(final_result_query, sql_tablename, "Point", self.epsg)
 
+        # Build isochrones from the in-memory results, if requested
+        if self.isochrone_minutes:
+            isochrone_gdf = self.make_isochrones(self.isochrone_minutes)
+
+            import_geodataframe(
+                self.db,
+                isochrone_gdf,
+                f"{self.output_schema}.{self.output_table_name}_isochrones",
+                if_exists="replace",
+            )
+
+        # Rasterize the in-memory results, if requested
+        if self.grid_cell_size:
+            grid, header = self.make_grid(self.grid_cell_size)
+
+            filepath = write_grid(
+                f"{self.grid_dir}/{self.output_schema}.{self.output_table_name}_grid.npz",
+                grid,
+                header,
+            )
+            print(f"Wrote {header['width']} x {header['height']} grid to {filepath}")
+
         # Clean out QAQC tables by merging into one table in output schema, and delete temp tables
         clean_up_qaqc_tables(self.db, self.output_schema, self.poi_id_column)
 
+    def store_results(self, results: list) -> pd.DataFrame:
+        """
+        - Merge the result of each POI into `self.result_df`, indexed like `self.node_gdf`
+        - `analyze_single_poi()` returns node IDs as strings, so without this cast they
+        would never match the node or edge IDs used by `make_isochrones()`, `make_walksheds()`
+        and `make_grid()`
+
+        Arguments:
+            results (list): of dataframes returned by `compute_single_poi()`
+
+        Returns:
+            pd.DataFrame: the merged results, with the node IDs left as they came in
+        """
+        merged = pd.concat(results, axis=1, sort=False)
+
+        self.result_df = merged.set_axis(merged.index.astype(self.node_gdf.index.dtype))
+
+        return merged
+
+    def make_grid(self, cell_size: float = 100, per_poi: bool = False):
+        """
+        - Rasterize the minutes in `self.result_df` onto a fixed-resolution grid
+        - Uses the node geometries already loaded by `build_network()`
+
+        Arguments:
+            cell_size (float): width and height of each grid cell in meters, defaults to `100`
+            per_poi (bool): flag to keep one band per POI instead of the least minutes across all of them
+
+        Returns:
+            np.ndarray: float32 grid shaped `(bands, rows, cols)`, with NaN for cells without a value
+            dict: grid header
+        """
+
+        return rasterize_results(self.node_gdf, self.result_df, cell_size, per_poi)
+
+    def make_isochrones(self, cutoff_minutes: float | list):
+        """
+        - Build a concave hull isochrone for every POI in `self.result_df`, for each cutoff
+        - Uses the node geometries already loaded by `build_network()`, so no extra database trips are needed
+
+        Arguments:
+            cutoff_minutes (float | list): the number of minutes to use as threshold/cutoff, or a list of them
+
+        Returns:
+            gpd.GeoDataFrame: with a `poi_uid`, `minutes` and `geometry` column
+        """
+
+        return concave_hull_isochrones(
+            self.node_gdf,
+            self.result_df,
+            cutoff_minutes,
+            workers=self.isochrone_workers,
+        )
+
+    def make_walksheds(self, cutoff_minutes: float, buffer_meters: float = 45):
+        """
+        - Build line and polygon walksheds for every POI in `self.result_df`
+        - Uses the edges already loaded by `build_network()`, including partial edges cut at the cutoff
+
+        Arguments:
+            cutoff_minutes (float): the number of minutes to use as threshold/cutoff
+            buffer_meters (float): distance to buffer the walkshed lines by, defaults to `45`
+
+        Returns:
+            tuple: two geodataframes with `poi_uid` and `geometry` columns, for lines and polygons
+        """
+
+        return edge_walksheds(
+            self.edge_gdf,
+            self.result_df,
+            cutoff_minutes,
+            buffer_meters,
+            workers=self.isochrone_workers,
+        )
+
 
 class DoubleNetwork:
     """
@@ -0,0 +1,312 @@
+"""
+bulk_import.py
+--------------
+
+Load dataframes and geodataframes into postgres with `COPY` instead of row-by-row inserts.
+
+These are drop-in replacements for `Database.import_dataframe()`,
+`Database.import_geodataframe()` and `Database.import_gis()`:
+
+- The table is created up front, with a geometry column that has the right type and SRID
+- Rows are streamed through `COPY ... FROM STDIN` as CSV in chunks, with geometries as hex EWKB
+- The `uid` primary key and the spatial index are built after the data is loaded,
+  followed by an `ANALYZE` so the planner knows what's in the new table
+
+Examples:
+    ```python
+    >>> from network_routing.database.bulk_import import import_geodataframe
+    >>> import_geodataframe(db, gdf, "data_viz.my_table", if_exists="replace")
+    ```
+
+"""
+from __future__ import annotations
+
+import io
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import psycopg2
+import shapely
+from pg_data_etl import Database, helpers
+
+
+def _postgres_type(dtype) -> str:
+    """Get the postgres column type to use for a pandas dtype"""
+
+    if pd.api.types.is_bool_dtype(dtype):
+        return "BOOLEAN"
+    if pd.api.types.is_integer_dtype(dtype):
+        return "BIGINT"
+    if pd.api.types.is_float_dtype(dtype):
+        return "DOUBLE PRECISION"
+    if pd.api.types.is_datetime64_any_dtype(dtype):
+        return "TIMESTAMP"
+    return "TEXT"
+
+
+def _array_element(value) -> str:
+    """Format one array element the way postgres prints it, quoting only when needed"""
+
+    if value is None or (isinstance(value, float) and pd.isna(value)):
+        return "NULL"
+
+    if isinstance(value, (list, tuple, np.ndarray)):
+        return array_literal(value)
+
+    text = str(value)
+
+    if text == "" or text.upper() == "NULL" or any(c in text for c in '{}",\\ \t\n'):
+        return '"' + text.replace("\\", "\\\\").replace('"', '\\"') + '"'
+
+    return text
+
+
+def array_literal(values) -> str:
+    """
+    - Turn a list or tuple into postgres array text, i.e. `{residential,trunk_link}`
+    - This matches what the old `to_sql()` import stored for the list-valued osmnx columns
+    """
+    return "{" + ",".join(_array_element(v) for v in values) + "}"
+
+
+def _prepare_columns(
+    df: pd.DataFrame, index: bool, index_label: str | list | None
+) -> pd.DataFrame:
+    """Write the index out as columns (like `DataFrame.to_sql()`) and clean up the column names"""
+
+    if index:
+        if index_label is not None:
+            df.index.names = [index_label] if isinstance(index_label, str) else index_label
+        df = df.reset_index()
+
+    df = helpers.sanitize_df_for_sql(df)
+
+    # COPY would write lists out as Python reprs, i.e. "['residential', 'trunk_link']"
+    for col in df.columns[df.dtypes == object]:
+        is_array = df[col].map(lambda x: isinstance(x, (list, tuple, np.ndarray)))
+        if is_array.any():
+            df.loc[is_array, col] = df.loc[is_array, col].map(array_literal)
+
+    return df
+
+
+def copy_dataframe(
+    db: Database,
+    df: pd.DataFrame,
+    tablename: str,
+    column_types: dict,
+    if_exists: str = "fail",
+    uid_col: str | None = None,
+    chunk_size: int = 100_000,
+) -> None:
+    """
+    - Create a table and stream a dataframe into it with `COPY`, all in one transaction
+    - Every column in `df` must already be in a COPY-able form (i.e. geometries as hex EWKB)
+
+    Arguments:
+        db (Database): analysis database
+        df (pd.DataFrame): data to load
+        tablename (str): name of the new table, with or without a schema
+        column_types (dict): postgres type for each column in `df`
+        if_exists (str): one of `fail`, `replace` or `append`, like `DataFrame.to_sql()`
+        uid_col (str | None): name of a `serial` primary key column to add, if any
+        chunk_size (int): number of rows to send in each `COPY`
+
+    Raises:
+        ValueError: if the table already exists and `if_exists="fail"`
+        psycopg2.errors.DependentObjectsStillExist: if `if_exists="replace"` and
+            a view depends on the table
+    """
+    schema, tbl = helpers.convert_full_tablename_to_parts(tablename)
+    full_tablename = f'"{schema}"."{tbl}"'
+
+    column_list = ", ".join(f'"{col}"' for col in df.columns)
+
+    connection = psycopg2.connect(db.uri)
+
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(f"CREATE SCHEMA IF NOT EXISTS {schema};")
+
+            cursor.execute("SELECT to_regclass(%s) IS NOT NULL", (f"{schema}.{tbl}",))
+            exists = cursor.fetchone()[0]
+
+            if exists and if_exists == "fail":
+                raise ValueError(f"Table {tablename} already exists")
+
+            # No CASCADE, so a table with dependent views fails loudly instead of taking them along
+            if exists and if_exists == "replace":
+                cursor.execute(f"DROP TABLE {full_tablename};")
+
+            if not exists or if_exists == "replace":
+                column_definitions = [f'"{col}" {column_types[col]}' for col in df.columns]
+                if uid_col:
+                    column_definitions.append(f'"{uid_col}" SERIAL')
+
+                cursor.execute(
+                    f"CREATE TABLE {full_tablename} ({', '.join(column_definitions)});"
+                )
+
+            copy_sql = f"""
+                COPY {full_tablename} ({column_list})
+                FROM STDIN WITH (FORMAT csv, NULL '\\N')
+            """
+
+            for start in range(0, len(df), chunk_size):
+                buffer = io.StringIO()
+                df.iloc[start : start + chunk_size].to_csv(
+                    buffer, header=False, index=False, na_rep="\\N"
+                )
+                buffer.seek(0)
+
+                cursor.copy_expert(copy_sql, buffer)
+
+            if uid_col and (not exists or if_exists == "replace"):
+                cursor.execute(f'ALTER TABLE {full_tablename} ADD PRIMARY KEY ("{uid_col}");')
+
+        connection.commit()
+
+    finally:
+        connection.close()
+
+
+def import_dataframe(
+    db: Database,
+    df: pd.DataFrame,
+    tablename: str,
+    if_exists: str = "fail",
+    index: bool = True,
+    index_label: str | list | None = None,
+) -> None:
+    """
+    - Bulk-load a `pandas.DataFrame` into postgres
+
+    Arguments:
+        db (Database): analysis database
+        df (pd.DataFrame): data to load
+        tablename (str): name of the new table, with or without a schema
+        if_exists (str): one of `fail`, `replace` or `append`, like `DataFrame.to_sql()`
+        index (bool): flag to write the index out as columns, like `DataFrame.to_sql()`
+        index_label (str | list | None): column name(s) to use for the index
+
+    Returns:
+        None: but creates a new table in the database
+    """
+    df = _prepare_columns(df.copy(), index, index_label)
+
+    column_types = {col: _postgres_type(dtype) for col, dtype in df.dtypes.items()}
+
+    copy_dataframe(db, df, tablename, column_types, if_exists)
+
+    db.execute(f"ANALYZE {tablename};")
+
+
+def import_geodataframe(
+    db: Database,
+    gdf: gpd.GeoDataFrame,
+    tablename: str,
+    if_exists: str = "fail",
+    uid_col: str | None = "uid",
+    explode: bool = False,
+    index: bool = True,
+    geom_type: str | None = None,
+) -> None:
+    """
+    - Bulk-load a `geopandas.GeoDataFrame` into postgres
+    - The geometry is written to a `geom` column, typed with the geometry type and SRID of the data.
+    A mix of geometry types raises an error, unless `explode=True` is used to split them all
+    into single-part (falling back to `GEOMETRY` if that isn't enough) or `geom_type` is given.
+    - An existing `uid_col` is renamed to `old_{uid_col}`, and a new serial primary key
+    is added, followed by a spatial index on `geom`
+
+    Arguments:
+        db (Database): analysis database
+        gdf (gpd.GeoDataFrame): data to load
+        tablename (str): name of the new table, with or without a schema
+        if_exists (str): one of `fail`, `replace` or `append`, like `DataFrame.to_sql()`
+        uid_col (str | None): name of the primary key column to add, defaults to `uid`.
+            Use None to leave the columns as they are, without a primary key.
+        explode (bool): flag to split multi-part geometries into single-part
+        index (bool): flag to write the index out as columns, like `DataFrame.to_sql()`
+        geom_type (str | None): postgis type for the `geom` column, defaults to the type of the data
+
+    Returns:
+        None: but creates a new table in the database
+
+    Raises:
+        ValueError: if the data has a mix of geometry types, without `explode` or `geom_type`
+    """
+    epsg_code = gdf.crs.to_epsg()
+
+    if explode:
+        gdf = gdf.explode(index_parts=True)
+        gdf["explode"] = gdf.index.to_numpy()
+
+    geometries = gdf.geometry.values
+
+    df = pd.DataFrame(gdf.drop(columns=gdf.geometry.name))
+    df = df.drop(columns=[c for c in ["geom", "geometry", "gid"] if c in df.columns])
+
+    df = _prepare_columns(df, index, None)
+
+    if uid_col and uid_col in df.columns:
+        df = df.rename(columns={uid_col: f"old_{uid_col}"})
+
+    geom_types = [x for x in pd.unique(shapely.get_type_id(geometries)) if x >= 0]
+
+    if geom_type is None and len(geom_types) == 1:
+        geom_type = shapely.GeometryType(geom_types[0]).name
+
+    elif geom_type is None and explode:
+        print(f"Warning! This dataset has {len(geom_types)} geometry types, using GEOMETRY")
+        geom_type = "GEOMETRY"
+
+    elif geom_type is None:
+        found = ", ".join(shapely.GeometryType(x).name for x in geom_types)
+        raise ValueError(
+            f"{tablename} has a mix of geometry types ({found}). "
+            "Use explode=True, or pass geom_type to set the column type explicitly"
+        )
+
+    column_types = {col: _postgres_type(dtype) for col, dtype in df.dtypes.items()}
+
+    df["geom"] = shapely.to_wkb(
+        shapely.set_srid(geometries, epsg_code), hex=True, include_srid=True
+    )
+    column_types["geom"] = f"GEOMETRY({geom_type}, {epsg_code})"
+
+    copy_dataframe(db, df, tablename, column_types, if_exists, uid_col)
+
+    _, tbl = helpers.convert_full_tablename_to_parts(tablename)
+    db.execute(f"CREATE INDEX IF NOT EXISTS {tbl}_geom_idx ON {tablename} USING GIST (geom);")
+
+    db.execute(f"ANALYZE {tablename};")
+
+
+def import_geofile(
+    db: Database,
+    filepath: Path | str,
+    tablename: str,
+    if_exists: str = "fail",
+    explode: bool = False,
+) -> None:
+    """
+    - Read a shapefile or geojson and bulk-load it with `import_geodataframe()`
+    - Rows without a geometry are dropped, like `Database.import_gis()` does
+
+    Arguments:
+        db (Database): analysis database
+        filepath (Path | str): path to any file that `geopandas.read_file()` can open
+        tablename (str): name of the new table, with or without a schema
+        if_exists (str): one of `fail`, `replace` or `append`, like `DataFrame.to_sql()`
+        explode (bool): flag to split multi-part geometries into single-part
+
+    Returns:
+        None: but creates a new table in the database
+    """
+    gdf = gpd.read_file(filepath)
+    gdf = gdf[gdf.geometry.notnull()]
+
+    import_geodataframe(db, gdf, tablename, if_exists=if_exists, explode=explode)
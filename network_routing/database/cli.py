@@ -14,6 +14,11 @@ Examples:
     > db make-nodes-for-edges
     ```
 
+    Or run every secondary patch and node build at once, skipping any whose inputs haven't changed:
+    ```shell
+    > db build-all-secondary --workers 4
+    ```
+
     To see all available commands, run `db --help`
 
     ```shell
@@ -27,33 +32,35 @@ Examples:
     --help  Show this message and exit.
 
     Commands:
+    build-all-secondary   Run every build-secondary patch and node build,...
     build-initial         Roll a brand-new database for with the...
     build-secondary       Update the db as defined by PATCH NUMBER
-    export-geojson        Save a group of .geojson files to be tiled for...
+    export-geojson        Save one or more groups of .geojson files to be...
     export-shapefiles     Export a set of shapefiles identified by EXPORT_NAME
+    export-table          Export TABLENAME to GeoParquet or FlatGeobuf,...
+    make-native-tiles     Render .mbtiles straight from the database with...
     make-nodes-for-edges  Generate topologically-sound nodes for the...
     make-vector-tiles     Turn GeoJSON files into .mbtiles format
+    provision-indexes     Create any missing indexes on TABLENAMES and...
     ```
 """
 
 import click
 
 from network_routing import pg_db_connection, FOLDER_DATA_PRODUCTS
-from network_routing.database.setup.make_nodes import generate_nodes
+from network_routing.database.setup.make_nodes import NODE_TABLES, make_nodes_for_edge_table
+from network_routing.database.indexes import (
+    provision_indexes as _provision_indexes,
+    table_indexes,
+)
 from network_routing.database.export.vector_tiles import (
     make_vector_tiles as _make_vector_tiles,
 )
-from network_routing.database.export.geojson import (
-    export_dock_data,
-    export_gap_webmap_data,
-    export_accessscore_webmap_data,
-    export_county_specific_data,
-    export_septa_data,
-    export_PART_data,
-    export_regional_gap_data,
-    export_rrmp_data,
-)
+from network_routing.database.export.geojson import EXPORT_GROUPS, EXPORT_INDEXES, export_groups
+from network_routing.database.export.binary_formats import export_table as _export_table
+from network_routing.database.export.mbtiles import make_native_tiles as _make_native_tiles
 from network_routing.database.setup.setup_00_initial import setup_00_initial
+from network_routing.database.setup.runner import SETUP_STEPS, run_setup_steps
 
 from network_routing.database.setup.setup_01_initial_accessscore_pois import (
     setup_01_updated_ridescore_inputs,
@@ -84,6 +91,7 @@ from network_routing.database.export.shapefile import (
     export_shapefiles_for_editing,
     export_shapefiles_for_downstream_ridescore,
     export_data_for_single_muni,
+    export_data_for_all_munis,
 )
 from network_routing.database.setup.setup_09_part import (
     setup_09_import_part_data,
@@ -149,88 +157,130 @@ def build_secondary(patch_number):
 
 
 @click.command()
-@click.argument("edge_tablename")
-def make_nodes_for_edges(edge_tablename):
-    """Generate topologically-sound nodes for edge tables"""
+@click.option("--workers", "-w", default=4, help="Number of steps to run at the same time")
+@click.option("--force", is_flag=True, help="Run every step, even if its inputs are unchanged")
+@click.option("--dry-run", is_flag=True, help="Print which steps would run, without running them")
+def build_all_secondary(workers, force, dry_run):
+    """Run every build-secondary patch and node build, in parallel where possible"""
 
-    db = pg_db_connection()
+    print(f"Checking {len(SETUP_STEPS)} setup steps")
 
-    _shared_kwargs = {
-        "geom_type": "Point",
-        "epsg": 26918,
-    }
+    status = run_setup_steps(workers=workers, force=force, dry_run=dry_run)
 
-    table_config = {
-        "osm_edges_all_no_motorway": {
-            "new_table_name": "nodes_for_osm_all",
-            "uid_col": "node_id",
-        },
-        # "osm_edges_drive_no_motorway": {
-        #     "new_table_name": "nodes_for_osm_drive",
-        #     "uid_col": "node_id",
-        # },
-        "pedestriannetwork_lines": {
-            "new_table_name": "nodes_for_sidewalks",
-            "uid_col": "sw_node_id",
-        },
-        "improvements.montgomery_split": {
-            "new_table_name": "improvements.montco_new_nodes",
-            "uid_col": "node_id",
-        },
-        "lowstress_islands": {
-            "new_table_name": "nodes_for_lowstress_islands",
-            "uid_col": "node_id",
-        },
-    }
+    if any(s in ("failed", "blocked") for s in status.values()):
+        raise click.ClickException("One or more setup steps did not finish")
+
+
+@click.command()
+@click.argument("edge_tablename")
+def make_nodes_for_edges(edge_tablename):
+    """Generate topologically-sound nodes for edge tables"""
 
-    if edge_tablename not in table_config:
+    if edge_tablename not in NODE_TABLES:
         print(f"{edge_tablename=} is not a valid option.")
-        print(f"Choices include: {table_config.keys()}")
+        print(f"Choices include: {NODE_TABLES.keys()}")
         return None
 
     print(f"Generating nodes for: {edge_tablename}")
 
-    kwargs = table_config[edge_tablename]
-    kwargs.update(_shared_kwargs)
+    db = pg_db_connection()
 
-    generate_nodes(db, edge_tablename, kwargs)
+    make_nodes_for_edge_table(db, edge_tablename)
 
 
 @click.command()
-@click.argument("data_group_name")
-def export_geojson(data_group_name):
-    """Save a group of .geojson files to be tiled for webmaps"""
-
-    db = pg_db_connection()
+@click.argument("data_group_names", nargs=-1, required=True)
+@click.option(
+    "--workers",
+    "-w",
+    default=4,
+    help="Number of layers to export at the same time",
+)
+@click.option(
+    "--format",
+    "file_format",
+    type=click.Choice(["geojson", "parquet", "fgb"]),
+    default="geojson",
+    help="Write GeoJSON, GeoParquet or FlatGeobuf files",
+)
+def export_geojson(data_group_names, workers, file_format):
+    """Save one or more groups of .geojson files to be tiled for webmaps"""
 
-    exporters = {
-        "accessscore": export_accessscore_webmap_data,
-        "gaps": export_gap_webmap_data,
-        "mcpc": export_county_specific_data,
-        "septa": export_septa_data,
-        "part": export_PART_data,
-        "regional_gaps": export_regional_gap_data,
-        "docks": export_dock_data,
-        "rrmp": export_rrmp_data,
-    }
+    missing = [x for x in data_group_names if x not in EXPORT_GROUPS]
 
-    if data_group_name not in exporters:
-        print(f"GeoJSON export process named '{data_group_name}' does not exist. Options include:")
-        for k in exporters.keys():
+    if missing:
+        print(f"GeoJSON export process named {missing} does not exist. Options include:")
+        for k in EXPORT_GROUPS.keys():
             print(f"\t -> {k}")
 
     else:
-        func = exporters[data_group_name]
-        func(db)
+        db = pg_db_connection()
+        _provision_indexes(
+            db, [x for name in data_group_names for x in EXPORT_INDEXES.get(name, [])]
+        )
+        export_groups(db, list(data_group_names), workers, file_format)
 
 
 @click.command()
 @click.argument("folder")
 @click.argument("filename")
-def make_vector_tiles(folder, filename):
+@click.option(
+    "--workers",
+    "-w",
+    default=4,
+    help="Number of tippecanoe jobs to run at the same time",
+)
+@click.option("--force", is_flag=True, help="Retile every layer, even if it hasn't changed")
+def make_vector_tiles(folder, filename, workers, force):
     """Turn GeoJSON files into .mbtiles format"""
     folder_path = FOLDER_DATA_PRODUCTS / folder
-    _make_vector_tiles(folder_path, filename)
+    results = _make_vector_tiles(folder_path, filename, workers, force)
+
+    if any(result["returncode"] != 0 for result in results.values()):
+        raise click.ClickException("One or more tiling jobs failed")
+
+
+@click.command()
+@click.argument("folder")
+@click.argument("filename")
+@click.option("--minzoom", default=6, help="Lowest zoom level to render")
+@click.option("--maxzoom", default=14, help="Highest zoom level to render")
+@click.option(
+    "--workers",
+    "-w",
+    default=4,
+    help="Number of tile chunks to render at the same time",
+)
+def make_native_tiles(folder, filename, minzoom, maxzoom, workers):
+    """Render .mbtiles straight from the database with ST_AsMVT"""
+    db = pg_db_connection()
+
+    # Only the groups with layers in this folder get tiled
+    group_names = [
+        name
+        for name, group in EXPORT_GROUPS.items()
+        if any(layer["folder"] == folder for layer in group())
+    ]
+    _provision_indexes(db, [x for name in group_names for x in EXPORT_INDEXES.get(name, [])])
+
+    folder_path = FOLDER_DATA_PRODUCTS / folder
+    _make_native_tiles(db, folder_path, filename, minzoom, maxzoom, workers)
+
+
+@click.command()
+@click.argument("tablename")
+@click.argument("folder")
+@click.option(
+    "--format",
+    "file_format",
+    type=click.Choice(["parquet", "fgb"]),
+    default="parquet",
+    help="Write a GeoParquet or FlatGeobuf file",
+)
+def export_table(tablename, folder, file_format):
+    """Export TABLENAME to GeoParquet or FlatGeobuf, keeping full column names"""
+    db = pg_db_connection()
+    _export_table(db, tablename, folder, file_format)
 
 
 @click.command()
@@ -254,23 +304,63 @@ def export_shapefiles(export_name):
 
 
 @click.command()
-@click.argument("muni_name")
-def export_muni_shapefiles(muni_name):
+@click.argument("muni_name", required=False)
+@click.option("--all", "all_munis", is_flag=True, help="Export every municipality at once")
+@click.option(
+    "--workers",
+    "-w",
+    default=4,
+    help="Number of municipalities to write at the same time, when using --all",
+)
+def export_muni_shapefiles(muni_name, all_munis, workers):
     """
-    Export shapefile(s) clipped to a single municipality
+    Export shapefile(s) clipped to a single municipality, or to all of them with --all
     """
 
-    export_data_for_single_muni(muni_name)
+    _provision_indexes(
+        pg_db_connection(),
+        table_indexes("osm_edges_drive") + table_indexes("municipalboundaries", keys=["mun_name"]),
+    )
+
+    if all_munis:
+        export_data_for_all_munis(workers)
+
+    elif muni_name:
+        export_data_for_single_muni(muni_name)
+
+    else:
+        print("Provide a MUNI_NAME, or use --all to export every municipality")
+
+
+@click.command()
+@click.argument("tablenames", nargs=-1, required=True)
+@click.option("--geom", default="geom", help="Geometry column to index, use '' to skip it")
+@click.option("--key", "keys", multiple=True, help="Column to index for lookups by value")
+@click.option("--text-key", "text_keys", multiple=True, help="Column to index as ::text")
+def provision_indexes(tablenames, geom, keys, text_keys):
+    """Create any missing indexes on TABLENAMES and ANALYZE them"""
+
+    db = pg_db_connection()
+
+    specs = []
+    for tablename in tablenames:
+        specs += table_indexes(tablename, geom=geom or None, keys=keys, text_keys=text_keys)
+
+    _provision_indexes(db, specs)
 
 
 _all_commands = [
     build_initial,
     build_secondary,
+    build_all_secondary,
     make_nodes_for_edges,
     export_geojson,
     make_vector_tiles,
+    make_native_tiles,
     export_shapefiles,
+    export_table,
     export_muni_shapefiles,
+    provision_indexes,
 ]
 
 for cmd in _all_commands:
@@ -0,0 +1,302 @@
+"""
+binary_formats.py
+-----------------
+
+Stream SQL queries out to GeoParquet and FlatGeobuf files.
+
+Rows come back from a server-side cursor in chunks and are turned into
+Arrow record batches, so memory use stays flat no matter how wide or long
+the table is. Both formats keep full column names and the source projection.
+
+- GeoParquet files get one row group per chunk and a `bbox` column that's
+  declared as a covering in the `geo` metadata, so readers can skip row groups
+  that fall outside of an area of interest
+- FlatGeobuf files get a packed R-tree spatial index, so readers can pull
+  features for a bounding box without scanning the whole file
+
+"""
+from __future__ import annotations
+
+import json
+from pathlib import Path
+
+import psycopg2
+import pyarrow as pa
+import pyarrow.parquet as pq
+from pyogrio.raw import write_arrow
+from pyproj import CRS
+from pg_data_etl import Database
+
+
+# Postgres type OIDs, mapped to the SQL cast and Arrow type used for each column.
+# Anything else is written out as text.
+INTEGER_TYPES = {20, 21, 23}
+FLOAT_TYPES = {700, 701, 1700}
+BOOLEAN_TYPES = {16}
+
+
+def _column_type(type_code: int) -> tuple:
+    if type_code in INTEGER_TYPES:
+        return "bigint", pa.int64()
+    if type_code in FLOAT_TYPES:
+        return "float8", pa.float64()
+    if type_code in BOOLEAN_TYPES:
+        return "boolean", pa.bool_()
+    return "text", pa.string()
+
+
+def query_record_batches(
+    connection,
+    query: str,
+    geom_col: str = "geom",
+    include_bbox: bool = True,
+    chunk_size: int = 50_000,
+) -> tuple:
+    """
+    - Describe a query and get a generator of Arrow record batches for it
+    - Geometries are written as WKB in a `geometry` column, in the query's own projection
+
+    Arguments:
+        connection: open psycopg2 connection
+        query (str): any SQL query with a geometry column
+        geom_col (str): name of the geometry column in the query
+        include_bbox (bool): flag to add a `bbox` struct column with each feature's extent
+        chunk_size (int): number of rows in each record batch
+
+    Returns:
+        pa.Schema: schema of every batch
+        generator: yields one `pa.RecordBatch` per chunk
+        dict: with the `srid`, overall `bounds` (None if empty) and `geometry_types`
+    """
+
+    with connection.cursor() as cursor:
+        cursor.execute(f"SELECT * FROM ({query}) q LIMIT 0")
+        columns = {
+            c.name: _column_type(c.type_code) for c in cursor.description if c.name != geom_col
+        }
+
+        cursor.execute(
+            f"""
+            SELECT
+                max(ST_SRID(q.{geom_col})),
+                ST_XMin(ST_Extent(q.{geom_col})),
+                ST_YMin(ST_Extent(q.{geom_col})),
+                ST_XMax(ST_Extent(q.{geom_col})),
+                ST_YMax(ST_Extent(q.{geom_col})),
+                array_agg(DISTINCT replace(ST_GeometryType(q.{geom_col}), 'ST_', ''))
+                    FILTER (WHERE q.{geom_col} IS NOT NULL)
+            FROM ({query}) q
+        """
+        )
+        srid, xmin, ymin, xmax, ymax, geometry_types = cursor.fetchone()
+
+    info = {
+        "srid": srid,
+        "bounds": [xmin, ymin, xmax, ymax] if srid is not None else None,
+        "geometry_types": sorted(geometry_types or []),
+    }
+
+    bbox_type = pa.struct([(k, pa.float64()) for k in ("xmin", "ymin", "xmax", "ymax")])
+
+    fields = [pa.field(name, arrow_type) for name, (_, arrow_type) in columns.items()]
+    fields.append(pa.field("geometry", pa.binary()))
+    if include_bbox:
+        fields.append(pa.field("bbox", bbox_type))
+
+    schema = pa.schema(fields)
+
+    select_list = "".join(f'q."{name}"::{cast}, ' for name, (cast, _) in columns.items())
+    select_list += f"ST_AsBinary(q.{geom_col})"
+    if include_bbox:
+        select_list += "".join(
+            f", ST_{k}(q.{geom_col})::float8" for k in ("XMin", "YMin", "XMax", "YMax")
+        )
+
+    def batches():
+        with connection.cursor(name="binary_export") as cursor:
+            cursor.itersize = chunk_size
+            cursor.execute(f"SELECT {select_list} FROM ({query}) q")
+
+            while True:
+                rows = cursor.fetchmany(chunk_size)
+
+                if not rows:
+                    break
+
+                values = list(zip(*rows))
+
+                arrays = [
+                    pa.array(values[idx], type=arrow_type)
+                    for idx, (_, arrow_type) in enumerate(columns.values())
+                ]
+                arrays.append(
+                    pa.array([bytes(x) if x is not None else None for x in values[len(columns)]])
+                )
+
+                if include_bbox:
+                    arrays.append(
+                        pa.StructArray.from_arrays(
+                            [pa.array(v, type=pa.float64()) for v in values[len(columns) + 1 :]],
+                            fields=list(bbox_type),
+                        )
+                    )
+
+                yield pa.RecordBatch.from_arrays(arrays, schema=schema)
+
+        connection.rollback()
+
+    return schema, batches(), info
+
+
+def write_query_to_geoparquet(
+    output_filepath: Path,
+    query: str,
+    db: Database,
+    columns: list | None = None,
+    geom_col: str = "geom",
+    chunk_size: int = 50_000,
+    connection=None,
+) -> Path:
+    """
+    Stream a SQL query out to a GeoParquet file, with one row group per chunk.
+
+    Arguments:
+        output_filepath (Path): path to the .parquet file
+        query (str): any SQL query with a geometry column
+        db (Database): analysis database
+        columns (list | None): attribute columns to keep, defaults to all of them
+        geom_col (str): name of the geometry column in the query
+        chunk_size (int): number of rows in each row group
+        connection: optional open psycopg2 connection to use, which is left open afterwards
+
+    Returns:
+        Path: path to the file that was written
+    """
+    own_connection = connection is None
+    if own_connection:
+        connection = psycopg2.connect(db.uri)
+
+    if columns is not None:
+        query = f"SELECT {', '.join(columns)}, {geom_col} FROM ({query}) subquery"
+
+    try:
+        schema, batches, info = query_record_batches(
+            connection, query, geom_col, include_bbox=True, chunk_size=chunk_size
+        )
+
+        geometry_metadata = {
+            "encoding": "WKB",
+            "geometry_types": info["geometry_types"],
+            "covering": {
+                "bbox": {k: ["bbox", k] for k in ("xmin", "ymin", "xmax", "ymax")},
+            },
+        }
+        if info["srid"] is not None:
+            geometry_metadata["crs"] = CRS.from_epsg(info["srid"]).to_json_dict()
+        if info["bounds"] is not None:
+            geometry_metadata["bbox"] = info["bounds"]
+
+        geo_metadata = {
+            "version": "1.1.0",
+            "primary_column": "geometry",
+            "columns": {"geometry": geometry_metadata},
+        }
+
+        schema = schema.with_metadata({b"geo": json.dumps(geo_metadata).encode()})
+
+        with pq.ParquetWriter(output_filepath, schema, compression="zstd") as writer:
+            for batch in batches:
+                writer.write_batch(batch.replace_schema_metadata(schema.metadata))
+
+    finally:
+        if own_connection:
+            connection.close()
+
+    print(f"\t-> {output_filepath.name}: {output_filepath.stat().st_size / 1e6:.1f} MB written")
+
+    return output_filepath
+
+
+def write_query_to_flatgeobuf(
+    output_filepath: Path,
+    query: str,
+    db: Database,
+    columns: list | None = None,
+    geom_col: str = "geom",
+    chunk_size: int = 50_000,
+    connection=None,
+) -> Path:
+    """
+    Stream a SQL query out to a FlatGeobuf file with a spatial index.
+
+    Arguments:
+        output_filepath (Path): path to the .fgb file
+        query (str): any SQL query with a geometry column
+        db (Database): analysis database
+        columns (list | None): attribute columns to keep, defaults to all of them
+        geom_col (str): name of the geometry column in the query
+        chunk_size (int): number of rows to fetch from the database at a time
+        connection: optional open psycopg2 connection to use, which is left open afterwards
+
+    Returns:
+        Path: path to the file that was written
+    """
+    own_connection = connection is None
+    if own_connection:
+        connection = psycopg2.connect(db.uri)
+
+    if columns is not None:
+        query = f"SELECT {', '.join(columns)}, {geom_col} FROM ({query}) subquery"
+
+    try:
+        schema, batches, info = query_record_batches(
+            connection, query, geom_col, include_bbox=False, chunk_size=chunk_size
+        )
+
+        # FlatGeobuf needs a single geometry type up front, or 'Unknown' for a mix
+        geometry_types = info["geometry_types"]
+        geometry_type = geometry_types[0] if len(geometry_types) == 1 else "Unknown"
+
+        write_arrow(
+            pa.RecordBatchReader.from_batches(schema, batches),
+            output_filepath,
+            driver="FlatGeobuf",
+            geometry_name="geometry",
+            geometry_type=geometry_type,
+            crs=f"EPSG:{info['srid']}" if info["srid"] is not None else None,
+            layer_options={"SPATIAL_INDEX": "YES"},
+        )
+
+    finally:
+        if own_connection:
+            connection.close()
+
+    print(f"\t-> {output_filepath.name}: {output_filepath.stat().st_size / 1e6:.1f} MB written")
+
+    return output_filepath
+
+
+def export_table(db: Database, tablename: str, folder: str, file_format: str = "parquet") -> Path:
+    """
+    Export a whole table, like one of the wide `*_results` tables,
+    to GeoParquet or FlatGeobuf without truncating any column names.
+
+    Arguments:
+        db (Database): analysis database
+        tablename (str): name of the table, with schema
+        folder (str): name of the output folder within the data products folder,
+            or within the active directory if that isn't configured
+        file_format (str): either `parquet` or `fgb`
+
+    Returns:
+        Path: path to the file that was written
+    """
+    # geojson.py imports the writers from this module, so this can't be imported at the top
+    from network_routing.database.export.geojson import geojson_output_path
+
+    filename = tablename.replace(".", "_")
+    output_filepath = geojson_output_path(filename, folder).with_suffix(f".{file_format}")
+
+    writer = write_query_to_geoparquet if file_format == "parquet" else write_query_to_flatgeobuf
+
+    return writer(output_filepath, f"SELECT * FROM {tablename}", db)
@@ -4,6 +4,7 @@ from network_routing import (
     pg_db_connection,
     FOLDER_DATA_PRODUCTS,
 )
+from network_routing.database.bulk_import import import_geodataframe
 
 
 def create_db_for_api():
@@ -67,7 +68,7 @@ def create_db_for_api():
 
         print(f"Importing {new_tablename}")
 
-        new_db.import_geodataframe(gdf, new_tablename)
+        import_geodataframe(new_db, gdf, new_tablename)
 
     # Write the resulting database to .sql dump file
     new_db.dump(FOLDER_DATA_PRODUCTS)
@@ -1,11 +1,24 @@
+from __future__ import annotations
+
+import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
+import geopandas as gpd
+import psycopg2
+from psycopg2.pool import ThreadedConnectionPool
 from pg_data_etl import Database
 from network_routing import FOLDER_DATA_PRODUCTS
+from network_routing.database.export.grid_cells import node_result_cells
+from network_routing.database.indexes import table_indexes
+from network_routing.database.export.binary_formats import (
+    write_query_to_geoparquet,
+    write_query_to_flatgeobuf,
+)
 
 
-def write_query_to_geojson(filename: str, query: str, db: Database, folder: str):
+def geojson_output_path(filename: str, folder: str) -> Path:
     """
-    Write SQL query out to geojson file on disk.
+    Get the path to a geojson file, making sure the folder exists.
     """
 
     # Put into Google Drive, if configured
@@ -20,39 +33,337 @@ def write_query_to_geojson(filename: str, query: str, db: Database, folder: str)
     output_folder.mkdir(exist_ok=True)
 
     # Define path to the file we're about to make
-    output_filepath = output_folder / f"{filename}.geojson"
+    return output_folder / f"{filename}.geojson"
+
+
+# Coordinate precision is in decimal degrees (6 places is ~10cm), and the
+# simplification tolerance is in the units of the source data (meters for EPSG:26918)
+EXPORT_PROFILES = {
+    "full": {"precision": 15, "simplify": None},
+    "points": {"precision": 6, "simplify": None},
+    "lines": {"precision": 6, "simplify": 0.5},
+    "polygons": {"precision": 5, "simplify": 5.0},
+}
+
+
+def write_query_to_geojson(
+    filename: str,
+    query: str,
+    db: Database,
+    folder: str,
+    profile: str = "full",
+    columns: list | None = None,
+    ndjson: bool = False,
+    geom_col: str = "geom",
+    chunk_size: int = 10_000,
+    connection=None,
+    measure_baseline: bool = False,
+) -> Path:
+    """
+    Stream a SQL query out to a geojson file on disk.
+
+    - Reprojection and `ST_AsGeoJSON` both happen in SQL, and rows come back
+    through a server-side cursor in chunks, so memory use doesn't grow with the layer size
+    - The export `profile` sets the coordinate precision and simplification tolerance, and
+    `columns` limits the attributes that get written. Both are applied in SQL.
+    - The size of a full-precision, all-column version of the features in the first chunk
+    is measured in the same pass, and scaled up to estimate how many bytes the profile saved.
+    `measure_baseline=True` measures every feature instead, which roughly doubles the cost.
+    - With `ndjson=True` the file has one feature per line and no surrounding
+    FeatureCollection, which lets tippecanoe read it in parallel
+
+    Arguments:
+        filename (str): name of the output file, without the extension
+        query (str): any SQL query with a geometry column
+        db (Database): analysis database
+        folder (str): name of the output folder
+        profile (str): name of the profile in `EXPORT_PROFILES` to use, defaults to `full`
+        columns (list | None): attribute columns to keep, defaults to all of them
+        ndjson (bool): flag to write newline-delimited features
+        geom_col (str): name of the geometry column in the query
+        chunk_size (int): number of features to fetch from the database at a time
+        connection: optional open psycopg2 connection to use, which is left open afterwards
+        measure_baseline (bool): flag to measure the baseline size of every feature
+
+    Returns:
+        Path: path to the file that was written
+    """
+
+    output_filepath = geojson_output_path(filename, folder)
+
+    settings = EXPORT_PROFILES[profile]
+
+    own_connection = connection is None
+    if own_connection:
+        connection = psycopg2.connect(db.uri)
+
+    try:
+        # Get the query's column names without running it
+        with connection.cursor() as cursor:
+            cursor.execute(f"SELECT * FROM ({query}) q LIMIT 0")
+            all_columns = [c.name for c in cursor.description if c.name != geom_col]
+
+        keep_columns = [c for c in all_columns if columns is None or c in columns]
+
+        def select_list(cols: list, geom_expr: str) -> str:
+            return "".join(f'q."{c}", ' for c in cols) + f"{geom_expr} AS {geom_col}"
+
+        geom = f"q.{geom_col}"
+        if settings["simplify"]:
+            geom = f"ST_SimplifyPreserveTopology({geom}, {settings['simplify']})"
+
+        baseline_length = f"length(ST_AsGeoJSON(baseline.*, '{geom_col}', 15))"
+        if not measure_baseline:
+            # Only the first chunk is measured, so the other rows skip the extra transform
+            baseline_length = f"""
+                CASE WHEN row_number() OVER () <= {chunk_size} THEN {baseline_length} END
+            """
+
+        feature_query = f"""
+            SELECT
+                ST_AsGeoJSON(t.*, '{geom_col}', {settings["precision"]}),
+                {baseline_length}
+            FROM ({query}) q
+            CROSS JOIN LATERAL (
+                SELECT {select_list(keep_columns, f"st_transform({geom}, 4326)")}
+            ) t
+            CROSS JOIN LATERAL (
+                SELECT {select_list(all_columns, f"st_transform(q.{geom_col}, 4326)")}
+            ) baseline
+        """
+
+        baseline_bytes = 0
+        num_measured = 0
+        num_features = 0
+
+        with connection.cursor(name="geojson_export") as cursor:
+            cursor.itersize = chunk_size
+            cursor.execute(feature_query)
+
+            with open(output_filepath, "w") as f:
+                if not ndjson:
+                    f.write('{"type": "FeatureCollection", "features": [\n')
+
+                separator = "\n" if ndjson else ",\n"
+                first_chunk = True
+
+                while True:
+                    rows = cursor.fetchmany(chunk_size)
+
+                    if not rows:
+                        break
+
+                    if not first_chunk:
+                        f.write(separator)
+
+                    f.write(separator.join(row[0] for row in rows))
+                    measured = [row[1] for row in rows if row[1] is not None]
+                    baseline_bytes += sum(measured) + len(separator) * len(measured)
+                    num_measured += len(measured)
+                    num_features += len(rows)
+                    first_chunk = False
+
+                f.write("\n" if ndjson else "\n]}\n")
+
+    finally:
+        if own_connection:
+            connection.close()
+        else:
+            # Close out the server-side cursor's transaction before the connection is reused
+            connection.rollback()
+
+    if num_measured and num_measured < num_features:
+        baseline_bytes = round(baseline_bytes / num_measured * num_features)
+
+    written_bytes = output_filepath.stat().st_size
+    saved_bytes = max(baseline_bytes - written_bytes, 0)
+    pct_saved = round(saved_bytes / baseline_bytes * 100, 1) if baseline_bytes else 0
+
+    print(
+        f"\t-> {filename}.geojson: {written_bytes / 1e6:.1f} MB written, "
+        f"{'' if num_measured == num_features else '~'}"
+        f"{saved_bytes / 1e6:.1f} MB ({pct_saved}%) saved with the '{profile}' profile"
+    )
+
+    return output_filepath
+
+
+def write_gdf_to_geojson(
+    filename: str, gdf: gpd.GeoDataFrame, folder: str, profile: str = "full"
+):
+    """
+    Write an in-memory geodataframe out to geojson file on disk,
+    using the coordinate precision from the export `profile`.
+    """
 
-    # Extract geodataframe from SQL
-    gdf = db.gdf(query)
+    output_filepath = geojson_output_path(filename, folder)
+
+    settings = EXPORT_PROFILES[profile]
+
+    if settings["simplify"]:
+        gdf = gdf.copy()
+        gdf.geometry = gdf.geometry.simplify(settings["simplify"])
 
     # Ensure it's in the proper projection
     gdf = gdf.to_crs("EPSG:4326")
 
     # Save to file
-    gdf.to_file(output_filepath, driver="GeoJSON")
+    gdf.to_file(
+        output_filepath, driver="GeoJSON", COORDINATE_PRECISION=settings["precision"]
+    )
 
 
-def export_rrmp_data(db: Database):
-    write_query_to_geojson(
-        "station_points", "select * from regional_rail_master_plan_pois", db, "rrmp"
-    )
-    write_query_to_geojson("isochrones", "select * from data_viz.rrmp_isochrones", db, "rrmp")
+BINARY_WRITERS = {
+    "parquet": write_query_to_geoparquet,
+    "fgb": write_query_to_flatgeobuf,
+}
 
 
-def export_gap_webmap_data(db: Database):
+def export_layers(
+    db: Database, layers: list, workers: int = 1, file_format: str = "geojson"
+) -> dict:
     """
-    Export six geojson files:
+    Write a list of layers out to geojson, GeoParquet or FlatGeobuf, several at a time.
+
+    - Each layer is a dict with `filename` and `folder`, along with either a `query` and any
+    extra keyword arguments for `write_query_to_geojson()`, or a `writer` function that
+    takes the database and file format and writes the layer on its own
+    - A `writer` layer can also have a `frames` function that takes the database and returns
+    the geodataframes it writes, keyed on filename, so `make_native_tiles()` can tile them too
+    - GeoParquet and FlatGeobuf files keep the source projection and full precision,
+    so only the `columns` setting is used for them
+    - Query layers share a pool of `workers` database connections, one per worker thread
+    - A summary of how long each layer took is printed at the end
+
+    Arguments:
+        db (Database): analysis database
+        layers (list): layer definitions, like the ones from `EXPORT_GROUPS`
+        workers (int): number of layers to write at the same time
+        file_format (str): one of `geojson`, `parquet` or `fgb`
+
+    Returns:
+        dict: number of seconds each layer took, keyed on `folder/filename`
+    """
+
+    connection_pool = ThreadedConnectionPool(1, workers, db.uri)
+
+    def export_layer(layer: dict) -> float:
+        layer = dict(layer)
+        filename, folder = layer.pop("filename"), layer.pop("folder")
+
+        print(f"Exporting {folder}/{filename}")
+
+        start_time = time.perf_counter()
+
+        if "writer" in layer:
+            layer["writer"](db, file_format)
+
+        else:
+            connection = connection_pool.getconn()
+            try:
+                if file_format == "geojson":
+                    write_query_to_geojson(
+                        filename, layer.pop("query"), db, folder, connection=connection, **layer
+                    )
+                else:
+                    writer = BINARY_WRITERS[file_format]
+                    writer(
+                        geojson_output_path(filename, folder).with_suffix(f".{file_format}"),
+                        layer["query"],
+                        db,
+                        columns=layer.get("columns"),
+                        connection=connection,
+                    )
+            finally:
+                connection_pool.putconn(connection)
+
+        return time.perf_counter() - start_time
+
+    start_time = time.perf_counter()
+
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            seconds = executor.map(export_layer, layers)
+            timings = {
+                f"{layer['folder']}/{layer['filename']}": x for layer, x in zip(layers, seconds)
+            }
+    finally:
+        connection_pool.closeall()
+
+    print(f"Exported {len(timings)} layers in {time.perf_counter() - start_time:.1f} seconds:")
+    for name, x in sorted(timings.items(), key=lambda item: -item[1]):
+        print(f"\t-> {x:8.1f}s  {name}")
+
+    return timings
+
+
+def rrmp_layers() -> list:
+    """
+    Layers for the regional rail master plan:
+    - station points
+    - isochrones
+    """
+    return [
+        {
+            "filename": "station_points",
+            "folder": "rrmp",
+            "query": "select * from regional_rail_master_plan_pois",
+            "profile": "points",
+        },
+        {
+            "filename": "isochrones",
+            "folder": "rrmp",
+            "query": "select * from data_viz.rrmp_isochrones",
+            "profile": "polygons",
+            "columns": ["poi_uid", "schema", "miles"],
+        },
+    ]
+
+
+def transit_hex_frames(db: Database) -> dict:
+    """
+    Transit accessibility results, using the LEAST of the n_1_* columns for each node
+    and summarized into hexagons instead of shipping one point per node
+
+    Returns:
+        dict: a geodataframe of cells for each size, keyed on its filename (`sw_nodes_hex_{size}m`)
+    """
+    hex_layers = node_result_cells(db, "sw_defaults.regional_transit_stops_results")
+
+    return {f"sw_nodes_hex_{size}m": gdf for size, gdf in hex_layers.items()}
+
+
+def write_transit_hex_layers(db: Database, file_format: str = "geojson") -> None:
+    """
+    Write each of the `transit_hex_frames()` out to the `gaps` folder
+    """
+    for filename, gdf in transit_hex_frames(db).items():
+        if file_format == "geojson":
+            write_gdf_to_geojson(filename, gdf, "gaps", profile="polygons")
+
+        elif file_format == "parquet":
+            gdf.to_parquet(geojson_output_path(filename, "gaps").with_suffix(".parquet"))
+
+        else:
+            gdf.to_file(
+                geojson_output_path(filename, "gaps").with_suffix(".fgb"), driver="FlatGeobuf"
+            )
+
+
+def gap_webmap_layers() -> list:
+    """
+    Layers for the gap webmap:
         - centerlines
-        - sw_nodes with transit results
+        - transit results of the sidewalk nodes, summarized into
+          hex cells at a few sizes (`sw_nodes_hex_{size}m`)
         - transit_stops
         - islands of connectivity
-        - eta schools
-        - sidewalk nodes with transit results
+        - eta schools and school results
     """
 
     # Centerlines with sidewalk amounts, as a ratio
     query_centerlines = """
-        select hwy_tag, sidewalk / st_length(o.geom) / 2 as sw_ratio, st_transform(o.geom, 4326) as geom
+        select hwy_tag, sidewalk / st_length(o.geom) / 2 as sw_ratio, o.geom
         from public.osm_edges_drive o
         inner join regional_counties c
         on st_within(o.geom, c.geom)
@@ -60,32 +371,16 @@ def export_gap_webmap_data(db: Database):
         and o.analyze_sw = 1
     """
 
-    write_query_to_geojson("osm_sw_coverage", query_centerlines, db, "gaps")
-
-    # Transit accessibility results
-    gdf_sample = db.gdf(f"SELECT * FROM sw_defaults.regional_transit_stops_results LIMIT 1")
-
-    # Make a list of all columns that have 'n_1_' in their name
-    cols_to_query = [col for col in gdf_sample.columns if "n_1_" in col]
-
-    # Build a dynamic SQL query, getting the LEAST of the n_1_* columns
-    query_base_results = "SELECT geom, LEAST(" + ", ".join(cols_to_query)
-    query_base_results += f") as walk_time FROM sw_defaults.regional_transit_stops_results"
-
-    write_query_to_geojson("sw_nodes", query_base_results, db, "gaps")
-
     # Transit stops
     query_transit_stops = """
         select * from regional_transit_with_accessscore
     """
-    write_query_to_geojson("transit_stops", query_transit_stops, db, "gaps")
 
     # Islands of connectivity
     query_islands = """
-        SELECT uid, size_miles, muni_names, muni_count, rgba, st_transform(geom, 4326) as geom
+        SELECT uid, size_miles, muni_names, muni_count, rgba, geom
         FROM data_viz.islands
     """
-    write_query_to_geojson("islands", query_islands, db, "gaps")
 
     # ETA Schools
     school_points = """
@@ -94,35 +389,61 @@ def export_gap_webmap_data(db: Database):
     school_results = """
         select * from eta_schools.school_results
     """
-    write_query_to_geojson("school_points", school_points, db, "gaps")
-    write_query_to_geojson("school_results", school_results, db, "gaps")
+
+    layers = [
+        {
+            "filename": "osm_sw_coverage",
+            "query": query_centerlines,
+            "profile": "lines",
+            "ndjson": True,
+        },
+        {
+            "filename": "sw_nodes_hex",
+            "writer": write_transit_hex_layers,
+            "frames": transit_hex_frames,
+        },
+        {"filename": "transit_stops", "query": query_transit_stops, "profile": "points"},
+        {"filename": "islands", "query": query_islands, "profile": "lines"},
+        {"filename": "school_points", "query": school_points, "profile": "points"},
+        {"filename": "school_results", "query": school_results, "profile": "points"},
+    ]
+
+    return [dict(layer, folder="gaps") for layer in layers]
 
 
-def export_accessscore_webmap_data(db: Database):
+def accessscore_webmap_layers() -> list:
     """
-    Export data for the ridescore analysis
+    Layers for the ridescore analysis
     - isochrones
     - single-point "sidewalkscore" for each station
     - multi-point access inputs (multiple points per station)
     """
 
-    tables_to_export = [
-        "data_viz.accessscore_results",
-        "data_viz.accessscore_points",
-        "public.access_score_final_poi_set",
-    ]
-
-    for tbl in tables_to_export:
-        query = f"SELECT * FROM {tbl}"
+    tables_to_export = {
+        "data_viz.accessscore_results": "polygons",
+        "data_viz.accessscore_points": "points",
+        "public.access_score_final_poi_set": "points",
+    }
 
+    layers = []
+    for tbl, profile in tables_to_export.items():
         schema, tablename = tbl.split(".")
 
-        write_query_to_geojson(tablename, query, db, "gaps")
+        layers.append(
+            {
+                "filename": tablename,
+                "folder": "gaps",
+                "query": f"SELECT * FROM {tbl}",
+                "profile": profile,
+            }
+        )
+
+    return layers
 
 
-def export_county_specific_data(db: Database):
+def county_specific_layers() -> list:
     """
-    Export data for the MCPC-specific visualization:
+    Layers for the MCPC-specific visualization:
 
     - ETA points with county name as text
     - Isochrones for all montco ETA points TODO
@@ -163,22 +484,23 @@ def export_county_specific_data(db: Database):
         select * from improvements.montgomery_split
     """
 
-    queries = {
-        "pois_full": mcpc_combined_pois_full,
-        "pois_centroids": mcpc_combined_pois_centroids,
-        "mcpc_isos": eta_isos,
-        "montco_missing_sidewalks": montco_missing_sidewalks,
-    }
-
-    for filename, query in queries.items():
-        print(filename, query)
+    layers = [
+        {"filename": "pois_full", "query": mcpc_combined_pois_full, "profile": "points"},
+        {"filename": "pois_centroids", "query": mcpc_combined_pois_centroids, "profile": "points"},
+        {"filename": "mcpc_isos", "query": eta_isos, "profile": "polygons"},
+        {
+            "filename": "montco_missing_sidewalks",
+            "query": montco_missing_sidewalks,
+            "profile": "lines",
+        },
+    ]
 
-        write_query_to_geojson(filename, query, db, "mcpc")
+    return [dict(layer, folder="mcpc") for layer in layers]
 
 
-def export_septa_data(db: Database):
+def septa_layers() -> list:
     """
-    Export data for SEPTA
+    Layers for SEPTA
     """
 
     pois = """
@@ -190,20 +512,17 @@ def export_septa_data(db: Database):
         from data_viz.isochrones_pois_for_septa_tod_analysis
     """
 
-    queries = {
-        "septa_stops": pois,
-        "walksheds": isos,
-    }
-
-    for filename, query in queries.items():
-        print(filename, query)
+    layers = [
+        {"filename": "septa_stops", "query": pois, "profile": "points"},
+        {"filename": "walksheds", "query": isos, "profile": "polygons"},
+    ]
 
-        write_query_to_geojson(filename, query, db, "septa")
+    return [dict(layer, folder="septa") for layer in layers]
 
 
-def export_PART_data(db: Database):
+def PART_layers() -> list:
     """
-    Export data for PART
+    Layers for PART
     """
 
     pois = """
@@ -219,17 +538,19 @@ def export_PART_data(db: Database):
         select * from part_osm.pois_results
     """
 
-    queries = {"pois": pois, "walksheds": isos, "raw_sw": raw_sw, "raw_osm": raw_osm}
-
-    for filename, query in queries.items():
-        print(filename, query)
+    layers = [
+        {"filename": "pois", "query": pois, "profile": "points"},
+        {"filename": "walksheds", "query": isos, "profile": "polygons"},
+        {"filename": "raw_sw", "query": raw_sw, "profile": "points"},
+        {"filename": "raw_osm", "query": raw_osm, "profile": "points"},
+    ]
 
-        write_query_to_geojson(filename, query, db, "PART")
+    return [dict(layer, folder="PART") for layer in layers]
 
 
-def export_dock_data(db: Database):
+def dock_layers() -> list:
     """
-    Export data for NJ docks
+    Layers for NJ docks
     """
     isos = """
         select * from data_viz.dock_isos
@@ -241,19 +562,19 @@ def export_dock_data(db: Database):
         select * from docks_osm.docks_open_street_results
     """
 
-    queries = {"walksheds": isos, "raw_sw": raw_sw, "raw_osm": raw_osm}
-
-    for filename, query in queries.items():
-        print(filename, query)
+    layers = [
+        {"filename": "walksheds", "query": isos, "profile": "polygons"},
+        {"filename": "raw_sw", "query": raw_sw, "profile": "points"},
+        {"filename": "raw_osm", "query": raw_osm, "profile": "points"},
+    ]
 
-        write_query_to_geojson(filename, query, db, "Dock")
+    return [dict(layer, folder="Dock") for layer in layers]
 
 
-def export_regional_gap_data(db: Database):
+def regional_gap_layers() -> list:
     """
-    Export data showing all gaps across the region
+    Layers showing all gaps across the region
     """
-    filename = "regional_sidewalk_gaps"
     query = """
         with all_gaps as (
                   select geom from improvements.gloucester_erased
@@ -272,7 +593,85 @@ def export_regional_gap_data(db: Database):
         from all_gaps
     """
 
-    write_query_to_geojson(filename, query, db, "regional_gaps")
+    return [
+        {
+            "filename": "regional_sidewalk_gaps",
+            "folder": "regional_gaps",
+            "query": query,
+            "profile": "lines",
+        }
+    ]
+
+
+EXPORT_GROUPS = {
+    "accessscore": accessscore_webmap_layers,
+    "gaps": gap_webmap_layers,
+    "mcpc": county_specific_layers,
+    "septa": septa_layers,
+    "part": PART_layers,
+    "regional_gaps": regional_gap_layers,
+    "docks": dock_layers,
+    "rrmp": rrmp_layers,
+}
+
+# Indexes that the layer queries in each group rely on. The other groups
+# read whole tables, so an index wouldn't change their plans.
+EXPORT_INDEXES = {
+    "gaps": table_indexes("osm_edges_drive") + table_indexes("regional_counties"),
+}
+
+
+def export_groups(
+    db: Database, group_names: list, workers: int = 1, file_format: str = "geojson"
+) -> dict:
+    """
+    Export every layer from one or more groups in `EXPORT_GROUPS` on a single worker pool,
+    so a group takes about as long as its slowest layer instead of the sum of all of them.
+
+    Arguments:
+        db (Database): analysis database
+        group_names (list): names of groups in `EXPORT_GROUPS`
+        workers (int): number of layers to write at the same time
+        file_format (str): one of `geojson`, `parquet` or `fgb`
+
+    Returns:
+        dict: number of seconds each layer took, keyed on `folder/filename`
+    """
+    layers = [layer for name in group_names for layer in EXPORT_GROUPS[name]()]
+
+    return export_layers(db, layers, workers, file_format)
+
+
+def export_rrmp_data(db: Database, workers: int = 1):
+    return export_groups(db, ["rrmp"], workers)
+
+
+def export_gap_webmap_data(db: Database, workers: int = 1):
+    return export_groups(db, ["gaps"], workers)
+
+
+def export_accessscore_webmap_data(db: Database, workers: int = 1):
+    return export_groups(db, ["accessscore"], workers)
+
+
+def export_county_specific_data(db: Database, workers: int = 1):
+    return export_groups(db, ["mcpc"], workers)
+
+
+def export_septa_data(db: Database, workers: int = 1):
+    return export_groups(db, ["septa"], workers)
+
+
+def export_PART_data(db: Database, workers: int = 1):
+    return export_groups(db, ["part"], workers)
+
+
+def export_dock_data(db: Database, workers: int = 1):
+    return export_groups(db, ["docks"], workers)
+
+
+def export_regional_gap_data(db: Database, workers: int = 1):
+    return export_groups(db, ["regional_gaps"], workers)
 
 
 if __name__ == "__main__":
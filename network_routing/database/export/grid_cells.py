@@ -0,0 +1,195 @@
+"""
+grid_cells.py
+-------------
+
+Aggregate node-level accessibility results into regular hexagon or square cells,
+so web maps can show a few thousand polygons instead of millions of node points.
+
+"""
+from __future__ import annotations
+
+import numpy as np
+import geopandas as gpd
+import shapely
+
+from pg_data_etl import Database
+
+
+SQRT_3 = np.sqrt(3)
+
+
+def hex_cell_ids(x: np.ndarray, y: np.ndarray, size: float) -> np.ndarray:
+    """
+    - Get the axial `(q, r)` coordinates of the pointy-top hexagon that holds each point
+
+    Arguments:
+        x (np.ndarray): x coordinate of each point
+        y (np.ndarray): y coordinate of each point
+        size (float): distance from the center of each hexagon to its corners
+
+    Returns:
+        np.ndarray: integer array shaped `(n, 2)`
+    """
+    q = (SQRT_3 / 3 * x - y / 3) / size
+    r = (2 / 3 * y) / size
+
+    # Round in cube coordinates, then fix whichever axis moved the most
+    cube = np.column_stack([q, -q - r, r])
+    rounded = np.round(cube)
+    diff = np.abs(rounded - cube)
+
+    worst = np.argmax(diff, axis=1)
+    rows = np.arange(len(cube))
+    rounded[rows, worst] = 0
+    rounded[rows, worst] = -rounded.sum(axis=1)
+
+    return rounded[:, [0, 2]].astype(np.int64)
+
+
+def square_cell_ids(x: np.ndarray, y: np.ndarray, size: float) -> np.ndarray:
+    """
+    - Get the `(column, row)` of the square cell that holds each point
+
+    Arguments:
+        x (np.ndarray): x coordinate of each point
+        y (np.ndarray): y coordinate of each point
+        size (float): width of each square
+
+    Returns:
+        np.ndarray: integer array shaped `(n, 2)`
+    """
+    return np.column_stack([np.floor(x / size), np.floor(y / size)]).astype(np.int64)
+
+
+def cell_polygons(cell_ids: np.ndarray, size: float, kind: str = "hex") -> np.ndarray:
+    """
+    - Build the polygon for each cell
+
+    Arguments:
+        cell_ids (np.ndarray): output from `hex_cell_ids()` or `square_cell_ids()`
+        size (float): the same size used to make `cell_ids`
+        kind (str): either `hex` or `square`
+
+    Returns:
+        np.ndarray: shapely polygons
+    """
+    a = cell_ids[:, 0].astype(float)
+    b = cell_ids[:, 1].astype(float)
+
+    if kind == "hex":
+        cx = size * SQRT_3 * (a + b / 2)
+        cy = size * 1.5 * b
+
+        angles = np.radians(30 + 60 * np.arange(7))
+        xs = cx[:, None] + size * np.cos(angles)[None, :]
+        ys = cy[:, None] + size * np.sin(angles)[None, :]
+
+    else:
+        corners_x = np.array([0, 1, 1, 0, 0])
+        corners_y = np.array([0, 0, 1, 1, 0])
+        xs = (a[:, None] + corners_x[None, :]) * size
+        ys = (b[:, None] + corners_y[None, :]) * size
+
+    return shapely.polygons(np.stack([xs, ys], axis=-1))
+
+
+def aggregate_cells(
+    x: np.ndarray,
+    y: np.ndarray,
+    minutes: np.ndarray,
+    size: float,
+    kind: str = "hex",
+    percentiles: tuple = (85,),
+    crs=None,
+) -> gpd.GeoDataFrame:
+    """
+    - Bin points into cells and summarize the minutes within each one
+    - Values are sorted once by cell and then by minutes, so every statistic
+    is a lookup into that sorted array
+
+    Arguments:
+        x (np.ndarray): x coordinate of each point
+        y (np.ndarray): y coordinate of each point
+        minutes (np.ndarray): travel time for each point, NaN values are skipped
+        size (float): hexagon radius or square width, in the units of the coordinates
+        kind (str): either `hex` or `square`
+        percentiles (tuple): extra percentiles to calculate, defaults to `(85,)`
+        crs: projection of the coordinates
+
+    Returns:
+        gpd.GeoDataFrame: one polygon per cell with a node count, `walk_time` (the minimum),
+        median and percentile minutes
+    """
+    if kind not in ("hex", "square"):
+        raise ValueError(f"{kind=} must be 'hex' or 'square'")
+
+    has_value = ~np.isnan(minutes)
+    x, y, minutes = x[has_value], y[has_value], minutes[has_value]
+
+    ids = hex_cell_ids(x, y, size) if kind == "hex" else square_cell_ids(x, y, size)
+
+    cells, inverse, counts = np.unique(ids, axis=0, return_inverse=True, return_counts=True)
+    inverse = inverse.reshape(-1)
+
+    order = np.lexsort((minutes, inverse))
+    sorted_minutes = minutes[order]
+    starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+
+    def percentile(pct: float) -> np.ndarray:
+        # Linear interpolation between the closest ranks, like np.percentile()
+        position = starts + pct / 100 * (counts - 1)
+        low = np.floor(position).astype(np.int64)
+        high = np.ceil(position).astype(np.int64)
+        fraction = position - low
+        return sorted_minutes[low] + (sorted_minutes[high] - sorted_minutes[low]) * fraction
+
+    data = {
+        "node_count": counts,
+        "walk_time": sorted_minutes[starts],
+        "median_minutes": percentile(50),
+    }
+    for pct in percentiles:
+        data[f"p{pct}_minutes"] = percentile(pct)
+
+    return gpd.GeoDataFrame(data, geometry=cell_polygons(cells, size, kind), crs=crs)
+
+
+def node_result_cells(
+    db: Database,
+    result_table: str,
+    sizes: tuple = (100, 250, 500),
+    kind: str = "hex",
+    percentiles: tuple = (85,),
+) -> dict:
+    """
+    - Summarize a node-level result table into cells at several resolutions
+    - The node minutes are the least value across every `n_1_*` column, and the table is only read once
+
+    Arguments:
+        db (Database): analysis database
+        result_table (str): name of the node-level result table
+        sizes (tuple): cell sizes to make, in meters
+        kind (str): either `hex` or `square`
+        percentiles (tuple): extra percentiles to calculate, defaults to `(85,)`
+
+    Returns:
+        dict: keyed on size, with a geodataframe of cells for each one
+    """
+    n1_columns = [x for x in db.columns(result_table) if x.startswith("n_1_")]
+
+    query = f"""
+        SELECT st_x(geom) AS x, st_y(geom) AS y, LEAST({", ".join(n1_columns)}) AS walk_time
+        FROM {result_table}
+        WHERE LEAST({", ".join(n1_columns)}) IS NOT NULL
+    """
+    df = db.df(query)
+
+    crs = f"EPSG:{db.projection(result_table)}"
+
+    x = df["x"].to_numpy(dtype=float)
+    y = df["y"].to_numpy(dtype=float)
+    minutes = df["walk_time"].to_numpy(dtype=float)
+
+    return {
+        size: aggregate_cells(x, y, minutes, size, kind, percentiles, crs) for size in sizes
+    }
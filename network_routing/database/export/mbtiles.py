@@ -0,0 +1,475 @@
+"""
+mbtiles.py
+----------
+
+Render vector tiles straight from PostGIS with `ST_AsMVT` and write them into
+an MBTiles (SQLite) file, without a GeoJSON round-trip or `tippecanoe`.
+
+Layers come from the same definitions that the geojson export uses
+(see `EXPORT_GROUPS`), so every query layer in a folder ends up as a layer in the tileset.
+Layers made by a `writer` function are included when they also have a `frames` function.
+
+Each layer's query is run once into an unlogged table in a scratch schema, already in
+web mercator and with a spatial index, so a slow query isn't re-run for every tile.
+The geodataframes from a `frames` function are loaded into the same schema with `COPY`.
+The scratch schema is dropped when the tileset is done.
+
+Tiles are rendered in chunks on a pool of worker threads, each with its own
+database connection, while the main thread writes the finished tiles into SQLite.
+Empty tiles are skipped, and identical tiles (like open water or solid polygon
+interiors) are only stored once using the `map`/`images` MBTiles layout.
+
+"""
+from __future__ import annotations
+
+import gzip
+import json
+import hashlib
+import math
+import os
+import re
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+
+import psycopg2
+from psycopg2.pool import ThreadedConnectionPool
+from pg_data_etl import Database
+
+from network_routing.database.bulk_import import import_geodataframe
+from network_routing.database.export.geojson import EXPORT_GROUPS
+
+
+EXTENT = 4096
+BUFFER = 64
+
+# Postgres type OIDs for numbers and booleans. Everything else is described as a string.
+NUMBER_TYPES = {20, 21, 23, 700, 701, 1700}
+BOOLEAN_TYPES = {16}
+
+
+def lonlat_to_tile(lon: float, lat: float, zoom: int) -> tuple:
+    """
+    - Get the XYZ tile column and row that holds a lon/lat point at a given zoom level
+    """
+    n = 2**zoom
+    lat = max(min(lat, 85.0511), -85.0511)
+
+    x = int((lon + 180.0) / 360.0 * n)
+    y = int((1.0 - math.asinh(math.tan(math.radians(lat))) / math.pi) / 2.0 * n)
+
+    return min(max(x, 0), n - 1), min(max(y, 0), n - 1)
+
+
+def tiles_for_bounds(bounds: tuple, minzoom: int, maxzoom: int) -> set:
+    """
+    - Get every `(z, x, y)` tile that touches a lon/lat bounding box
+
+    Arguments:
+        bounds (tuple): `(west, south, east, north)` in lon/lat
+        minzoom (int): lowest zoom level
+        maxzoom (int): highest zoom level
+
+    Returns:
+        set: of `(z, x, y)` tuples
+    """
+    west, south, east, north = bounds
+
+    tiles = set()
+    for z in range(minzoom, maxzoom + 1):
+        xmin, ymin = lonlat_to_tile(west, north, z)
+        xmax, ymax = lonlat_to_tile(east, south, z)
+
+        tiles.update((z, x, y) for x in range(xmin, xmax + 1) for y in range(ymin, ymax + 1))
+
+    return tiles
+
+
+def describe_layer(connection, layer: dict) -> dict:
+    """
+    - Get the SRID, lon/lat bounds and attribute fields of a query layer
+
+    Returns:
+        dict: with `srid`, `bounds` (None if the layer is empty) and `fields`
+    """
+    query = layer["query"]
+    columns = layer.get("columns")
+
+    with connection.cursor() as cursor:
+        cursor.execute(f"SELECT * FROM ({query}) q LIMIT 0")
+
+        fields = {}
+        for c in cursor.description:
+            if c.name == "geom" or (columns is not None and c.name not in columns):
+                continue
+            if c.type_code in NUMBER_TYPES:
+                fields[c.name] = "Number"
+            elif c.type_code in BOOLEAN_TYPES:
+                fields[c.name] = "Boolean"
+            else:
+                fields[c.name] = "String"
+
+        cursor.execute(
+            f"""
+            SELECT
+                max(ST_SRID(q.geom)),
+                ST_XMin(ST_Extent(ST_Transform(q.geom, 4326))),
+                ST_YMin(ST_Extent(ST_Transform(q.geom, 4326))),
+                ST_XMax(ST_Extent(ST_Transform(q.geom, 4326))),
+                ST_YMax(ST_Extent(ST_Transform(q.geom, 4326)))
+            FROM ({query}) q
+        """
+        )
+        srid, *bounds = cursor.fetchone()
+
+    connection.rollback()
+
+    return {
+        "srid": srid,
+        "bounds": tuple(bounds) if srid is not None else None,
+        "fields": fields,
+    }
+
+
+def materialize_layer(connection, layer: dict, tablename: str) -> dict:
+    """
+    - Run a layer's query once into an unlogged table, in EPSG:3857 and with a spatial index
+    - Only the layer's `columns` (or all of them) and the geometry are kept
+
+    Arguments:
+        connection: open psycopg2 connection
+        layer (dict): layer definition with a `query`
+        tablename (str): schema-qualified name of the table to make
+
+    Returns:
+        dict: a copy of `layer` whose `query` reads from the new table
+    """
+    query = layer["query"]
+    columns = layer.get("columns")
+
+    with connection.cursor() as cursor:
+        cursor.execute(f"SELECT * FROM ({query}) q LIMIT 0")
+        keep_columns = [
+            c.name
+            for c in cursor.description
+            if c.name != "geom" and (columns is None or c.name in columns)
+        ]
+        column_list = "".join(f'q."{c}", ' for c in keep_columns)
+
+        cursor.execute(
+            f"""
+            CREATE UNLOGGED TABLE {tablename} AS
+                SELECT {column_list} ST_Transform(q.geom, 3857) AS geom
+                FROM ({query}) q
+                WHERE q.geom IS NOT NULL;
+            CREATE INDEX ON {tablename} USING GIST (geom);
+            ANALYZE {tablename};
+        """
+        )
+
+    connection.commit()
+
+    return dict(layer, query=f"SELECT * FROM {tablename}")
+
+
+def materialize_frames(db: Database, layer: dict, table_prefix: str) -> list:
+    """
+    - Load each geodataframe from a layer's `frames` function into its own table,
+    in EPSG:3857 and with a spatial index, like `materialize_layer()` does for a query
+    - Empty geodataframes are skipped
+
+    Arguments:
+        db (Database): analysis database
+        layer (dict): layer definition with a `frames` function
+        table_prefix (str): schema-qualified prefix for the new tables
+
+    Returns:
+        list: a copy of `layer` for each geodataframe, named after it and reading from its table
+    """
+    layers = []
+
+    for i, (filename, gdf) in enumerate(layer["frames"](db).items()):
+        if gdf.empty:
+            continue
+
+        tablename = f"{table_prefix}_{i}"
+        import_geodataframe(db, gdf.to_crs(3857), tablename, uid_col=None, index=False)
+
+        layers.append(dict(layer, filename=filename, query=f"SELECT * FROM {tablename}"))
+
+    return layers
+
+
+def tile_chunk_sql(layers: list, tiles: list) -> str:
+    """
+    - Build a single query that renders a chunk of tiles, with one row per tile
+    - Each layer is encoded separately with `ST_AsMVT`, and the protobuf messages
+    are concatenated together into a multi-layer tile
+    - Features are found with a bounding-box filter in the layer's own SRID,
+    so the spatial index on the source table can be used. Layers should be
+    run through `materialize_layer()` first, or the filter may not reach the index
+    and the layer's query is re-run for every tile.
+    """
+    tile_values = ", ".join(f"({z}, {x}, {y})" for z, x, y in tiles)
+
+    layer_parts = []
+    for layer in layers:
+        column_list = "".join(f'q."{c}", ' for c in layer["fields"])
+
+        layer_parts.append(
+            f"""
+            COALESCE((
+                SELECT ST_AsMVT(mvt, '{layer["filename"]}', {EXTENT}, 'geom')
+                FROM (
+                    SELECT
+                        {column_list}
+                        ST_AsMVTGeom(
+                            ST_Transform(q.geom, 3857), t.envelope, {EXTENT}, {BUFFER}, true
+                        ) AS geom
+                    FROM ({layer["query"]}) q
+                    WHERE q.geom && ST_Transform(t.search_envelope, {layer["srid"]})
+                ) mvt
+                WHERE mvt.geom IS NOT NULL
+            ), ''::bytea)
+        """
+        )
+
+    return f"""
+        SELECT t.z, t.x, t.y, {" || ".join(layer_parts)} AS tile
+        FROM (
+            SELECT
+                z, x, y,
+                ST_TileEnvelope(z, x, y) AS envelope,
+                ST_TileEnvelope(z, x, y, margin => {BUFFER / EXTENT}) AS search_envelope
+            FROM (VALUES {tile_values}) AS v(z, x, y)
+        ) t
+    """
+
+
+def create_mbtiles(filepath: Path) -> sqlite3.Connection:
+    """
+    - Make an empty MBTiles file that stores each distinct tile once,
+    with a `tiles` view for readers that expect the basic layout
+    """
+    if filepath.exists():
+        filepath.unlink()
+
+    filepath.parent.mkdir(parents=True, exist_ok=True)
+
+    sqlite = sqlite3.connect(filepath)
+    sqlite.executescript(
+        """
+        PRAGMA synchronous = OFF;
+        PRAGMA journal_mode = MEMORY;
+
+        CREATE TABLE metadata (name TEXT, value TEXT);
+        CREATE TABLE map (
+            zoom_level INTEGER, tile_column INTEGER, tile_row INTEGER, tile_id TEXT
+        );
+        CREATE TABLE images (tile_id TEXT PRIMARY KEY, tile_data BLOB);
+
+        CREATE UNIQUE INDEX map_index ON map (zoom_level, tile_column, tile_row);
+        CREATE UNIQUE INDEX name ON metadata (name);
+
+        CREATE VIEW tiles AS
+            SELECT
+                map.zoom_level AS zoom_level,
+                map.tile_column AS tile_column,
+                map.tile_row AS tile_row,
+                images.tile_data AS tile_data
+            FROM map
+            JOIN images ON images.tile_id = map.tile_id;
+    """
+    )
+
+    return sqlite
+
+
+def make_native_tiles(
+    db: Database,
+    folder: Path,
+    tileset_name: str,
+    minzoom: int = 6,
+    maxzoom: int = 14,
+    workers: int = 4,
+    chunk_size: int = 64,
+) -> Path | None:
+    """
+    Render every query layer that exports into `folder` as vector tiles,
+    straight from the database, into a single MBTiles file.
+
+    - Layers that are written by a Python function instead of a query are tiled from
+    their `frames` function, or skipped if they don't have one
+    - Each layer is materialized once into a scratch schema, which is dropped afterwards
+    - Rows are flipped into the TMS scheme that MBTiles uses
+
+    The output file will be named:
+        folder / tileset / tileset_name.mbtiles
+
+    Arguments:
+        db (Database): analysis database
+        folder (Path): data product folder, whose name is matched against each layer's `folder`
+        tileset_name (str): name of the output tileset
+        minzoom (int): lowest zoom level to render
+        maxzoom (int): highest zoom level to render
+        workers (int): number of tile chunks to render at the same time
+        chunk_size (int): number of tiles to render in each query
+
+    Returns:
+        Path | None: path to the .mbtiles file, or None if there was nothing to tile
+    """
+    start_time = time.perf_counter()
+
+    all_layers = [layer for group in EXPORT_GROUPS.values() for layer in group()]
+    folder_layers = [layer for layer in all_layers if layer["folder"] == folder.name]
+
+    for layer in folder_layers:
+        if "query" not in layer and "frames" not in layer:
+            print(f"Skipping {layer['filename']}, which isn't made from a query or frames")
+
+    connection_pool = ThreadedConnectionPool(1, workers, db.uri)
+
+    # One scratch schema per run, so tilesets made at the same time don't collide
+    scratch_schema = f"tile_scratch_{os.getpid()}"
+    table_prefix = re.sub(r"[^a-z0-9]+", "_", tileset_name.lower())[:40]
+
+    try:
+        # Materialize each layer, then find out where it has data and which tiles that covers
+        connection = connection_pool.getconn()
+        layers, tiles, lon_lat_bounds = [], set(), []
+
+        with connection.cursor() as cursor:
+            cursor.execute(f"CREATE SCHEMA IF NOT EXISTS {scratch_schema}")
+        connection.commit()
+
+        for i, layer in enumerate(folder_layers):
+            tablename = f"{scratch_schema}.{table_prefix}_{i}"
+
+            if "query" in layer:
+                print(f"Materializing {layer['filename']}")
+                materialized = [materialize_layer(connection, layer, tablename)]
+
+            elif "frames" in layer:
+                print(f"Materializing the frames of {layer['filename']}")
+                materialized = materialize_frames(db, layer, tablename)
+
+            else:
+                continue
+
+            for layer in materialized:
+                layer = dict(layer, **describe_layer(connection, layer))
+
+                if layer["bounds"] is None:
+                    print(f"Skipping {layer['filename']}, which has no features")
+                    continue
+
+                layers.append(layer)
+                lon_lat_bounds.append(layer["bounds"])
+                tiles.update(tiles_for_bounds(layer["bounds"], minzoom, maxzoom))
+
+        connection_pool.putconn(connection)
+
+        if not layers:
+            print(f"No layers with features export into '{folder.name}'")
+            return None
+
+        tiles = sorted(tiles)
+        chunks = [tiles[i : i + chunk_size] for i in range(0, len(tiles), chunk_size)]
+
+        print(f"Rendering {len(layers)} layers into {len(tiles)} tiles, {chunk_size} at a time")
+
+        def render_chunk(chunk: list) -> list:
+            connection = connection_pool.getconn()
+            try:
+                with connection.cursor() as cursor:
+                    cursor.execute(tile_chunk_sql(layers, chunk))
+                    rows = cursor.fetchall()
+                connection.rollback()
+            finally:
+                connection_pool.putconn(connection)
+
+            return [(z, x, y, bytes(tile)) for z, x, y, tile in rows]
+
+        output_mbtile = folder / "tileset" / f"{tileset_name}.mbtiles"
+        sqlite = create_mbtiles(output_mbtile)
+
+        num_tiles, num_empty = 0, 0
+        known_ids = set()
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(render_chunk, chunk) for chunk in chunks]
+
+            for future in as_completed(futures):
+                images, tile_map = [], []
+
+                for z, x, y, tile in future.result():
+                    if not tile:
+                        num_empty += 1
+                        continue
+
+                    tile_id = hashlib.md5(tile).hexdigest()
+
+                    if tile_id not in known_ids:
+                        known_ids.add(tile_id)
+                        images.append((tile_id, gzip.compress(tile, mtime=0)))
+
+                    # MBTiles uses TMS rows, which count up from the bottom
+                    tile_map.append((z, x, (2**z - 1) - y, tile_id))
+
+                sqlite.executemany("INSERT INTO images VALUES (?, ?)", images)
+                sqlite.executemany("INSERT INTO map VALUES (?, ?, ?, ?)", tile_map)
+                sqlite.commit()
+
+                num_tiles += len(tile_map)
+
+    finally:
+        connection_pool.closeall()
+
+        # Use a fresh connection, in case a pooled one was left mid-transaction
+        connection = psycopg2.connect(db.uri)
+        connection.autocommit = True
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute(f"DROP SCHEMA IF EXISTS {scratch_schema} CASCADE")
+        finally:
+            connection.close()
+
+    west = min(b[0] for b in lon_lat_bounds)
+    south = min(b[1] for b in lon_lat_bounds)
+    east = max(b[2] for b in lon_lat_bounds)
+    north = max(b[3] for b in lon_lat_bounds)
+
+    vector_layers = [
+        {
+            "id": layer["filename"],
+            "fields": layer["fields"],
+            "minzoom": minzoom,
+            "maxzoom": maxzoom,
+        }
+        for layer in layers
+    ]
+
+    metadata = {
+        "name": tileset_name,
+        "format": "pbf",
+        "type": "overlay",
+        "minzoom": minzoom,
+        "maxzoom": maxzoom,
+        "bounds": f"{west},{south},{east},{north}",
+        "center": f"{(west + east) / 2},{(south + north) / 2},{minzoom}",
+        "json": json.dumps({"vector_layers": vector_layers}),
+    }
+
+    sqlite.executemany(
+        "INSERT INTO metadata VALUES (?, ?)", [(k, str(v)) for k, v in metadata.items()]
+    )
+    sqlite.commit()
+    sqlite.close()
+
+    print(
+        f"Wrote {num_tiles} tiles ({len(known_ids)} distinct, {num_empty} empty tiles skipped) "
+        f"to {output_mbtile} in {time.perf_counter() - start_time:.1f} seconds"
+    )
+
+    return output_mbtile
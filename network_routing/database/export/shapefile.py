@@ -1,6 +1,27 @@
+from concurrent.futures import ThreadPoolExecutor
+
 from network_routing import FOLDER_DATA_PRODUCTS, pg_db_connection
 
 
+def centerline_coverage_columns(alias: str = "o") -> str:
+    """
+    Columns for the centerline classification results, from `osm_edges_drive` as `alias`
+    """
+    sw_ratio = f"({alias}.sidewalk / 2 / st_length({alias}.geom))"
+
+    return f"""
+        {alias}.osmid, {alias}.name, {alias}.highway, {alias}.oneway, {alias}.hwy_tag,
+        {alias}.sidewalk, st_length({alias}.geom) as shape_len,
+        {sw_ratio} as sw_ratio,
+        CASE WHEN {sw_ratio} <= 0.45
+                THEN 'red'
+            WHEN {sw_ratio} < 0.82
+                THEN 'orange'
+            ELSE 'green' END AS color,
+        {alias}.geom
+    """
+
+
 def export_data_for_single_muni(muni_name: str) -> None:
     """
     Export a shapefile with the centerline classification
@@ -17,22 +38,14 @@ def export_data_for_single_muni(muni_name: str) -> None:
     all_queries = {
         "centerline_coverage": f"""
             select
-                osmid, name, highway, oneway, hwy_tag,
-                sidewalk, st_length(geom) as shape_len,
-                (sidewalk / 2 / st_length(geom)) as sw_ratio,
-                CASE WHEN (sidewalk / 2 / st_length(geom)) <= 0.45
-                        THEN 'red'
-                    WHEN (sidewalk / 2 / st_length(geom)) < 0.82
-                        THEN 'orange'
-                    ELSE 'green' END AS color,
-                geom
-            from osm_edges_drive
-            where st_dwithin(geom, 
+                {centerline_coverage_columns("o")}
+            from osm_edges_drive o
+            where st_dwithin(o.geom, 
                 (select geom from municipalboundaries m 
                 where mun_name LIKE '%%{muni_name}%%'),
                 1609.34
             )
-            and hwy_tag != 'motorway'
+            and o.hwy_tag != 'motorway'
             """,
     }
 
@@ -45,6 +58,56 @@ def export_data_for_single_muni(muni_name: str) -> None:
         db.export_gis(table_or_sql=query, filepath=output_path, filetype="shp")
 
 
+def export_data_for_all_munis(workers: int = 4) -> None:
+    """
+    Export the centerline classification shapefile for every municipality at once.
+
+    - A single spatial join tags each centerline with every municipality
+    within 1 mile, instead of running one full query per municipality
+    - The result is split up by municipality and the files are written in parallel
+    - Municipality names that appear in more than one county get the county name added
+    """
+    db = pg_db_connection()
+
+    query = f"""
+        select
+            m.mun_name, m.co_name,
+            {centerline_coverage_columns("o")}
+        from osm_edges_drive o
+        inner join municipalboundaries m
+        on st_dwithin(o.geom, m.geom, 1609.34)
+        where o.hwy_tag != 'motorway'
+    """
+
+    print("Tagging centerlines with every municipality within 1 mile")
+    gdf = db.gdf(query)
+
+    counties_per_name = gdf.groupby("mun_name")["co_name"].nunique()
+
+    def write_muni(group: tuple) -> str:
+        (muni_name, county_name), muni_gdf = group
+
+        if counties_per_name[muni_name] > 1:
+            muni_name = f"{muni_name} {county_name} County"
+
+        output_folder = FOLDER_DATA_PRODUCTS / muni_name
+        output_folder.mkdir(parents=True, exist_ok=True)
+
+        output_path = output_folder / f"{muni_name.replace(' ', '_')}_centerline_coverage.shp"
+
+        muni_gdf.drop(columns=["mun_name", "co_name"]).to_file(output_path)
+
+        return muni_name
+
+    groups = gdf.groupby(["mun_name", "co_name"])
+
+    print(f"Writing shapefiles for {groups.ngroups} municipalities")
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for muni_name in executor.map(write_muni, groups):
+            print(f"\t-> {muni_name}")
+
+
 def export_shapefiles_for_downstream_ridescore():
     db = pg_db_connection()
 
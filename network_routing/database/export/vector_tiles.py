@@ -1,16 +1,72 @@
-import os
+import hashlib
+import json
+import subprocess
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
 
 
-def make_vector_tiles(folder: Path, joined_tileset_name: str):
-    """Loop through the provided folder path and convert
-    each geojson file into its own vector tileset.
+MANIFEST_FILENAME = ".tippecanoe_manifest.json"
 
-    Then merge all tilesets into a single tileset
-    with layers for each single tileset.
+
+def is_line_delimited(filepath: Path) -> bool:
+    """Check if a .geojson file holds one feature per line,
+    instead of a single FeatureCollection"""
+
+    with open(filepath, "r") as f:
+        return '"FeatureCollection"' not in f.read(64)
+
+
+def file_hash(filepath: Path) -> str:
+    """Get the sha256 hash of a file, reading it in 1 MB blocks"""
+
+    sha = hashlib.sha256()
+    with open(filepath, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            sha.update(block)
+
+    return sha.hexdigest()
+
+
+def tippecanoe_command(geojson: Path, mbtiles: Path) -> list:
+    """Build the tippecanoe command for a single layer.
+    Line-delimited files can be read in parallel with -P"""
+
+    cmd = ["tippecanoe", "-o", str(mbtiles), "-l", geojson.stem, "-f", "-r1", "-pk", "-pf"]
+
+    if is_line_delimited(geojson):
+        cmd.append("-P")
+
+    return cmd + [str(geojson)]
+
+
+def run_command(cmd: list) -> dict:
+    """Run a command in a subprocess, capturing its exit code, timing and error output"""
+
+    start_time = time.perf_counter()
+    result = subprocess.run(cmd, capture_output=True, text=True)
+
+    return {
+        "returncode": result.returncode,
+        "seconds": time.perf_counter() - start_time,
+        "stderr": result.stderr.strip().splitlines()[-5:],
+    }
+
+
+def make_vector_tiles(
+    folder: Path, joined_tileset_name: str, workers: int = 4, force: bool = False
+) -> dict:
+    """Convert each geojson file in the provided folder
+    into its own vector tileset, several at a time.
+
+    Layers whose geojson file (and tippecanoe command) hasn't changed since the
+    last build are skipped. Hashes are kept in a manifest file in the folder.
+
+    Then merge the tilesets for the current set of geojson files
+    into a single tileset with layers for each single tileset.
 
     The output file will be named:
-        folder / joined_tileset_name.mbtiles
+        folder / tileset / joined_tileset_name.mbtiles
 
     THIS REQUIRES `tippecanoe` AND WILL NOT WORK IF
     THE COMMAND DOES NOT WORK FROM YOUR TERMINAL.
@@ -19,29 +75,112 @@ def make_vector_tiles(folder: Path, joined_tileset_name: str):
     On Windows, you'll need to use WSL. See https://gist.github.com/ryanbaumann/e5c7d76f6eeb8598e66c5785b677726e
 
     For more info, see: https://github.com/mapbox/tippecanoe
+
+    If any layer fails to tile, the joined tileset is left alone instead of being
+    rewritten without that layer, and the `tile-join` entry gets a non-zero exit code.
+
+    Returns a dict keyed on layer name, with the status, exit code and timing of each job
     """
 
     print("\n\nConverting .geojson files to .mbtiles")
-    # Make an individual tileset for each geojson file
-    for f in folder.rglob("*.geojson"):
-        print(f"\n\nTILING: {f.stem}")
-        cmd = f'tippecanoe -o "{folder / f.stem}.mbtiles" -l {f.stem} -f -r1 -pk -pf "{f}"'
-        print(cmd, "\n")
-        os.system(cmd)
-
-    # Combine all tiles into a single set
-    print("\n\nMerging multiple .mbtiles files into a single tilset")
-    output_folder = folder / "tileset"
 
-    if not output_folder.exists():
-        output_folder.mkdir()
+    manifest_path = folder / MANIFEST_FILENAME
+    saved = json.loads(manifest_path.read_text()) if manifest_path.exists() else {}
+
+    # Older manifests only held the layers
+    manifest = saved.get("layers", {}) if "layers" in saved else saved
+    last_join = saved.get("joined", {}) if "layers" in saved else {}
+
+    output_folder = folder / "tileset"
+    output_folder.mkdir(exist_ok=True)
 
     output_mbtile = output_folder / f"{joined_tileset_name}.mbtiles"
 
-    cmd = f'tile-join -n {joined_tileset_name} -pk -f -o "{output_mbtile}"'
-    for f in folder.rglob("*.mbtiles"):
-        if joined_tileset_name not in str(f):
-            cmd += f' "{f}"'
+    # Figure out which layers need to be (re)built
+    layers, jobs = {}, {}
+    for f in sorted(folder.rglob("*.geojson")):
+        mbtiles = folder / f"{f.stem}.mbtiles"
+        cmd = tippecanoe_command(f, mbtiles)
+
+        layers[f.stem] = {
+            "mbtiles": mbtiles,
+            "sha256": file_hash(f),
+            "command": " ".join(cmd),
+        }
+
+        previous = manifest.get(f.stem, {})
+        unchanged = (
+            previous.get("sha256") == layers[f.stem]["sha256"]
+            and previous.get("command") == layers[f.stem]["command"]
+            and mbtiles.exists()
+        )
+
+        if force or not unchanged:
+            jobs[f.stem] = cmd
+
+    print(f"{len(jobs)} of {len(layers)} layers need to be tiled")
+
+    results = {name: {"status": "unchanged", "returncode": 0, "seconds": 0.0} for name in layers}
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(run_command, cmd): name for name, cmd in jobs.items()}
+
+        for future in as_completed(futures):
+            name = futures[future]
+            result = future.result()
+            result["status"] = "tiled" if result["returncode"] == 0 else "failed"
+            results[name] = result
+
+            if result["returncode"] == 0:
+                manifest[name] = {
+                    "sha256": layers[name]["sha256"],
+                    "command": layers[name]["command"],
+                }
+            else:
+                manifest.pop(name, None)
+                print(f"\tFAILED: {name}")
+                for line in result["stderr"]:
+                    print(f"\t\t{line}")
+
+    # Forget about layers whose geojson file is gone
+    manifest = {name: v for name, v in manifest.items() if name in layers}
+
+    failed = [name for name, result in results.items() if result["returncode"] != 0]
+
+    # Re-join whenever the set of layers (or any layer's contents) differs from the last join
+    current_join = {
+        "output": output_mbtile.name,
+        "layers": {name: layers[name]["sha256"] for name in sorted(layers)},
+    }
+    needs_join = force or current_join != last_join or not output_mbtile.exists()
+
+    if failed:
+        print(f"\n\nNot merging into {output_mbtile.name}, {len(failed)} layer(s) failed to tile")
+        results["tile-join"] = {"status": "skipped", "returncode": 1, "seconds": 0.0}
+
+    elif layers and needs_join:
+        print("\n\nMerging multiple .mbtiles files into a single tilset")
+
+        cmd = ["tile-join", "-n", joined_tileset_name, "-pk", "-f", "-o", str(output_mbtile)]
+        cmd += [str(layers[name]["mbtiles"]) for name in sorted(layers)]
+
+        print("\n\n", " ".join(cmd))
+        results["tile-join"] = run_command(cmd)
+
+        if results["tile-join"]["returncode"] == 0:
+            results["tile-join"]["status"] = "joined"
+            last_join = current_join
+        else:
+            results["tile-join"]["status"] = "failed"
+            last_join = {}
+
+    manifest_path.write_text(json.dumps({"layers": manifest, "joined": last_join}, indent=2))
+
+    print("\n\nTiling summary:")
+    for name, result in sorted(results.items(), key=lambda item: -item[1]["seconds"]):
+        print(
+            f"\t-> {result['seconds']:8.1f}s  {result['status']:>9}  "
+            f"(exit {result['returncode']})  {name}"
+        )
 
-    print("\n\n", cmd)
-    os.system(cmd)
+    return results
@@ -0,0 +1,212 @@
+"""
+indexes.py
+----------
+
+Make sure the indexes that the analysis queries depend on actually exist.
+
+Each index is described as a `(tablename, method, expression)` tuple, i.e.
+`("nodes_for_sidewalks", "gist", "geom")` or `("ridescore_pois", "btree", "dvrpc_id::text")`.
+`provision_indexes()` looks at what's already on each table, builds anything
+that's missing with `CREATE INDEX CONCURRENTLY` so the tables stay readable,
+runs `ANALYZE` on the tables that changed, and appends what it did to a JSON report.
+
+It's called before the work starts in:
+
+- `RoutableNetwork.build_network()`, so every `access` analysis
+- `make_nodes_for_edge_table()`, `db export-muni-shapefiles`, `db export-geojson`
+  and `db make-native-tiles`
+- `gaps classify-osm-sw-coverage`, `gaps identify-islands` and every `gaps isochrones-*` command
+- `improvements draw-missing-network-links`, `feature-engineering` and `reconnect-nodes`
+
+Anything else can use `db provision-indexes TABLENAME`.
+
+Examples:
+    ```python
+    >>> from network_routing.database.indexes import provision_indexes, table_indexes
+    >>> provision_indexes(db, table_indexes("osm_edges_drive", keys=["uid"]))
+    ```
+
+"""
+from __future__ import annotations
+
+import json
+import re
+import time
+from datetime import datetime
+from pathlib import Path
+
+import psycopg2
+from pg_data_etl import Database, helpers
+
+
+REPORT_PATH = Path("./data/index_report.json")
+
+# Data types that a `::text` cast is a no-op for
+TEXT_TYPES = ("text", "character varying")
+
+
+def table_indexes(
+    tablename: str,
+    geom: str | None = "geom",
+    keys: tuple | list = (),
+    text_keys: tuple | list = (),
+) -> list:
+    """
+    - Describe the usual indexes for one table
+
+    Arguments:
+        tablename (str): name of the table, with or without a schema
+        geom (str | None): geometry column to get a GiST index, or None to skip it
+        keys (tuple | list): columns that get looked up by value, like `uid` or `start_id`
+        text_keys (tuple | list): columns that get compared as text, like POI ID columns.
+            A column that is already text gets a plain index instead.
+
+    Returns:
+        list: of `(tablename, method, expression)` tuples
+    """
+    specs = [(tablename, "gist", geom)] if geom else []
+    specs += [(tablename, "btree", col) for col in keys]
+    specs += [(tablename, "btree", f"{col}::text") for col in text_keys]
+
+    return specs
+
+
+def _normalize(expression: str) -> str:
+    """Strip parentheses, quotes and spaces so expressions can be compared to `pg_get_indexdef()`"""
+    return re.sub(r'[()"\s]', "", expression).lower()
+
+
+def _index_name(tbl: str, method: str, expression: str) -> str:
+    """Postgres truncates names at 63 characters"""
+    return f"{tbl}_{re.sub(r'[^a-z0-9]+', '_', expression.lower()).strip('_')}_{method}_idx"[:63]
+
+
+def provision_indexes(db: Database, specs: list, report_path: Path | None = REPORT_PATH) -> list:
+    """
+    - Create any of the indexes in `specs` that don't exist yet,
+    then `ANALYZE` the tables that changed
+    - Indexes are built with `CREATE INDEX CONCURRENTLY` on an autocommit connection.
+    An invalid index left behind by an earlier failed build is dropped and rebuilt.
+    - Missing tables and columns are skipped, so this is safe to call before a process makes them
+
+    Arguments:
+        db (Database): analysis database
+        specs (list): of `(tablename, method, expression)` tuples, i.e. from `table_indexes()`
+        report_path (Path | None): JSON file to append the results to, or None to skip the report
+
+    Returns:
+        list: one dict per index with the table, expression, index name, status and seconds
+    """
+    results = []
+    tables_to_analyze = set()
+
+    connection = psycopg2.connect(db.uri)
+    connection.autocommit = True
+
+    try:
+        with connection.cursor() as cursor:
+            for tablename, method, expression in specs:
+                schema, tbl = helpers.convert_full_tablename_to_parts(tablename)
+                result = {
+                    "table": f"{schema}.{tbl}",
+                    "method": method,
+                    "expression": expression,
+                    "index": None,
+                    "status": "exists",
+                    "seconds": 0.0,
+                }
+                results.append(result)
+
+                cursor.execute(
+                    """
+                    SELECT column_name, data_type FROM information_schema.columns
+                    WHERE table_schema = %s AND table_name = %s
+                """,
+                    (schema, tbl),
+                )
+                columns = dict(cursor.fetchall())
+
+                if not columns:
+                    result["status"] = "missing table"
+                    continue
+
+                column, _, cast = expression.partition("::")
+
+                if column not in columns:
+                    result["status"] = "missing column"
+                    continue
+
+                # Postgres drops a `::text` cast on a text column, so index it plainly
+                if cast == "text" and columns[column] in TEXT_TYPES:
+                    expression = column
+
+                cursor.execute(
+                    """
+                    SELECT c.relname, pg_get_indexdef(i.indexrelid), i.indisvalid
+                    FROM pg_index i
+                    JOIN pg_class c ON c.oid = i.indexrelid
+                    WHERE i.indrelid = to_regclass(%s)
+                """,
+                    (f"{schema}.{tbl}",),
+                )
+
+                # Match on the method and the leading column/expression of each valid index
+                wanted = _normalize(f"{method}({expression})")
+                index_name = _index_name(tbl, method, expression)
+                invalid_names = []
+
+                for name, indexdef, is_valid in cursor.fetchall():
+                    existing = _normalize(indexdef.split(" USING ", 1)[1]).split(",")[0]
+
+                    if not is_valid:
+                        invalid_names.append(name)
+                    elif existing == wanted:
+                        result["index"] = name
+                        break
+
+                if result["index"]:
+                    continue
+
+                start_time = time.perf_counter()
+
+                if index_name in invalid_names:
+                    cursor.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {schema}.{index_name}")
+
+                column_or_expression = f"({expression})" if "::" in expression else expression
+
+                print(f"Creating {method} index on {schema}.{tbl} ({expression})")
+                cursor.execute(
+                    f"""
+                    CREATE INDEX CONCURRENTLY IF NOT EXISTS {index_name}
+                    ON {schema}.{tbl} USING {method} ({column_or_expression})
+                """
+                )
+
+                result["index"] = index_name
+                result["status"] = "created"
+                result["seconds"] = round(time.perf_counter() - start_time, 2)
+
+                tables_to_analyze.add(f"{schema}.{tbl}")
+
+            for tablename in sorted(tables_to_analyze):
+                print(f"Analyzing {tablename}")
+                cursor.execute(f"ANALYZE {tablename}")
+
+    finally:
+        connection.close()
+
+    if report_path:
+        report_path = Path(report_path)
+        report_path.parent.mkdir(parents=True, exist_ok=True)
+
+        report = json.loads(report_path.read_text()) if report_path.exists() else []
+        report.append(
+            {"timestamp": datetime.now().isoformat(timespec="seconds"), "indexes": results}
+        )
+
+        report_path.write_text(json.dumps(report, indent=2))
+
+    created = [r for r in results if r["status"] == "created"]
+    print(f"Index check: {len(created)} created, {len(results) - len(created)} in place or skipped")
+
+    return results
@@ -0,0 +1,368 @@
+"""
+instrumentation.py
+------------------
+
+Time every query that goes through the `Database` handle, and report
+where each command spends its database time.
+
+Turn it on by adding `SQL_PROFILE=1` to the `.env` file (or the shell environment).
+`pg_db_connection()` will then hand out an `InstrumentedDatabase`, which
+behaves exactly like a regular `Database`, but:
+
+- Times each call to `execute()`, `query*()`, `df()` and `gdf()`
+- Groups the queries into templates by swapping the inlined IDs, numbers and strings
+  for `?`, so that `WHERE uid = 12` and `WHERE uid = 13` are counted together
+- Writes a JSON report with the count, total, p50 and p99 of each template
+  to `./data/sql_profiles/` when the command exits, and prints the slowest templates
+
+The timed methods are swapped out on the wrapped `Database` itself, so the queries that
+its helpers run internally, like `gis_make_geotable_from_query()`, `schema_add()` or
+`columns()`, are timed as well. When one timed method calls another, i.e. `query_as_singleton()`
+calling `query_as_list_of_lists()`, only the outer call is counted.
+
+Not every query is captured: code that opens its own `psycopg2.connect(db.uri)`,
+like the `COPY` loads in `bulk_import.py` and the exports, bypasses the handle entirely.
+
+Processes in a `ProcessPoolExecutor` don't run `atexit` hooks, so the setup runner calls
+`flush_profile()` after each step to write that worker's report, labelled with the step ID.
+
+Set `SQL_PROFILE_EXPLAIN` to a number, i.e. `SQL_PROFILE_EXPLAIN=3`, to also capture
+`EXPLAIN (ANALYZE, BUFFERS)` for the slowest query of that many of the slowest `SELECT` templates.
+Each plan is run inside a transaction that gets rolled back.
+
+"""
+from __future__ import annotations
+
+import atexit
+import json
+import math
+import os
+import re
+import sys
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+
+import psycopg2
+from pg_data_etl import Database
+
+
+REPORT_FOLDER = Path("./data/sql_profiles")
+
+TIMED_METHODS = (
+    "execute",
+    "query",
+    "query_as_list_of_lists",
+    "query_as_list_of_singletons",
+    "query_as_singleton",
+    "df",
+    "gdf",
+)
+
+# These methods go through SQLAlchemy, which turns '%%' into '%'
+SQLALCHEMY_METHODS = ("df", "gdf")
+
+
+def fingerprint(query: str) -> str:
+    """
+    - Turn a query into a template by replacing its literal values with `?`
+
+    Arguments:
+        query (str): SQL query with inlined values
+
+    Returns:
+        str: normalized query text, with whitespace collapsed
+    """
+    template = re.sub(r"--[^\n]*", " ", query)
+    template = re.sub(r"'(?:[^']|'')*'", "?", template)
+    template = re.sub(r"(?<![\w.])-?\d+(?:\.\d+)?(?![\w.])", "?", template)
+    template = re.sub(r"\(\s*\?(?:\s*,\s*\?)*\s*\)", "(...)", template)
+    template = re.sub(r"\s+", " ", template).strip().rstrip(";").strip()
+
+    return template.lower()
+
+
+def percentile(values: list, pct: float) -> float:
+    """
+    - Nearest-rank percentile of a list of numbers
+    """
+    ordered = sorted(values)
+    rank = max(math.ceil(pct / 100 * len(ordered)), 1)
+
+    return ordered[rank - 1]
+
+
+class QueryProfile:
+    """
+    - Collect the time spent in each query template, across threads
+
+    Attributes:
+        templates (dict): keyed on the template, with the method,
+            every duration, and the slowest raw query seen so far
+    """
+
+    def __init__(self):
+        self.templates = {}
+        self.started = time.perf_counter()
+        self._lock = threading.Lock()
+
+    def record(self, method: str, query: str, seconds: float) -> None:
+        """
+        - Add one timed query to its template
+        """
+        template = fingerprint(query)
+
+        with self._lock:
+            stats = self.templates.setdefault(
+                template,
+                {"method": method, "durations": [], "slowest_seconds": 0.0, "slowest_query": None},
+            )
+            stats["durations"].append(seconds)
+
+            if seconds >= stats["slowest_seconds"]:
+                stats["slowest_seconds"] = seconds
+                stats["slowest_query"] = query
+
+    def take(self) -> QueryProfile:
+        """
+        - Move everything collected so far into a new profile, and start over
+
+        Returns:
+            QueryProfile: with the templates and start time this profile had
+        """
+        taken = QueryProfile()
+
+        with self._lock:
+            taken.templates, taken.started = self.templates, self.started
+            self.templates, self.started = {}, time.perf_counter()
+
+        return taken
+
+    def summary(self) -> list:
+        """
+        - Get one row per template, slowest total time first
+
+        Returns:
+            list: of dicts with the template, count, total, mean, p50, p99 and max seconds
+        """
+        rows = []
+
+        with self._lock:
+            for template, stats in self.templates.items():
+                durations = stats["durations"]
+
+                rows.append(
+                    {
+                        "template": template,
+                        "method": stats["method"],
+                        "count": len(durations),
+                        "total_seconds": round(sum(durations), 4),
+                        "mean_seconds": round(sum(durations) / len(durations), 4),
+                        "p50_seconds": round(percentile(durations, 50), 4),
+                        "p99_seconds": round(percentile(durations, 99), 4),
+                        "max_seconds": round(stats["slowest_seconds"], 4),
+                        "slowest_query": stats["slowest_query"],
+                    }
+                )
+
+        return sorted(rows, key=lambda row: row["total_seconds"], reverse=True)
+
+
+def explain_query(uri: str, query: str) -> str:
+    """
+    - Run `EXPLAIN (ANALYZE, BUFFERS)` on a query inside a transaction that gets rolled back
+
+    Returns:
+        str: the query plan as text
+    """
+    connection = psycopg2.connect(uri)
+
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(f"EXPLAIN (ANALYZE, BUFFERS) {query}")
+            plan = "\n".join(row[0] for row in cursor.fetchall())
+
+    finally:
+        connection.rollback()
+        connection.close()
+
+    return plan
+
+
+_CALL_DEPTH = threading.local()
+
+
+def _timed(method, name: str, profile: QueryProfile):
+    """
+    - Wrap a bound `Database` method so it records into `profile`,
+      unless it was called from inside another timed method
+    """
+
+    def timed(query: str, *args, **kwargs):
+        depth = getattr(_CALL_DEPTH, "value", 0)
+        _CALL_DEPTH.value = depth + 1
+
+        start_time = time.perf_counter()
+        try:
+            return method(query, *args, **kwargs)
+        finally:
+            _CALL_DEPTH.value = depth
+            if depth == 0:
+                profile.record(name, query, time.perf_counter() - start_time)
+
+    timed.__wrapped__ = method
+    return timed
+
+
+class InstrumentedDatabase:
+    """
+    - Wrap a `Database` so that every query it runs is timed into a `QueryProfile`
+    - The timed methods are replaced on `db` itself, so calls made inside
+      its own helpers go through the timer too
+    - Everything else, like `db.uri` or `db.columns()`, is passed straight through
+
+    Attributes:
+        db (Database): the database handle to wrap
+        profile (QueryProfile): where the timings get collected
+    """
+
+    def __init__(self, db: Database, profile: QueryProfile):
+        self.db = db
+        self.profile = profile
+
+        for name in TIMED_METHODS:
+            method = getattr(db, name)
+            method = getattr(method, "__wrapped__", method)
+            setattr(db, name, _timed(method, name, profile))
+
+    def __getattr__(self, name: str):
+        return getattr(self.db, name)
+
+    def write_report(self, explain: int = 0, label: str | None = None) -> Path | None:
+        """
+        - Save the profile to `./data/sql_profiles/` and print the slowest templates
+
+        Arguments:
+            explain (int): number of the slowest `SELECT` templates to run `EXPLAIN` on
+            label (str | None): added to the filename and report, i.e. the setup step ID
+
+        Returns:
+            Path | None: path to the JSON report, or None if no queries ran
+        """
+        rows = self.profile.summary()
+
+        if not rows:
+            return None
+
+        candidates = [
+            row for row in rows if re.match(r"\s*(select|with)\b", row["slowest_query"], re.I)
+        ]
+
+        for row in candidates[:explain]:
+            query = row["slowest_query"]
+            if row["method"] in SQLALCHEMY_METHODS:
+                query = query.replace("%%", "%")
+
+            try:
+                row["explain"] = explain_query(self.db.uri, query)
+            except psycopg2.Error as e:
+                row["explain"] = f"EXPLAIN failed: {e}"
+
+        command = "_".join(Path(arg).name for arg in sys.argv[:3]) or "python"
+        if label:
+            command += f"_{label}"
+        command = re.sub(r"[^\w\-]+", "_", command)
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+
+        REPORT_FOLDER.mkdir(parents=True, exist_ok=True)
+        report_path = REPORT_FOLDER / f"{command}_{timestamp}_{os.getpid()}.json"
+
+        report = {
+            "command": " ".join(sys.argv),
+            "label": label,
+            "pid": os.getpid(),
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "wall_seconds": round(time.perf_counter() - self.profile.started, 2),
+            "database_seconds": round(sum(row["total_seconds"] for row in rows), 2),
+            "num_queries": sum(row["count"] for row in rows),
+            "templates": rows,
+        }
+
+        report_path.write_text(json.dumps(report, indent=2))
+
+        print("-" * 80, f"\nSQL PROFILE{f' ({label})' if label else ''}")
+        print(
+            f"\t -> {report['num_queries']} queries in {len(rows)} templates took "
+            f"{report['database_seconds']}s of {report['wall_seconds']}s"
+        )
+        for row in rows[:10]:
+            print(
+                f"\t -> {row['total_seconds']:>9.2f}s  n={row['count']:<6} "
+                f"p50={row['p50_seconds']:.3f}s p99={row['p99_seconds']:.3f}s  "
+                f"{row['template'][:80]}"
+            )
+        print(f"\t -> Full report saved to {report_path}")
+
+        return report_path
+
+
+_PROFILE = None
+_PROFILE_PID = None
+_PROFILE_DB = None
+
+
+def _report_explain() -> int:
+    return int(os.getenv("SQL_PROFILE_EXPLAIN", "0") or 0)
+
+
+def instrument(db: Database) -> InstrumentedDatabase:
+    """
+    - Wrap `db` so its queries are profiled, and write a report when Python exits
+    - Every handle made in one process shares the same profile and report.
+      A forked worker starts its own profile instead of adding to its parent's.
+
+    Arguments:
+        db (Database): the database handle to wrap
+
+    Returns:
+        InstrumentedDatabase: drop-in replacement for `db`
+    """
+    global _PROFILE, _PROFILE_PID, _PROFILE_DB
+
+    if _PROFILE is None or _PROFILE_PID != os.getpid():
+        if _PROFILE_PID is None:
+            atexit.register(flush_profile)
+
+        _PROFILE = QueryProfile()
+        _PROFILE_PID = os.getpid()
+        _PROFILE_DB = db
+
+    return InstrumentedDatabase(db, _PROFILE)
+
+
+def flush_profile(label: str | None = None) -> Path | None:
+    """
+    - Write the report for this process's profile, and start a fresh one
+    - Called after each setup step, since pool workers never run `atexit` hooks
+
+    Arguments:
+        label (str | None): added to the report's filename, i.e. the setup step ID
+
+    Returns:
+        Path | None: path to the JSON report, or None if nothing was profiled in this process
+    """
+    if _PROFILE is None or _PROFILE_PID != os.getpid():
+        return None
+
+    report = InstrumentedDatabase.__new__(InstrumentedDatabase)
+    report.db, report.profile = _PROFILE_DB, _PROFILE.take()
+
+    return report.write_report(_report_explain(), label)
+
+
+def profiling_enabled() -> bool:
+    """
+    - Check the `SQL_PROFILE` environment variable
+    """
+    return os.getenv("SQL_PROFILE", "").lower() in ("1", "true", "yes")
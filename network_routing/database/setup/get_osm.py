@@ -1,17 +1,34 @@
+import os
+
 import osmnx as ox
 
 from pg_data_etl import Database
 
+from network_routing.database.bulk_import import import_geodataframe
+from network_routing.database.setup.get_osm_pbf import import_osm_from_pbf
+
+
+# north, south, east, west
+DVRPC_BBOX = (40.601963, 39.478606, -73.885803, -76.210785)
+
 
 def import_osm_for_dvrpc_region(db: Database, network_type: str = "all"):
     """
     Import OpenStreetMap data to the database with osmnx.
     This bounding box overshoots the region and takes a bit to run.
+
+    If `OSM_PBF_PATH` is defined in the environment, the edges are streamed
+    from that local .osm.pbf extract instead of being downloaded.
     """
 
+    pbf_path = os.getenv("OSM_PBF_PATH")
+    if pbf_path:
+        import_osm_from_pbf(db, pbf_path, network_type, bbox=DVRPC_BBOX)
+        return None
+
     print("-" * 80, "\nIMPORTING OpenStreetMap DATA")
 
-    north, south, east, west = 40.601963, 39.478606, -73.885803, -76.210785
+    north, south, east, west = DVRPC_BBOX
 
     print("\t -> Beginning to download...")
     G = ox.graph_from_bbox(north, south, east, west, network_type=network_type)
@@ -25,12 +42,10 @@ def import_osm_for_dvrpc_region(db: Database, network_type: str = "all"):
     print("\t -> Converting graph to geodataframes")
     _, edges = ox.graph_to_gdfs(G)
 
-    db.import_geodataframe(edges, f"osm_edges_{network_type}")
-
     # Reproject from 4326 to 26918 to facilitate analysis queries
-    db.gis_table_update_spatial_data_projection(
-        f"osm_edges_{network_type}", 4326, 26918, "LINESTRING"
-    )
+    edges = edges.to_crs("EPSG:26918")
+
+    import_geodataframe(db, edges, f"osm_edges_{network_type}")
 
     # Make a uuid column
     make_id_query = f"""
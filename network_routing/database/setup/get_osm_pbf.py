@@ -0,0 +1,327 @@
+"""
+get_osm_pbf.py
+--------------
+
+Import OpenStreetMap edges from a local `.osm.pbf` extract, instead of downloading
+the region through the Overpass API and building a NetworkX graph in memory.
+
+The extract is streamed once with `pyosmium`:
+
+- Ways are filtered by network type as they're read, and only the node IDs,
+  coordinates and a handful of tags are kept, in flat arrays
+- Ways are split into edges at every node that's shared with another way,
+  like `osmnx` does when it simplifies a graph
+- With a `bbox`, edges that start or end outside of it are dropped, like `osmnx` does
+  when it truncates a graph. Ways that cross the edge of the bbox are cut back to
+  their last intersection inside it, and no geometry is clipped at the bbox itself.
+- Coordinates are projected to EPSG:26918 in one vectorized `pyproj` call,
+  and the edge geometries are built with `shapely.linestrings()`
+- `uid` and `osmuuid` are assigned in Python, and the edges are loaded with `COPY` in chunks
+
+The result is a table named `osm_edges_{network_type}` with the same columns
+that the rest of the analysis uses from the `osmnx` import.
+
+Examples:
+    ```python
+    >>> from network_routing.database.setup.get_osm_pbf import import_osm_from_pbf
+    >>> import_osm_from_pbf(db, "pennsylvania-latest.osm.pbf", network_type="drive")
+    ```
+
+"""
+from __future__ import annotations
+
+import time
+import uuid
+from array import array
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import osmium
+import shapely
+from pyproj import Transformer
+from pg_data_etl import Database
+
+from network_routing.database.bulk_import import copy_dataframe
+
+
+EPSG = 26918
+
+# Tags that get copied onto each edge
+TAG_COLUMNS = [
+    "highway",
+    "name",
+    "oneway",
+    "maxspeed",
+    "lanes",
+    "ref",
+    "bridge",
+    "tunnel",
+    "access",
+    "service",
+    "junction",
+]
+
+# Tag values that knock a way out of each network type, based on the osmnx filters
+_NOT_ROADS = {"abandoned", "construction", "no", "planned", "platform", "proposed", "raceway"}
+
+NETWORK_FILTERS = {
+    "all": {
+        "highway": _NOT_ROADS | {"razed"},
+        "access": {"private"},
+    },
+    "drive": {
+        "highway": _NOT_ROADS
+        | {
+            "bridleway",
+            "bus_guideway",
+            "corridor",
+            "cycleway",
+            "elevator",
+            "escalator",
+            "footway",
+            "path",
+            "pedestrian",
+            "razed",
+            "service",
+            "steps",
+            "track",
+        },
+        "motor_vehicle": {"no"},
+        "motorcar": {"no"},
+        "access": {"private"},
+        "service": {"alley", "driveway", "emergency_access", "parking", "parking_aisle", "private"},
+    },
+    "walk": {
+        "highway": _NOT_ROADS | {"bus_guideway", "cycleway", "motor", "motorway", "motorway_link"},
+        "foot": {"no"},
+        "access": {"private"},
+        "service": {"private"},
+    },
+    "bike": {
+        "highway": _NOT_ROADS
+        | {"corridor", "elevator", "escalator", "footway", "motor", "motorway", "motorway_link"},
+        "bicycle": {"no"},
+        "access": {"private"},
+        "service": {"private"},
+    },
+}
+
+
+class WayCollector(osmium.SimpleHandler):
+    """
+    - Keep the nodes, coordinates and tags of every way that's part of the network
+    - Node IDs and coordinates are kept in flat arrays, with the number of nodes in each way
+
+    Attributes:
+        exclude (dict): tag values that knock a way out of the network
+        bbox (tuple | None): `(north, south, east, west)` that each way needs to touch
+    """
+
+    def __init__(self, network_type: str, bbox: tuple | None = None):
+        super().__init__()
+
+        self.exclude = NETWORK_FILTERS[network_type]
+        self.bbox = bbox
+
+        self.refs = array("q")
+        self.lons = array("d")
+        self.lats = array("d")
+        self.sizes = array("q")
+        self.osmids = array("q")
+        self.tags = {tag: [] for tag in TAG_COLUMNS}
+
+    def keep(self, tags) -> bool:
+        if "highway" not in tags or tags.get("area") == "yes":
+            return False
+
+        return not any(tags.get(tag) in values for tag, values in self.exclude.items())
+
+    def way(self, w):
+        if not self.keep(w.tags):
+            return
+
+        refs, lons, lats = [], [], []
+        for node in w.nodes:
+            # Nodes past the edge of the extract have no location
+            if node.location.valid():
+                refs.append(node.ref)
+                lons.append(node.location.lon)
+                lats.append(node.location.lat)
+
+        if len(refs) < 2:
+            return
+
+        if self.bbox:
+            north, south, east, west = self.bbox
+            if not any(west <= x <= east and south <= y <= north for x, y in zip(lons, lats)):
+                return
+
+        self.refs.extend(refs)
+        self.lons.extend(lons)
+        self.lats.extend(lats)
+        self.sizes.append(len(refs))
+        self.osmids.append(w.id)
+
+        for tag, values in self.tags.items():
+            values.append(w.tags.get(tag))
+
+
+def split_ways_at_intersections(refs: np.ndarray, sizes: np.ndarray) -> tuple:
+    """
+    - Split ways into edges at their endpoints and at every node shared by more than one way
+
+    Arguments:
+        refs (np.ndarray): node IDs of every way, one after another
+        sizes (np.ndarray): number of nodes in each way
+
+    Returns:
+        np.ndarray: the way that each edge came from
+        np.ndarray: position in `refs` of the first node of each edge
+        np.ndarray: position in `refs` of the last node of each edge
+    """
+    way_ends = np.cumsum(sizes)
+    way_starts = way_ends - sizes
+
+    _, inverse, counts = np.unique(refs, return_inverse=True, return_counts=True)
+
+    # Count each node once per way, so a way that loops back on itself isn't split
+    way_ids = np.repeat(np.arange(len(sizes)), sizes)
+    _, first_in_way = np.unique(np.stack([way_ids, inverse]), axis=1, return_index=True)
+    ways_per_node = np.bincount(inverse[first_in_way], minlength=len(counts))
+
+    is_split = ways_per_node[inverse] > 1
+    is_split[way_starts] = True
+    is_split[way_ends - 1] = True
+
+    split_positions = np.flatnonzero(is_split)
+    same_way = way_ids[split_positions[:-1]] == way_ids[split_positions[1:]]
+
+    return (
+        way_ids[split_positions[:-1]][same_way],
+        split_positions[:-1][same_way],
+        split_positions[1:][same_way],
+    )
+
+
+def import_osm_from_pbf(
+    db: Database,
+    pbf_path: str | Path,
+    network_type: str = "all",
+    bbox: tuple | None = None,
+    chunk_size: int = 200_000,
+) -> None:
+    """
+    Stream a local `.osm.pbf` extract into a table named `osm_edges_{network_type}`.
+
+    Arguments:
+        db (Database): analysis database
+        pbf_path (str | Path): filepath to the .osm.pbf extract
+        network_type (str): one of `all`, `drive`, `walk` or `bike`
+        bbox (tuple | None): `(north, south, east, west)` to keep the edges within
+        chunk_size (int): number of edges to send in each `COPY`
+
+    Returns:
+        None: but creates a new table in the database
+    """
+    start_time = time.perf_counter()
+    tablename = f"osm_edges_{network_type}"
+
+    print("-" * 80, f"\nIMPORTING OpenStreetMap DATA FROM {Path(pbf_path).name}")
+
+    print(f"\t -> Reading '{network_type}' ways")
+    collector = WayCollector(network_type, bbox)
+    collector.apply_file(str(pbf_path), locations=True, idx="flex_mem")
+
+    refs = np.frombuffer(collector.refs, dtype=np.int64)
+    sizes = np.frombuffer(collector.sizes, dtype=np.int64)
+    tags = {tag: np.array(values, dtype=object) for tag, values in collector.tags.items()}
+    osmids = np.frombuffer(collector.osmids, dtype=np.int64)
+
+    lons = np.frombuffer(collector.lons, dtype=np.float64)
+    lats = np.frombuffer(collector.lats, dtype=np.float64)
+
+    print(f"\t -> Projecting {len(refs):,} nodes from {len(sizes):,} ways to EPSG:{EPSG}")
+    transformer = Transformer.from_crs("EPSG:4326", f"EPSG:{EPSG}", always_xy=True)
+    x, y = transformer.transform(lons, lats)
+
+    if not len(sizes):
+        print(f"\t -> No '{network_type}' ways found, nothing to import")
+        return None
+
+    way_idx, starts, ends = split_ways_at_intersections(refs, sizes)
+    print(f"\t -> Split into {len(way_idx):,} edges")
+
+    if bbox:
+        # Drop the edges that leave the bbox, which osmnx does by removing the nodes outside of it
+        north, south, east, west = bbox
+        inside = (west <= lons) & (lons <= east) & (south <= lats) & (lats <= north)
+        within = inside[starts] & inside[ends]
+
+        way_idx, starts, ends = way_idx[within], starts[within], ends[within]
+        print(f"\t -> Kept {len(way_idx):,} edges that start and end within the bbox")
+
+        if not len(way_idx):
+            print(f"\t -> No '{network_type}' edges within the bbox, nothing to import")
+            return None
+
+    column_types = {
+        "uid": "BIGINT",
+        "u": "BIGINT",
+        "v": "BIGINT",
+        "key": "BIGINT",
+        "osmid": "BIGINT",
+        **{tag: "TEXT" for tag in TAG_COLUMNS},
+        "length": "DOUBLE PRECISION",
+        "osmuuid": "UUID",
+        "geom": f"GEOMETRY(LineString, {EPSG})",
+    }
+
+    for chunk_start in range(0, len(way_idx), chunk_size):
+        chunk = slice(chunk_start, chunk_start + chunk_size)
+        chunk_ways, chunk_starts, chunk_ends = way_idx[chunk], starts[chunk], ends[chunk]
+
+        # Gather the vertices of every edge in the chunk, one edge after another
+        num_vertices = chunk_ends - chunk_starts + 1
+        edge_ids = np.repeat(np.arange(len(chunk_starts)), num_vertices)
+        offsets = np.cumsum(num_vertices) - num_vertices
+        vertices = np.repeat(chunk_starts - offsets, num_vertices) + np.arange(len(edge_ids))
+
+        geoms = shapely.linestrings(x[vertices], y[vertices], indices=edge_ids)
+
+        df = pd.DataFrame(
+            {
+                "uid": np.arange(chunk_start + 1, chunk_start + len(chunk_starts) + 1),
+                "u": refs[chunk_starts],
+                "v": refs[chunk_ends],
+                "key": 0,
+                "osmid": osmids[chunk_ways],
+                **{tag: values[chunk_ways] for tag, values in tags.items()},
+                "length": shapely.length(geoms),
+                "osmuuid": [str(uuid.uuid4()) for _ in range(len(chunk_starts))],
+                "geom": shapely.to_wkb(
+                    shapely.set_srid(geoms, EPSG), hex=True, include_srid=True
+                ),
+            }
+        )
+
+        copy_dataframe(
+            db,
+            df,
+            tablename,
+            column_types,
+            if_exists="replace" if chunk_start == 0 else "append",
+        )
+
+        print(f"\t -> Loaded {min(chunk_start + chunk_size, len(way_idx)):,} edges")
+
+    print("\t -> Adding primary key and spatial index")
+    db.execute(
+        f"""
+        ALTER TABLE {tablename} ADD PRIMARY KEY (uid);
+        CREATE INDEX IF NOT EXISTS {tablename}_geom_idx ON {tablename} USING GIST (geom);
+        ANALYZE {tablename};
+    """
+    )
+
+    print(f"\t -> ... import complete in {time.perf_counter() - start_time:.1f} seconds")
@@ -1,5 +1,32 @@
 from pg_data_etl import Database
 
+from network_routing.database.indexes import provision_indexes, table_indexes
+
+
+# Edge tables that get their own node table, and what to call it
+NODE_TABLES = {
+    "osm_edges_all_no_motorway": {
+        "new_table_name": "nodes_for_osm_all",
+        "uid_col": "node_id",
+    },
+    # "osm_edges_drive_no_motorway": {
+    #     "new_table_name": "nodes_for_osm_drive",
+    #     "uid_col": "node_id",
+    # },
+    "pedestriannetwork_lines": {
+        "new_table_name": "nodes_for_sidewalks",
+        "uid_col": "sw_node_id",
+    },
+    "improvements.montgomery_split": {
+        "new_table_name": "improvements.montco_new_nodes",
+        "uid_col": "node_id",
+    },
+    "lowstress_islands": {
+        "new_table_name": "nodes_for_lowstress_islands",
+        "uid_col": "node_id",
+    },
+}
+
 
 def generate_nodes(db: Database, edge_tbl: str, geotable_kwargs: dict):
     """
@@ -17,3 +44,18 @@ def generate_nodes(db: Database, edge_tbl: str, geotable_kwargs: dict):
     """
 
     db.gis_make_geotable_from_query(node_query, **geotable_kwargs)
+
+
+def make_nodes_for_edge_table(db: Database, edge_tablename: str):
+    """
+    Generate the node table configured for `edge_tablename` in `NODE_TABLES`,
+    with the indexes that the routing queries use
+    """
+
+    kwargs = dict(NODE_TABLES[edge_tablename], geom_type="Point", epsg=26918)
+
+    provision_indexes(db, table_indexes(edge_tablename))
+
+    generate_nodes(db, edge_tablename, kwargs)
+
+    provision_indexes(db, table_indexes(kwargs["new_table_name"], keys=[kwargs["uid_col"]]))
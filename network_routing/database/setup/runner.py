@@ -0,0 +1,460 @@
+"""
+runner.py
+---------
+
+Run every `build-secondary` patch and node build as a dependency graph.
+
+Each step in `SETUP_STEPS` lists:
+
+- `run`: the function that does the work, which makes its own database connection
+- `code`: modules whose source code the step runs, including any helpers it calls
+- `after`: steps that have to finish first, because they make tables this step reads
+- `inputs`: glob patterns for the input files it reads, relative to `GDRIVE_DATA`
+- `env_files` (optional): environment variables that can point the step at an input file
+- `tables`: tables it reads, whether they come from `build-initial` or another step
+- `outputs`: tables it makes
+
+Steps whose upstream steps are done are run at the same time in separate processes.
+Before a step runs, its inputs are fingerprinted: the contents of every input file,
+the source code of the step, and the catalog version of every upstream table.
+If the fingerprint matches the last successful run and every output table
+still exists, the step is skipped. Fingerprints are kept in `./data/setup_state.json`.
+
+Examples:
+    ```python
+    >>> from network_routing.database.setup.runner import run_setup_steps
+    >>> run_setup_steps(workers=4)
+    ```
+
+"""
+from __future__ import annotations
+
+import hashlib
+import importlib
+import inspect
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from datetime import datetime
+from pathlib import Path
+
+from pg_data_etl import Database, helpers
+
+from network_routing import pg_db_connection, GDRIVE_DATA
+from network_routing.database import instrumentation
+from network_routing.database.setup.make_nodes import make_nodes_for_edge_table
+from network_routing.database.setup.setup_01_initial_accessscore_pois import (
+    setup_01_updated_ridescore_inputs,
+)
+from network_routing.database.setup.setup_02_osm_drive import setup_02_import_osm_drive_network
+from network_routing.database.setup.setup_03_more_inputs import setup_03_import_mode_data
+from network_routing.database.setup.setup_04_osm_without_motorway import (
+    setup_04_remove_motorways_from_osm,
+)
+from network_routing.database.setup.setup_05_lts_and_mcpc_inputs import (
+    setup_05_import_mcpc_and_lts_shapefiles,
+)
+from network_routing.database.setup.setup_06_more_accessscore_inputs import (
+    setup_06_more_accessscore_inputs,
+)
+from network_routing.database.setup.setup_07_mcpc_srts_projects import (
+    setup_07_import_srts_projects,
+)
+from network_routing.database.setup.setup_08_septa_request import setup_08_import_septa_data
+from network_routing.database.setup.setup_09_part import setup_09_import_part_data
+from network_routing.database.setup.setup_10_merge_accesscore_w_regional_transit import (
+    setup_10_merge_accessscore_w_regional_stops,
+)
+from network_routing.database.setup.setup_11_docks import setup_11_import_docks_data
+from network_routing.database.setup.setup_12_delco_trailheads import (
+    setup_12_import_delco_trailheads,
+)
+from network_routing.database.setup.setup_13_regional_rail_master_plan import (
+    setup_13_regional_rail_master_plan,
+)
+from network_routing.database.setup.setup_14_eta_schools import setup_14_eta_schools
+
+
+STATE_PATH = Path("./data/setup_state.json")
+
+
+def make_osm_all_nodes():
+    make_nodes_for_edge_table(pg_db_connection(), "osm_edges_all_no_motorway")
+
+
+def make_sidewalk_nodes():
+    make_nodes_for_edge_table(pg_db_connection(), "pedestriannetwork_lines")
+
+
+def make_lowstress_island_nodes():
+    make_nodes_for_edge_table(pg_db_connection(), "lowstress_islands")
+
+
+# Modules that the node builds run, instead of this one
+NODE_CODE = [
+    "network_routing.database.setup.make_nodes",
+    "network_routing.database.indexes",
+]
+
+SETUP_STEPS = {
+    "1": {
+        "run": setup_01_updated_ridescore_inputs,
+        "code": ["network_routing.database.setup.setup_01_initial_accessscore_pois"],
+        "after": [],
+        "inputs": ["inputs/AccessScore pois/station_pois_for_*"],
+        "tables": ["passengerrailstations"],
+        "outputs": ["ridescore_transit_poi_sw", "ridescore_transit_poi_osm", "ridescore_pois"],
+    },
+    "2": {
+        "run": setup_02_import_osm_drive_network,
+        "code": [
+            "network_routing.database.setup.setup_02_osm_drive",
+            "network_routing.database.setup.get_osm",
+            "network_routing.database.setup.get_osm_pbf",
+            "network_routing.database.bulk_import",
+        ],
+        "after": [],
+        "inputs": [],
+        "env_files": ["OSM_PBF_PATH"],
+        "tables": [],
+        "outputs": ["osm_edges_drive"],
+    },
+    "3": {
+        "run": setup_03_import_mode_data,
+        "code": ["network_routing.database.setup.setup_03_more_inputs"],
+        "after": [],
+        "inputs": ["inputs/ETA pois/eta_essential_services.*"],
+        "tables": ["regional_counties"],
+        "outputs": ["eta_points", "eta_montgomery"],
+    },
+    "4": {
+        "run": setup_04_remove_motorways_from_osm,
+        "code": ["network_routing.database.setup.setup_04_osm_without_motorway"],
+        "after": ["2"],
+        "inputs": [],
+        "tables": ["osm_edges_all", "osm_edges_drive"],
+        "outputs": ["osm_edges_all_no_motorway", "osm_edges_drive_no_motorway"],
+    },
+    "5": {
+        "run": setup_05_import_mcpc_and_lts_shapefiles,
+        "code": ["network_routing.database.setup.setup_05_lts_and_mcpc_inputs"],
+        "after": ["3"],
+        "inputs": ["inputs/MCPC pois/**/*", "inputs/LTS Base/**/*"],
+        "tables": ["regional_transit_stops", "regional_counties", "eta_montgomery"],
+        "outputs": ["mcpc_combined_pois", "mcpc_school_pois", "lowstress_islands"],
+    },
+    "6": {
+        "run": setup_06_more_accessscore_inputs,
+        "code": ["network_routing.database.setup.setup_06_more_accessscore_inputs"],
+        "after": ["1"],
+        "inputs": ["inputs/AccessScore pois/AccessScoreStations_062521.*"],
+        "tables": ["ridescore_pois"],
+        "outputs": ["access_score_pois", "access_score_final_poi_set"],
+    },
+    "7": {
+        "run": setup_07_import_srts_projects,
+        "code": ["network_routing.database.setup.setup_07_mcpc_srts_projects"],
+        "after": [],
+        "inputs": ["inputs/MCPC SRTS lines/MCPC_SRTS_Recs_Post_manual_edits.*"],
+        "tables": [],
+        "outputs": ["mcpc_srts_projects"],
+    },
+    "8": {
+        "run": setup_08_import_septa_data,
+        "code": ["network_routing.database.setup.setup_08_septa_request"],
+        "after": [],
+        "inputs": ["inputs/SEPTA request/**/*"],
+        "tables": [],
+        "outputs": ["pois_for_septa_tod_analysis"],
+    },
+    "9": {
+        "run": setup_09_import_part_data,
+        "code": ["network_routing.database.setup.setup_09_part"],
+        "after": [],
+        "inputs": ["inputs/PART/**/*"],
+        "tables": [],
+        "outputs": ["part"],
+    },
+    "10": {
+        "run": setup_10_merge_accessscore_w_regional_stops,
+        "code": ["network_routing.database.setup.setup_10_merge_accesscore_w_regional_transit"],
+        "after": ["6"],
+        "inputs": [],
+        "tables": ["regional_transit_stops", "access_score_final_poi_set"],
+        "outputs": ["regional_transit_with_accessscore"],
+    },
+    "11": {
+        "run": setup_11_import_docks_data,
+        "code": ["network_routing.database.setup.setup_11_docks"],
+        "after": [],
+        "inputs": ["inputs/Docks/**/*"],
+        "tables": [],
+        "outputs": ["docks"],
+    },
+    "12": {
+        "run": setup_12_import_delco_trailheads,
+        "code": ["network_routing.database.setup.setup_12_delco_trailheads"],
+        "after": [],
+        "inputs": ["inputs/Delco Trail Project/**/*.geojson"],
+        "tables": [],
+        "outputs": ["delco_trailheads"],
+    },
+    "13": {
+        "run": setup_13_regional_rail_master_plan,
+        "code": ["network_routing.database.setup.setup_13_regional_rail_master_plan"],
+        "after": ["6"],
+        "inputs": [],
+        "tables": ["access_score_final_poi_set"],
+        "outputs": ["regional_rail_master_plan_pois"],
+    },
+    "14": {
+        "run": setup_14_eta_schools,
+        "code": ["network_routing.database.setup.setup_14_eta_schools"],
+        "after": ["3"],
+        "inputs": [],
+        "tables": ["eta_points"],
+        "outputs": ["eta_schools"],
+    },
+    "nodes-osm-all": {
+        "run": make_osm_all_nodes,
+        "code": NODE_CODE,
+        "after": ["4"],
+        "inputs": [],
+        "tables": ["osm_edges_all_no_motorway"],
+        "outputs": ["nodes_for_osm_all"],
+    },
+    "nodes-sidewalks": {
+        "run": make_sidewalk_nodes,
+        "code": NODE_CODE,
+        "after": [],
+        "inputs": [],
+        "tables": ["pedestriannetwork_lines"],
+        "outputs": ["nodes_for_sidewalks"],
+    },
+    "nodes-lowstress-islands": {
+        "run": make_lowstress_island_nodes,
+        "code": NODE_CODE,
+        "after": ["5"],
+        "inputs": [],
+        "tables": ["lowstress_islands"],
+        "outputs": ["nodes_for_lowstress_islands"],
+    },
+}
+
+
+def table_versions(db: Database, tables: list) -> dict:
+    """
+    - Get a cheap version stamp for each table, without reading the table itself
+    - The stamp is the table's OID and file node, which change when it's dropped, replaced
+    or rewritten, plus the insert/update/delete counters from the statistics collector
+
+    Returns:
+        dict: keyed on table name, with the version stamp or None if the table doesn't exist
+    """
+    versions = {}
+
+    for tablename in tables:
+        schema, tbl = helpers.convert_full_tablename_to_parts(tablename)
+
+        result = db.query_as_list_of_lists(
+            f"""
+            SELECT c.oid, c.relfilenode, s.n_tup_ins, s.n_tup_upd, s.n_tup_del
+            FROM pg_class c
+            JOIN pg_namespace n ON n.oid = c.relnamespace
+            LEFT JOIN pg_stat_user_tables s ON s.relid = c.oid
+            WHERE n.nspname = '{schema}' AND c.relname = '{tbl}'
+        """
+        )
+
+        versions[tablename] = "-".join(str(x) for x in result[0]) if result else None
+
+    return versions
+
+
+def file_hashes(patterns: list) -> dict:
+    """
+    - Hash the contents of every file that matches the glob patterns, relative to `GDRIVE_DATA`
+
+    Returns:
+        dict: keyed on the relative filepath, with the sha256 of its contents
+    """
+    hashes = {}
+
+    for pattern in patterns:
+        for filepath in sorted(GDRIVE_DATA.glob(pattern)):
+            if not filepath.is_file():
+                continue
+
+            hashes[str(filepath.relative_to(GDRIVE_DATA))] = _sha256(filepath)
+
+    return hashes
+
+
+def env_file_hashes(variables: list) -> dict:
+    """
+    - Hash the file that each environment variable points to, if it's set
+
+    Returns:
+        dict: keyed on the variable, with its value and the sha256 of the file, or None if unset
+    """
+    hashes = {}
+
+    for variable in variables:
+        value = os.getenv(variable)
+        hashes[variable] = [value, _sha256(Path(value))] if value else None
+
+    return hashes
+
+
+def _sha256(filepath: Path) -> str:
+    sha = hashlib.sha256()
+    with open(filepath, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            sha.update(block)
+
+    return sha.hexdigest()
+
+
+def step_fingerprint(db: Database, step_id: str) -> str:
+    """
+    - Hash everything a step reads: its input files (including any set through the environment),
+    its upstream tables and the source code of every module in its `code` list
+    """
+    step = SETUP_STEPS[step_id]
+
+    fingerprint = {
+        "files": file_hashes(step["inputs"]),
+        "env_files": env_file_hashes(step.get("env_files", [])),
+        "tables": table_versions(db, step["tables"]),
+        "code": {
+            module: hashlib.sha256(
+                inspect.getsource(importlib.import_module(module)).encode()
+            ).hexdigest()
+            for module in step["code"]
+        },
+    }
+
+    return hashlib.sha256(json.dumps(fingerprint, sort_keys=True).encode()).hexdigest()
+
+
+def _run_step(step_id: str) -> float:
+    """Run a single step in a worker process, and return how long it took"""
+    start_time = time.perf_counter()
+
+    try:
+        SETUP_STEPS[step_id]["run"]()
+    finally:
+        # Pool workers never run atexit hooks, so write this step's SQL profile now
+        if instrumentation.profiling_enabled():
+            instrumentation.flush_profile(label=f"step_{step_id}")
+
+    return time.perf_counter() - start_time
+
+
+def run_setup_steps(
+    workers: int = 4,
+    force: bool = False,
+    dry_run: bool = False,
+    state_path: Path = STATE_PATH,
+) -> dict:
+    """
+    - Run every step in `SETUP_STEPS`, as many at a time as their dependencies allow
+    - A step that fails stops everything downstream of it, but the other branches keep going
+
+    Arguments:
+        workers (int): number of steps to run at the same time
+        force (bool): flag to run every step, even if its inputs haven't changed
+        dry_run (bool): flag to print what would run without running anything
+        state_path (Path): JSON file that holds the fingerprint of each step's last successful run
+
+    Returns:
+        dict: keyed on step ID, with `ran`, `skipped`, `failed` or `blocked`
+    """
+    db = pg_db_connection()
+
+    state_path = Path(state_path)
+    state = json.loads(state_path.read_text()) if state_path.exists() else {}
+
+    def save_state():
+        state_path.parent.mkdir(parents=True, exist_ok=True)
+        state_path.write_text(json.dumps(state, indent=2))
+
+    status = {}
+    # A step only counts as changed for this run if it actually ran
+    changed = set()
+    fingerprints = {}
+    running = {}
+
+    start_time = time.perf_counter()
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        while len(status) < len(SETUP_STEPS):
+
+            for step_id, step in SETUP_STEPS.items():
+                if step_id in status or step_id in running.values():
+                    continue
+
+                upstream = [status.get(up) for up in step["after"]]
+
+                if any(s in ("failed", "blocked") for s in upstream):
+                    print(f"Step {step_id}: blocked by a failed upstream step")
+                    status[step_id] = "blocked"
+                    continue
+
+                if not all(s in ("ran", "skipped") for s in upstream):
+                    continue
+
+                fingerprints[step_id] = step_fingerprint(db, step_id)
+
+                outputs_exist = all(table_versions(db, step["outputs"]).values())
+                upstream_changed = any(up in changed for up in step["after"])
+                unchanged = state.get(step_id, {}).get("fingerprint") == fingerprints[step_id]
+
+                if not force and unchanged and outputs_exist and not upstream_changed:
+                    print(f"Step {step_id}: inputs unchanged, skipping")
+                    status[step_id] = "skipped"
+                    continue
+
+                if dry_run:
+                    print(f"Step {step_id}: would run")
+                    status[step_id] = "ran"
+                    changed.add(step_id)
+                    continue
+
+                print(f"Step {step_id}: starting")
+                running[executor.submit(_run_step, step_id)] = step_id
+
+            if not running:
+                continue
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+
+            for future in done:
+                step_id = running.pop(future)
+
+                try:
+                    seconds = future.result()
+                except Exception as e:
+                    print(f"Step {step_id}: FAILED - {e!r}")
+                    status[step_id] = "failed"
+                    continue
+
+                print(f"Step {step_id}: finished in {seconds:.1f} seconds")
+                status[step_id] = "ran"
+                changed.add(step_id)
+
+                state[step_id] = {
+                    "fingerprint": fingerprints[step_id],
+                    "finished": datetime.now().isoformat(timespec="seconds"),
+                    "seconds": round(seconds, 1),
+                }
+                save_state()
+
+    counts = {s: list(status.values()).count(s) for s in ("ran", "skipped", "failed", "blocked")}
+    print(
+        f"Setup finished in {time.perf_counter() - start_time:.1f} seconds: "
+        + ", ".join(f"{n} {s}" for s, n in counts.items())
+    )
+
+    return status
@@ -8,6 +8,7 @@ from geopandas import GeoDataFrame
 from pg_data_etl import Database
 from philly_transit_data import TransitData
 from network_routing.database.setup.get_osm import import_osm_for_dvrpc_region
+from network_routing.database.bulk_import import import_geodataframe
 
 
 def explode_gdf_if_multipart(gdf: GeoDataFrame) -> GeoDataFrame:
@@ -58,7 +59,7 @@ def import_data_from_portal(db: Database):
 
             sql_tablename = tbl.lower()
 
-            db.import_geodataframe(gdf, sql_tablename, gpd_kwargs={"if_exists": "replace"})
+            import_geodataframe(db, gdf, sql_tablename, if_exists="replace")
 
 
 def create_new_geodata(db: Database):
@@ -99,9 +100,7 @@ def setup_00_initial(local_db: Database):
 
     stops = stops.to_crs("EPSG:26918")
 
-    local_db.import_geodataframe(
-        stops, "regional_transit_stops", gpd_kwargs={"if_exists": "replace"}
-    )
+    import_geodataframe(local_db, stops, "regional_transit_stops", if_exists="replace")
 
     # 4) Import OSM data for the entire region
     import_osm_for_dvrpc_region(local_db, network_type="all")
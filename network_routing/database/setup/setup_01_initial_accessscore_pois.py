@@ -1,4 +1,5 @@
 from network_routing import pg_db_connection, GDRIVE_DATA
+from network_routing.database.bulk_import import import_geofile
 
 
 def setup_01_updated_ridescore_inputs():
@@ -14,12 +15,7 @@ def setup_01_updated_ridescore_inputs():
     for filename_part in ["sw", "osm"]:
         filepath = data_folder / f"station_pois_for_{filename_part}.shp"
 
-        db.import_gis(
-            method="geopandas",
-            filepath=filepath,
-            sql_tablename=f"ridescore_transit_poi_{filename_part}",
-            gpd_kwargs={"if_exists": "replace"},
-        )
+        import_geofile(db, filepath, f"ridescore_transit_poi_{filename_part}", if_exists="replace")
 
     # Feature engineering to build a single table with all points combined
     query = """
@@ -1,4 +1,5 @@
 from network_routing import pg_db_connection, GDRIVE_DATA
+from network_routing.database.bulk_import import import_geofile
 
 
 def setup_03_import_mode_data():
@@ -9,9 +10,7 @@ def setup_03_import_mode_data():
 
     db = pg_db_connection()
 
-    db.import_gis(
-        sql_tablename="eta_points", filepath=shp_path, gpd_kwargs={"if_exists": "replace"}
-    )
+    import_geofile(db, shp_path, "eta_points", if_exists="replace")
 
     # Generate a cut of the ETA points for each of the nine counties
 
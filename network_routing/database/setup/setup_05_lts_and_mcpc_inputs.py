@@ -1,4 +1,5 @@
 from network_routing import pg_db_connection, GDRIVE_DATA
+from network_routing.database.bulk_import import import_geofile
 
 
 def setup_05_import_mcpc_and_lts_shapefiles():
@@ -23,12 +24,7 @@ def setup_05_import_mcpc_and_lts_shapefiles():
             if f"public.{sql_tablename}" not in existing_tables:
 
                 print(f"\tShapefile: {shp.stem}")
-                db.import_gis(
-                    filepath=shp,
-                    sql_tablename=sql_tablename,
-                    explode=True,
-                    gpd_kwargs={"if_exists": "replace"},
-                )
+                import_geofile(db, shp, sql_tablename, if_exists="replace", explode=True)
 
     # Use SQL queries to combine individual tables together
     query = """
@@ -1,4 +1,5 @@
 from network_routing import pg_db_connection, GDRIVE_DATA
+from network_routing.database.bulk_import import import_geofile
 
 
 def setup_06_more_accessscore_inputs():
@@ -9,9 +10,7 @@ def setup_06_more_accessscore_inputs():
 
     shp_path = GDRIVE_DATA / "inputs/AccessScore pois/AccessScoreStations_062521.shp"
 
-    db.import_gis(
-        filepath=shp_path, sql_tablename="access_score_pois", gpd_kwargs={"if_exists": "replace"}
-    )
+    import_geofile(db, shp_path, "access_score_pois", if_exists="replace")
 
     query = """
         select 
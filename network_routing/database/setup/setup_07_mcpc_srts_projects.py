@@ -1,4 +1,5 @@
 from network_routing import pg_db_connection, GDRIVE_DATA
+from network_routing.database.bulk_import import import_geofile
 
 
 def setup_07_import_srts_projects():
@@ -9,9 +10,7 @@ def setup_07_import_srts_projects():
 
     shp_path = GDRIVE_DATA / "inputs/MCPC SRTS lines/MCPC_SRTS_Recs_Post_manual_edits.shp"
 
-    db.import_gis(
-        filepath=shp_path, sql_tablename="mcpc_srts_projects", gpd_kwargs={"if_exists": "replace"}
-    )
+    import_geofile(db, shp_path, "mcpc_srts_projects", if_exists="replace")
 
 
 if __name__ == "__main__":
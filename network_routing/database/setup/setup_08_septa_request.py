@@ -1,4 +1,5 @@
 from network_routing import pg_db_connection, GDRIVE_DATA
+from network_routing.database.bulk_import import import_geofile
 
 
 def setup_08_import_septa_data():
@@ -14,7 +15,7 @@ def setup_08_import_septa_data():
     for shp_filepath in data_folder.rglob("*.shp"):
         print(shp_filepath.stem)
 
-        db.import_gis(filepath=shp_filepath, sql_tablename=shp_filepath.stem.lower())
+        import_geofile(db, shp_filepath, shp_filepath.stem.lower())
 
     # Run a query that combines all three tables into one singular table
     # the 'stop_id' column across all three tables should be unique
@@ -1,4 +1,5 @@
 from network_routing import pg_db_connection, GDRIVE_DATA
+from network_routing.database.bulk_import import import_geofile
 
 
 def setup_11_import_docks_data():
@@ -10,9 +11,7 @@ def setup_11_import_docks_data():
 
     shapefile_folder = GDRIVE_DATA / "inputs/Docks"
     for shp in shapefile_folder.rglob("*.shp"):
-        db.import_gis(
-            filepath=shp, sql_tablename=shp.stem.lower(), gpd_kwargs={"if_exists": "replace"}
-        )
+        import_geofile(db, shp, shp.stem.lower(), if_exists="replace")
 
     # Clean up the point layer:
     # remove the 'level_0' column from the raw data
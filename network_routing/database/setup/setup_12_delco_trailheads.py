@@ -1,4 +1,5 @@
 from network_routing import pg_db_connection, GDRIVE_DATA
+from network_routing.database.bulk_import import import_geofile
 
 
 def setup_12_import_delco_trailheads():
@@ -11,9 +12,7 @@ def setup_12_import_delco_trailheads():
     shapefile_folder = GDRIVE_DATA / "inputs/Delco Trail Project"
     for shp in shapefile_folder.rglob("*.geojson"):
         print(shp)
-        db.import_gis(
-            filepath=shp, sql_tablename=shp.stem.lower(), gpd_kwargs={"if_exists": "replace"}
-        )
+        import_geofile(db, shp, shp.stem.lower(), if_exists="replace")
 
         db.gis_table_update_spatial_data_projection(
             "delco_trailheads", old_epsg=4326, new_epsg=26918, geom_type="Point"
@@ -29,6 +29,7 @@ Examples:
     isochrones                Turn access results into isochrone polygons
     scrub-osm-tags            Clean 'highway' tags in the OSM data
     sidewalkscore             Calculate the SidewalkScore for each rail stop
+    update-islands            Merge new edges from EDGE_TABLE into the...
     ```
 
 """
@@ -36,11 +37,13 @@ Examples:
 import click
 
 from network_routing import pg_db_connection
+from network_routing.database.indexes import provision_indexes, table_indexes
 
 from network_routing.gaps.segments.centerline_sidewalk_coverage import (
     classify_centerlines,
 )
 from network_routing.gaps.segments.generate_islands import generate_islands
+from network_routing.gaps.segments.island_index import IslandIndex
 
 from network_routing.gaps.data_viz.handle_osm_tags import (
     scrub_osm_tags as _scrub_osm_tags,
@@ -53,6 +56,8 @@ from network_routing.gaps.data_viz.access_score_results import (
     main as access_score_results_main,
 )
 from network_routing.gaps.data_viz.eta_isochrones import IsochroneGenerator
+from network_routing.gaps.data_viz.edge_walksheds import generate_walksheds
+from network_routing.gaps.data_viz.isochrone_cache import IsochroneCache
 
 
 @click.group()
@@ -61,12 +66,35 @@ def main():
     pass
 
 
+def _provision_isochrone_indexes(db, node_tables: list = ()) -> None:
+    """
+    - Index the isochrone cache on `network`, which every cache lookup filters on,
+    and each node table on the ID column that the hull queries join on
+
+    Arguments:
+        db (Database): analysis database
+        node_tables (list): `(tablename, node_id_col)` pairs, for isochrones built from node lists
+    """
+    specs = table_indexes(IsochroneCache(db).tablename, geom=None, keys=["network"])
+
+    for tablename, node_id_col in node_tables:
+        specs += table_indexes(tablename, keys=[node_id_col])
+
+    provision_indexes(db, specs)
+
+
 @click.command()
 def classify_osm_sw_coverage():
     """Classify OSM w/ length of parallel sidewalks"""
 
     db = pg_db_connection()
 
+    provision_indexes(
+        db,
+        table_indexes("osm_edges_drive", keys=["uid"])
+        + table_indexes("pedestriannetwork_lines", keys=["line_type"]),
+    )
+
     classify_centerlines(db, "osm_edges_drive")
 
 
@@ -76,18 +104,48 @@ def identify_islands():
 
     db = pg_db_connection()
 
+    provision_indexes(db, table_indexes("pedestriannetwork_lines", keys=["objectid"]))
+
     generate_islands(db)
 
 
 @click.command()
-def isochrones_accessscore():
+@click.argument("edge_table")
+@click.option("--id-col", default="uid", help="Unique ID column in EDGE_TABLE")
+@click.option("--where", default=None, help="Optional filter for EDGE_TABLE")
+@click.option("--dry-run/--no-dry-run", default=False)
+def update_islands(edge_table, id_col, where, dry_run):
+    """Merge new edges from EDGE_TABLE into the existing islands"""
+
+    db = pg_db_connection()
+
+    index = IslandIndex(db)
+    summary = index.add_edges(edge_table, id_col=id_col, where=where, dry_run=dry_run)
+
+    for k, v in summary.items():
+        print(f"\t -> {k} = {v}")
+
+
+@click.command()
+@click.option(
+    "--miles",
+    multiple=True,
+    type=float,
+    help="Cutoff distance in miles. Use more than once to get nested bands in one pass",
+)
+def isochrones_accessscore(miles):
     """
     Make 'Access Score' isos & POIs with stats
     """
 
     db = pg_db_connection()
 
-    generate_isochrones(db)
+    _provision_isochrone_indexes(db)
+
+    if miles:
+        generate_isochrones(db, sw_cutoff=list(miles), osm_cutoff=list(miles))
+    else:
+        generate_isochrones(db)
 
     query = """
         select
@@ -101,6 +159,30 @@ def isochrones_accessscore():
     calculate_sidewalkscore(db, query)
 
 
+@click.command()
+@click.option("--workers", default=1, help="Number of threads for the buffer geometry work")
+def walksheds_accessscore(workers):
+    """
+    Make 'Access Score' line & polygon walksheds from network edges
+    """
+
+    db = pg_db_connection()
+
+    generate_walksheds(db, workers=workers)
+
+
+@click.command()
+@click.option("--network", default=None, help="Only clear isochrones built from this table")
+def clear_isochrone_cache(network):
+    """
+    Force isochrones to be rebuilt on the next run
+    """
+
+    db = pg_db_connection()
+
+    IsochroneCache(db).clear(network)
+
+
 @click.command()
 def accessscore_line_results():
     """
@@ -130,13 +212,27 @@ def isochrones_mcpc():
         "data_dir": "./data",
     }
 
+    _provision_isochrone_indexes(
+        db,
+        [
+            (args["network_a_nodes"], args["network_a_node_id_col"]),
+            (args["network_b_nodes"], args["network_b_node_id_col"]),
+        ],
+    )
+
     i = IsochroneGenerator(**args)
     i.save_isos_to_db()
     i.save_pois_with_iso_stats_to_db()
 
 
 @click.command()
-def isochrones_septa():
+@click.option(
+    "--miles",
+    multiple=True,
+    type=float,
+    help="Cutoff distance in miles. Use more than once to get nested bands in one pass",
+)
+def isochrones_septa(miles):
     """
     Make SEPTA isos & POIs with stats
 
@@ -154,9 +250,17 @@ def isochrones_septa():
         "network_b_nodes": "nodes_for_osm_all",
         "network_b_node_id_col": "node_id",
         "data_dir": "./data",
-        "distance_threshold_miles": 0.25,
+        "distance_threshold_miles": list(miles) if miles else 0.25,
     }
 
+    _provision_isochrone_indexes(
+        db,
+        [
+            (args["network_a_nodes"], args["network_a_node_id_col"]),
+            (args["network_b_nodes"], args["network_b_node_id_col"]),
+        ],
+    )
+
     i = IsochroneGenerator(**args)
     i.save_isos_to_db()
     i.save_pois_with_iso_stats_to_db()
@@ -170,6 +274,8 @@ def isochrones_part():
 
     db = pg_db_connection()
 
+    _provision_isochrone_indexes(db)
+
     # Generate isochrones
     iso_args = {
         "sidewalk_result_table": "part_sw.pois_results",
@@ -214,6 +320,8 @@ def isochrones_docks():
 
     db = pg_db_connection()
 
+    _provision_isochrone_indexes(db)
+
     # Generate isochrones
     iso_args = {
         "sidewalk_result_table": "docks_sw.docks_sidewalk_results",
@@ -251,37 +359,56 @@ def isochrones_docks():
 
 
 @click.command()
-def scrub_osm_tags():
+@click.option(
+    "--edge-table",
+    "edge_tables",
+    multiple=True,
+    default=["osm_edges_drive"],
+    help="OSM edge table to clean. Can be used more than once",
+)
+def scrub_osm_tags(edge_tables):
     """Clean 'highway' tags in the OSM data"""
 
     db = pg_db_connection()
 
-    _scrub_osm_tags(db)
+    for edge_table in edge_tables:
+        _scrub_osm_tags(db, edge_table=edge_table)
 
 
 @click.command()
-def isochrones_rrmp():
+@click.option(
+    "--miles",
+    multiple=True,
+    type=float,
+    help="Cutoff distance in miles. Use more than once to get nested bands in one pass",
+)
+def isochrones_rrmp(miles):
     """
     Make isochrones for the RR Master Plan
     """
 
     db = pg_db_connection()
 
+    _provision_isochrone_indexes(db)
+
     generate_isochrones(
         db,
         sidewalk_result_table="rrmp_sw.regional_rail_stops_results",
         osm_result_table="rrmp_lts.regional_rail_stops_results",
         output_tablename="data_viz.rrmp_isochrones",
-        sw_cutoff=0.75,
-        osm_cutoff=3.0,
+        sw_cutoff=list(miles) if miles else 0.75,
+        osm_cutoff=list(miles) if miles else 3.0,
     )
 
 
 _all_commands = [
     classify_osm_sw_coverage,
     identify_islands,
+    update_islands,
     scrub_osm_tags,
     isochrones_accessscore,
+    walksheds_accessscore,
+    clear_isochrone_cache,
     isochrones_mcpc,
     accessscore_line_results,
     isochrones_septa,
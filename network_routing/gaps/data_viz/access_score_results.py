@@ -1,10 +1,14 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
 import pandas as pd
 import geopandas as gpd
-from tqdm import tqdm
+import shapely
 
 from pg_data_etl import Database
 
 from network_routing import pg_db_connection, GDRIVE_DATA
+from network_routing.database.bulk_import import import_geodataframe
 
 # the RUNS dict contains the necessary tablenames/cutoff value
 # for each of the three analysis runs
@@ -27,50 +31,46 @@ RUNS = {
 }
 
 
-def geodataframe_of_result_for_single_poi(
-    db: Database,
-    dvrpc_id: int,
-    result_table: str,
-    edge_table: str,
-    id_column: str,
-    cutoff_minutes: float,
-) -> gpd.GeoDataFrame:
+def load_network_edges(db: Database, edge_table: str) -> gpd.GeoDataFrame:
     """
-    Get a multi-linestring output showing all edges that are within `cutoff_minutes`
-    of a given Access Score POI, identified by its `dvrpc_id`.
+    - Load the routable edges of a network, the same way `construct_network` does
 
-    Arguments:
+    Args:
         db (Database): analysis database
-        dvrpc_id (int): ID of the POI to analyze
-        result_table (str): name of the table with the node-level access analysis results
-        edge_table (str): name of the edge table that was used to generate the results
-        id_column (str): name of the column in the node table with IDs
-        cutoff_minutes (float): the number of minutes to use as threshold/cutoff
+        edge_table (str): name of the edge table, which must already have `start_id`, `end_id` and `minutes`
 
     Returns:
-        gpd.GeoDataFrame: with the multipart geometry and the associated POI ID
+        gpd.GeoDataFrame: one row per edge
+    """
+    query = f"""
+        SELECT start_id, end_id, minutes, geom
+        FROM {edge_table}
+        WHERE start_id IS NOT NULL
+        AND end_id IS NOT NULL
     """
+    return db.gdf(query)
+
 
-    matching_node_subquery = f"""
-        select {id_column}::int
-        from {result_table}
-        where n_1_{dvrpc_id} <= {cutoff_minutes}
+def load_node_results(db: Database, result_table: str, id_column: str = "node_id") -> pd.DataFrame:
     """
+    - Load every `n_1_*` column of a result table, indexed by node ID, without any geometry
 
-    query = f"""
-        select
-            '{dvrpc_id}' as dvrpc_id,
-            '{edge_table}' as src_network,
-            st_collect(i.geom) as geom
-        from
-            {edge_table} i
-        where 
-            i.end_id in ({matching_node_subquery})
-          and 
-            i.start_id in ({matching_node_subquery})
+    Args:
+        db (Database): analysis database
+        result_table (str): name of the table with the node-level access analysis results
+        id_column (str): name of the column in the result table with node IDs
+
+    Returns:
+        pd.DataFrame: one row per node, one column per POI
     """
+    n1_columns = [x for x in db.columns(result_table) if "n_1_" in x]
 
-    return db.gdf(query)
+    query = f"""
+        SELECT {id_column}::bigint AS node_id, {", ".join(n1_columns)}
+        FROM {result_table}
+        WHERE {id_column} IS NOT NULL
+    """
+    return db.df(query).set_index("node_id")
 
 
 def access_score_poi_ids(
@@ -97,49 +97,79 @@ def get_all_access_score_results_as_edges(
     """
     - Get results for all POIs for a given analysis network
     - Skip any IDs that didn't get a result on the network
+    - The node results and edges are each loaded once, and the edges for each POI are found
+    with a vectorized membership test on both endpoints instead of a query per POI
     """
 
     all_ids = access_score_poi_ids(db)
 
-    ids_in_table = [x.split("_")[-1] for x in db.columns(result_table) if "n_1_" in x]
-
-    results = []
-    no_results = []
-    for poi_id in tqdm(all_ids, total=len(all_ids)):
-
-        if str(poi_id) in ids_in_table:
-
-            gdf = geodataframe_of_result_for_single_poi(
-                db, poi_id, result_table, edge_table, id_column, cutoff_minutes
-            )
-
-            results.append(gdf)
+    result_df = load_node_results(db, result_table, id_column)
+    n1_columns = {x.split("_")[-1]: x for x in result_df.columns}
 
-        else:
-            no_results.append(poi_id)
+    poi_ids = [poi_id for poi_id in all_ids if str(poi_id) in n1_columns]
+    no_results = [poi_id for poi_id in all_ids if str(poi_id) not in n1_columns]
 
     if len(no_results) > 0:
         print(f"{edge_table} - no result for these POIs:")
         for uid in no_results:
             print(uid)
 
-    return pd.concat(results)
+    edge_gdf = load_network_edges(db, edge_table)
+
+    # One row per node, one column per POI. Nodes that aren't in the results
+    # have a position of -1, which lands on the trailing row of False values
+    minutes = result_df[[n1_columns[str(poi_id)] for poi_id in poi_ids]].to_numpy(dtype=float)
+    reachable = np.asfortranarray(
+        np.vstack([minutes <= cutoff_minutes, np.zeros((1, len(poi_ids)), dtype=bool)])
+    )
+
+    start_pos = result_df.index.get_indexer(edge_gdf["start_id"])
+    end_pos = result_df.index.get_indexer(edge_gdf["end_id"])
+
+    edge_idx = []
+    group_ids = []
+
+    for i in range(len(poi_ids)):
+        matches = np.flatnonzero(reachable[start_pos, i] & reachable[end_pos, i])
+        edge_idx.append(matches)
+        group_ids.append(np.full(len(matches), i))
+
+    edge_idx = np.concatenate(edge_idx) if edge_idx else np.array([], dtype=int)
+    group_ids = np.concatenate(group_ids) if group_ids else np.array([], dtype=int)
+
+    # Flatten any multipart edges and build every POI's multilinestring in one batch.
+    # POIs without any matching edges keep a null geometry, like `st_collect()` of no rows
+    geoms = np.asarray(edge_gdf.geometry.values)
+    parts, part_idx = shapely.get_parts(geoms[edge_idx], return_index=True)
+    parts_group = group_ids[part_idx]
+
+    collected = np.full(len(poi_ids), None, dtype=object)
+    has_edges = np.unique(parts_group)
+    if len(has_edges) > 0:
+        collected[has_edges] = shapely.multilinestrings(
+            parts, indices=np.searchsorted(has_edges, parts_group)
+        )
+
+    return gpd.GeoDataFrame(
+        {"dvrpc_id": [str(poi_id) for poi_id in poi_ids], "src_network": edge_table},
+        geometry=collected,
+        crs=edge_gdf.crs,
+    )
 
 
 def main():
     db = pg_db_connection()
 
-    all_results = pd.concat(
-        [
-            get_all_access_score_results_as_edges(db, **RUNS["osm"]),
-            get_all_access_score_results_as_edges(db, **RUNS["bike"]),
-            get_all_access_score_results_as_edges(db, **RUNS["ped"]),
-        ]
-    )
+    # Each network runs on its own thread, with its own database connection
+    with ThreadPoolExecutor(max_workers=len(RUNS)) as executor:
+        all_results = pd.concat(
+            executor.map(
+                lambda run: get_all_access_score_results_as_edges(pg_db_connection(), **run),
+                RUNS.values(),
+            )
+        )
 
-    db.import_geodataframe(
-        all_results, "data_viz.access_score_segments", gpd_kwargs={"if_exists": "replace"}
-    )
+    import_geodataframe(db, all_results, "data_viz.access_score_segments", if_exists="replace")
 
     output_path = GDRIVE_DATA / "outputs/access_score_network_results.shp"
     db.export_gis(
@@ -0,0 +1,63 @@
+import pandas as pd
+
+from pg_data_etl import Database
+
+from network_routing.accessibility.logic_isochrones import edge_walksheds
+from network_routing.database.bulk_import import import_geodataframe
+from network_routing.gaps.data_viz.access_score_results import (
+    RUNS,
+    load_network_edges,
+    load_node_results,
+)
+
+
+def generate_walksheds(
+    db: Database,
+    runs: dict = RUNS,
+    output_tablename: str = "data_viz.accessscore_walksheds",
+    buffer_meters: float = 45,
+    workers: int = 1,
+) -> None:
+    """
+    - Build line and polygon walksheds from the network edges for every POI in each run
+    - Edges and results are loaded once per network, and partial edges are cut at the cutoff
+
+    Args:
+        db (Database): analysis database
+        runs (dict): keyed on run name, each with an `edge_table`, `result_table` and `cutoff_minutes`
+        output_tablename (str): base name of the output tables, with schema
+        buffer_meters (float): distance to buffer the walkshed lines by
+        workers (int): number of threads to use for the buffer geometry work
+
+    Returns:
+        New SQL tables named `{output_tablename}_lines` and `{output_tablename}_polygons`
+    """
+
+    output_schema, _ = output_tablename.split(".")
+    db.execute(f"CREATE SCHEMA IF NOT EXISTS {output_schema};")
+
+    all_lines = []
+    all_polygons = []
+
+    for run in runs.values():
+        print(f"Generating walksheds for {run['result_table'].upper()}")
+
+        edge_gdf = load_network_edges(db, run["edge_table"])
+        result_df = load_node_results(db, run["result_table"], run.get("id_column", "node_id"))
+
+        lines, polygons = edge_walksheds(
+            edge_gdf, result_df, run["cutoff_minutes"], buffer_meters, workers
+        )
+
+        for gdf in [lines, polygons]:
+            gdf["src_network"] = run["edge_table"]
+
+        all_lines.append(lines)
+        all_polygons.append(polygons)
+
+    import_geodataframe(
+        db, pd.concat(all_lines), f"{output_tablename}_lines", if_exists="replace"
+    )
+    import_geodataframe(
+        db, pd.concat(all_polygons), f"{output_tablename}_polygons", if_exists="replace"
+    )
@@ -1,14 +1,20 @@
 from __future__ import annotations
 
+import numpy as np
 import pandas as pd
 import geopandas as gpd
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from tqdm import tqdm
 
 import pg_data_etl as pg
 
 from network_routing import pg_db_connection
+from network_routing.database.bulk_import import import_geodataframe
 from network_routing.accessibility.logic_analyze import get_unique_ids
+from network_routing.accessibility.logic_isochrones import nested_concave_hulls, nested_node_sets
+from network_routing.gaps.data_viz.isochrone_cache import IsochroneCache, node_fingerprint
+from network_routing.gaps.data_viz.make_single_isochrone import nested_hulls_sql
 
 
 class IsochroneGenerator:
@@ -28,9 +34,13 @@ class IsochroneGenerator:
         network_b_edges (str): name of network 'B's edge table
         network_b_nodes (str): name of network 'B's node table
         network_b_node_id_col (str): name of ID column in network 'B's node table
-        distance_threshold_miles (float): distance to use for isochrones. Defaults to 1.0
+        distance_threshold_miles (float | list): distance to use for isochrones, or a list of distances to get nested bands. Defaults to 1.0
         walking_speed_mph (float): Assumned walking speed of pedestrians, defaults to 2.5 mph
         data_dir (str): folder where outputs from earlier process were stored. Defaults to "./data"
+        in_memory (bool): build the hulls in Python from node geometries loaded once per network, instead of one PostGIS query per POI. Defaults to False
+        workers (int): number of threads to use when `in_memory=True`. Defaults to 1
+        read_workers (int): number of threads to use when reading the CSV results. Defaults to 8
+        use_cache (bool): only build isochrones whose node sets changed since they were last saved to `data_viz.isochrone_cache`. Defaults to True
 
 
     """
@@ -46,13 +56,29 @@ class IsochroneGenerator:
         network_b_edges: str,
         network_b_nodes: str,
         network_b_node_id_col: str,
-        distance_threshold_miles: float = 1.0,
+        distance_threshold_miles: float | list = 1.0,
         walking_speed_mph: float = 2.5,
         data_dir: str = "./data",
+        in_memory: bool = False,
+        workers: int = 1,
+        read_workers: int = 8,
+        use_cache: bool = True,
     ):
         self.db = db
+        self.in_memory = in_memory
+        self.workers = workers
+        self.read_workers = read_workers
+        self.cache = IsochroneCache(db) if use_cache else None
         self.data_dir = Path(data_dir)
-        self.minutes_cutoff = distance_threshold_miles * 60 / walking_speed_mph
+
+        if isinstance(distance_threshold_miles, (int, float)):
+            distance_threshold_miles = [distance_threshold_miles]
+
+        # Keyed on miles, with the matching cutoff in minutes
+        self.bands = {
+            miles: miles * 60 / walking_speed_mph for miles in sorted(set(distance_threshold_miles))
+        }
+        self.minutes_cutoff = max(self.bands.values())
         self.data_names = {
             "a": {
                 "edges": network_a_edges,
@@ -67,11 +93,9 @@ class IsochroneGenerator:
             "poi": {"table": poi_table, "id_col": poi_col},
         }
 
-        # Read all filenames for networks A and B
-        tables = {
-            "a": [x for x in self.data_dir.rglob(f"{network_a_edges}_*.csv")],
-            "b": [x for x in self.data_dir.rglob(f"{network_b_edges}_*.csv")],
-        }
+        # Index the data folder once. Only files directly within `data_dir` can match,
+        # so a set of those paths gives a constant-time lookup for each POI
+        csv_files = set(self.data_dir.glob("*.csv"))
 
         # For each POI ID, record A and B filepaths if they exist
         uids = get_unique_ids(db, poi_table, poi_col)
@@ -86,51 +110,107 @@ class IsochroneGenerator:
             a_path = self.data_dir / f"{network_a_edges}_{clean_id}.csv"
             b_path = self.data_dir / f"{network_b_edges}_{clean_id}.csv"
 
-            if a_path in tables["a"]:
+            if a_path in csv_files:
                 self.uid_results[uid]["a"] = a_path
 
-            if b_path in tables["b"]:
+            if b_path in csv_files:
                 self.uid_results[uid]["b"] = b_path
 
-        # For each ID, gather node lists or None
-        self.data = {
-            k: {"a": self.load_data(v["a"]), "b": self.load_data(v["b"])}
-            for k, v in self.uid_results.items()
-        }
+        # Node lists (one per band) or None for each ID, loaded lazily by `get_data()`
+        self._data = {}
+
+    @property
+    def data(self) -> dict:
+        """
+        - Node lists for every POI ID, keyed on network 'a' and 'b'
+        - Any files that haven't been read yet are loaded concurrently the first time this is used
+        """
+        self.load_all_data()
+
+        return self._data
+
+    def get_data(self, eta_uid: str) -> dict:
+        """
+        - Get the node lists for a single POI, reading its files from disk if they haven't been read yet
+
+        Arguments:
+            eta_uid (str): ID of the POI
+
+        Returns:
+            dict: keyed on network 'a' and 'b', with node lists or None
+        """
+        if eta_uid not in self._data:
+            paths = self.uid_results[eta_uid]
+            self._data[eta_uid] = {"a": self.load_data(paths["a"]), "b": self.load_data(paths["b"])}
+
+        return self._data[eta_uid]
+
+    def load_all_data(self) -> None:
+        """
+        - Read every CSV file that hasn't been read yet, using a pool of `self.read_workers` threads
+        - Only the filtered node tuples are kept, so each dataframe is released as soon as it's read
+        """
+        jobs = [
+            (uid, network_id, paths[network_id])
+            for uid, paths in self.uid_results.items()
+            if uid not in self._data
+            for network_id in ["a", "b"]
+        ]
+
+        if not jobs:
+            return
 
-    def load_data(self, filepath: Path | None) -> tuple | None:
+        with ThreadPoolExecutor(max_workers=self.read_workers) as executor:
+            results = executor.map(lambda job: self.load_data(job[2]), jobs)
+
+            for (uid, network_id, _), node_lists in zip(jobs, results):
+                self._data.setdefault(uid, {})[network_id] = node_lists
+
+    def load_data(self, filepath: Path | None) -> dict | None:
         """
         - Read CSV file from disk
         - Filter out rows beyond `self.minutes_cutoff`
+        - Sort the remaining nodes by travel time once, and slice off the nodes for each band
 
         Arguments:
             filepath (Path | None): filepath to CSV file or None value
 
         Returns:
-            tuple: if filepath is not None, read CSV with pandas and return a list of node IDs that meet the `minutes_cutoff`
+            dict: if filepath is not None, read CSV with pandas and return a tuple of node IDs that meet each band's cutoff, keyed on miles
         """
         if filepath:
-            # Read CSV
-            df = pd.read_csv(filepath)
+            # Read CSV, only parsing the columns we need
+            df = pd.read_csv(filepath, usecols=["node_id", "n_1"])
 
             # Filter to only include rows that are at or below the
-            # defined cutoff time in minutes
-            df = df[df["n_1"] <= self.minutes_cutoff]
+            # largest cutoff time in minutes
+            df = df[df["n_1"] <= self.minutes_cutoff].drop_duplicates(subset="node_id")
 
-            # Get a list of the remaining node id values as a tuple
-            nodes_as_tuple = tuple(df["node_id"].unique())
+            node_sets = nested_node_sets(
+                df["node_id"].to_numpy(),
+                df["n_1"].to_numpy(dtype=float),
+                list(self.bands.values()),
+            )
 
-            return nodes_as_tuple
+            # Get the node id values for each band as a tuple
+            return {
+                miles: tuple(node_sets[minutes].tolist()) for miles, minutes in self.bands.items()
+            }
 
         else:
             return None
 
-    def make_concave_hull(self, eta_uid: str) -> gpd.GeoDataFrame | None:
+    def make_concave_hull(
+        self, eta_uid: str, network_ids: list | None = None
+    ) -> gpd.GeoDataFrame | None:
         """
         - Generate a set of concave hulls for a single UID, using networks A and B
+        - One hull is made for each distance band, all in one query per network
+        with `nested_hulls_sql()`, so every band contains the ones inside it
 
         Arguments:
             eta_uid (str): ID of the POI
+            network_ids (list | None): networks to use, defaults to both 'a' and 'b'
 
         Returns:
             gpd.GeoDataFrame: polygons for both networks, if there are results
@@ -138,50 +218,50 @@ class IsochroneGenerator:
 
         # Only load node lists that exist. Skip 'None' values
         node_lists = {}
-        for network_id in ["a", "b"]:
-            data = self.data[eta_uid][network_id]
+        for network_id in network_ids or ["a", "b"]:
+            data = self.get_data(eta_uid)[network_id]
             if data:
                 node_lists[network_id] = data
 
         gdfs = []
 
-        for network_id, node_filter in node_lists.items():
+        for network_id, bands in node_lists.items():
             edge_table = self.data_names[network_id]["edges"]
             node_table = self.data_names[network_id]["nodes"]
             node_id_col = self.data_names[network_id]["node_id_col"]
 
-            num_nodes = len(node_filter)
-
-            if num_nodes > 0:
+            # Each band's node list is a prefix of the next one, so label every node
+            # with the smallest band it falls within
+            node_values = []
+            num_used = 0
+            for band, node_filter in enumerate(bands.values()):
+                node_values += [f"({node_id!r}, {band})" for node_id in node_filter[num_used:]]
+                num_used = len(node_filter)
+
+            if not node_values:
+                continue
+
+            rings = f"""
+                select '{eta_uid}' as poi_uid, 0 as poi_order, v.band, n.geom
+                from {node_table} n
+                join (values {", ".join(node_values)}) as v(node_id, band)
+                on n.{node_id_col} = v.node_id
+            """
 
-                # See: https://postgis.net/docs/ST_CollectionExtract.html
-                if num_nodes == 1:
-                    geom_idx = 1
-                    node_filter = f"({node_filter[0]})"
+            band_miles = ", ".join(f"({band}, {miles})" for band, miles in enumerate(bands))
 
-                elif num_nodes == 2:
-                    geom_idx = 2
+            query = f"""
+                select
+                    '{eta_uid}' as eta_uid,
+                    '{edge_table}' as src_network,
+                    b.miles,
+                    h.geom
+                from ({nested_hulls_sql(rings, len(bands), 45)}) h
+                join (values {band_miles}) as b(band, miles) on b.band = h.band
+                order by b.miles
+            """
 
-                else:
-                    geom_idx = 3
-
-                query = f"""
-                    select
-                        '{eta_uid}' as eta_uid,
-                        '{edge_table}' as src_network,
-                        st_buffer(
-                            st_collectionextract(
-                                st_concavehull(
-                                    st_collect(geom), 
-                                    0.99
-                                ),
-                            {geom_idx}),
-                        45) as geom
-                    from {node_table}
-                    where {node_id_col} in {node_filter}
-                """
-
-                gdfs.append(self.db.gdf(query))
+            gdfs.append(self.db.gdf(query))
 
         if len(gdfs) == 0:
             return None
@@ -199,9 +279,17 @@ class IsochroneGenerator:
 
         print("Generating all isochrones")
 
+        if self.cache is not None:
+            return self.cached_isochrones()
+
+        if self.in_memory:
+            return self.isochrones_in_memory()
+
         all_gdfs = []
 
-        for eta_uid in tqdm(self.data.keys(), total=len(self.data)):
+        self.load_all_data()
+
+        for eta_uid in tqdm(self.uid_results.keys(), total=len(self.uid_results)):
             iso = self.make_concave_hull(eta_uid)
 
             if iso is not None:
@@ -211,6 +299,154 @@ class IsochroneGenerator:
 
         return gdf
 
+    def node_gdf(self, network_id: str) -> gpd.GeoDataFrame:
+        """
+        - Load every node geometry for network 'a' or 'b', indexed by node ID
+
+        Arguments:
+            network_id (str): key for the network to use. Options include 'a' and 'b'
+
+        Returns:
+            gpd.GeoDataFrame: node geometries
+        """
+        node_table = self.data_names[network_id]["nodes"]
+        node_id_col = self.data_names[network_id]["node_id_col"]
+
+        query = f"select {node_id_col} as node_id, geom from {node_table}"
+
+        return self.db.gdf(query).set_index("node_id")
+
+    def node_sets(self, network_id: str) -> dict:
+        """
+        - Get every non-empty node list for network 'a' or 'b'
+
+        Returns:
+            dict: keyed on `(eta_uid, miles)`, with a tuple of node IDs
+        """
+        return {
+            (uid, miles): node_ids
+            for uid, data in self.data.items()
+            if data[network_id]
+            for miles, node_ids in data[network_id].items()
+            if len(node_ids) > 0
+        }
+
+    def hulls_in_memory(self, network_id: str, node_sets: dict) -> gpd.GeoDataFrame:
+        """
+        - Build the hulls for a set of node lists on network 'a' or 'b' in Python
+
+        Arguments:
+            network_id (str): key for the network to use. Options include 'a' and 'b'
+            node_sets (dict): keyed on `(eta_uid, miles)`, with a tuple of node IDs
+
+        Returns:
+            gpd.GeoDataFrame: with `eta_uid`, `src_network`, `miles` and geometry columns
+        """
+        # Group the bands back up by POI, smallest first, so they can be built incrementally
+        banded_node_sets = {}
+        for (uid, miles), node_ids in node_sets.items():
+            banded_node_sets.setdefault(uid, {})[miles] = node_ids
+
+        hulls = nested_concave_hulls(
+            self.node_gdf(network_id), banded_node_sets, workers=self.workers
+        )
+
+        return gpd.GeoDataFrame(
+            {
+                "eta_uid": [uid for uid, _ in hulls.index],
+                "src_network": self.data_names[network_id]["edges"],
+                "miles": [miles for _, miles in hulls.index],
+            },
+            geometry=hulls.values,
+            crs=hulls.crs,
+        )
+
+    def isochrones_in_memory(self) -> gpd.GeoDataFrame:
+        """
+        - Generate an isochrone set for every POI UID without a database trip per POI
+        - Node geometries are loaded once per network, and all hulls are built in Python
+        - Every distance band is built in the same batch of hulls
+
+        Returns:
+            gpd.GeoDataFrame: a single gdf with all results merged together
+        """
+
+        return pd.concat(
+            [
+                self.hulls_in_memory(network_id, self.node_sets(network_id))
+                for network_id in ["a", "b"]
+            ]
+        )
+
+    def cached_isochrones(self) -> gpd.GeoDataFrame:
+        """
+        - Generate an isochrone set for every POI UID, only building the ones that are missing
+        from `self.cache` or whose node lists have changed
+
+        Returns:
+            gpd.GeoDataFrame: a single gdf with all results merged together
+        """
+
+        all_gdfs = []
+
+        for network_id in ["a", "b"]:
+            edge_table = self.data_names[network_id]["edges"]
+
+            node_sets = self.node_sets(network_id)
+            raw_ids = {str(uid): uid for uid, _ in node_sets}
+
+            fingerprints = pd.DataFrame(
+                [
+                    {
+                        "poi_uid": str(uid),
+                        "miles": miles,
+                        "cutoff_minutes": self.bands[miles],
+                        "fingerprint": node_fingerprint(node_ids),
+                    }
+                    for (uid, miles), node_ids in node_sets.items()
+                ],
+                columns=["poi_uid", "miles", "cutoff_minutes", "fingerprint"],
+            )
+
+            def build(stale):
+                # Each band is built on top of the smaller ones, so rebuild every band of a
+                # stale POI. The cache only keeps the stale ones.
+                stale_uids = {raw_ids[uid] for uid in stale["poi_uid"]}
+
+                if self.in_memory:
+                    gdf = self.hulls_in_memory(
+                        network_id, {k: v for k, v in node_sets.items() if k[0] in stale_uids}
+                    )
+
+                else:
+                    gdf = pd.concat(
+                        [
+                            self.make_concave_hull(uid, [network_id])
+                            for uid in tqdm(stale_uids, total=len(stale_uids))
+                        ]
+                    )
+
+                gdf["poi_uid"] = gdf["eta_uid"].astype(str)
+                gdf["cutoff_minutes"] = gdf["miles"].map(self.bands)
+
+                return gdf[["poi_uid", "cutoff_minutes", gdf.geometry.name]]
+
+            gdf = self.cache.get_or_build(edge_table, 45, fingerprints, build)
+
+            all_gdfs.append(
+                gpd.GeoDataFrame(
+                    {
+                        "eta_uid": gdf["poi_uid"],
+                        "src_network": edge_table,
+                        "miles": gdf["miles"],
+                    },
+                    geometry=gdf.geometry.values,
+                    crs=gdf.crs,
+                )
+            )
+
+        return pd.concat(all_gdfs)
+
     def save_isos_to_db(self) -> None:
         """
         - Save the full isochrone set to PostgreSQL
@@ -225,8 +461,8 @@ class IsochroneGenerator:
 
         poi_tablename = self.data_names["poi"]["table"]
 
-        self.db.import_geodataframe(
-            gdf, f"data_viz.isochrones_{poi_tablename}", gpd_kwargs={"if_exists": "replace"}
+        import_geodataframe(
+            self.db, gdf, f"data_viz.isochrones_{poi_tablename}", if_exists="replace"
         )
 
     def save_pois_with_iso_stats_to_db(self) -> None:
@@ -241,44 +477,41 @@ class IsochroneGenerator:
         id_col = poi_info["id_col"]
 
         poi_gdf = self.db.gdf(f"select * from {tablename}")
-        poi_gdf["ab_ratio"] = -2.0
 
-        for idx, poi in poi_gdf.iterrows():
-            this_id = poi[id_col]
+        a_network = self.data_names["a"]["edges"]
+        b_network = self.data_names["b"]["edges"]
 
-            query = f"""
-                select src_network, st_area(geom) as area
-                from data_viz.isochrones_{tablename}
-                where eta_uid = '{this_id}'
-            """
-
-            shape_info = self.db.query_as_list_of_lists(query)
+        # Get the area of every isochrone in one query. Bands are nested,
+        # so the largest area for each POI/network is the outermost band
+        query = f"""
+            select eta_uid::text as eta_uid, src_network, max(st_area(geom)) as area
+            from data_viz.isochrones_{tablename}
+            group by eta_uid, src_network
+        """
 
-            if len(shape_info) == 0:
-                print("WARNING! No results for ID #", this_id)
-            else:
+        areas = (
+            self.db.df(query)
+            .pivot(index="eta_uid", columns="src_network", values="area")
+            .reindex(columns=[a_network, b_network])
+            .fillna(0)
+        )
 
-                values = {
-                    self.data_names["a"]["edges"]: 0,
-                    self.data_names["b"]["edges"]: 0,
-                }
+        poi_ids = poi_gdf[id_col].astype(str)
+        matched = poi_ids.isin(areas.index)
 
-                for result in shape_info:
-                    edge_table, area = result
-                    values[edge_table] = area
+        for this_id in poi_ids[~matched]:
+            print("WARNING! No results for ID #", this_id)
 
-                a = values[self.data_names["a"]["edges"]]
-                b = values[self.data_names["b"]["edges"]]
+        a = poi_ids.map(areas[a_network])
+        b = poi_ids.map(areas[b_network])
 
-                if b == 0:
-                    ratio = -1
-                else:
-                    ratio = a / b
+        with np.errstate(divide="ignore", invalid="ignore"):
+            ratio = np.where(b == 0, -1.0, a / b)
 
-                poi_gdf.at[idx, "ab_ratio"] = ratio
+        poi_gdf["ab_ratio"] = np.where(matched, ratio, -2.0)
 
-        self.db.import_geodataframe(
-            poi_gdf, f"data_viz.ab_ratio_{tablename}", gpd_kwargs={"if_exists": "replace"}
+        import_geodataframe(
+            self.db, poi_gdf, f"data_viz.ab_ratio_{tablename}", if_exists="replace"
         )
 
 
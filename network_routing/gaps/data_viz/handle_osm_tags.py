@@ -1,24 +1,32 @@
 from pg_data_etl import Database
 
 
-def scrub_osm_tags(db: Database, custom_hierarchy: list = None) -> None:
+def scrub_osm_tags(
+    db: Database, custom_hierarchy: list = None, edge_table: str = "osm_edges_drive"
+) -> None:
     """
     - Some streets have multiple OSM 'highway' tags, like `'{trunk,motorway}'` or `'{residential,trunk_link}'`
 
     - This function finds the 'worst' attribute, following the pre-defined `hierarchy`,
     which is ordered from 'worst' to 'best'. It can be overridden by providing a `custom_hierarchy`.
 
+    - The hierarchy is loaded as a small lookup table and applied to the edge table with a single
+    `UPDATE ... FROM` join, so it can be re-run after an OSM refresh without any manual cleanup.
+
+    - Only the 'highway' values found on segments with `analyze_sw = 1` are ranked, when the table
+    has that column. Every segment that shares one of those values gets updated.
+
+    - A 'highway' value without any tag in the hierarchy keeps its raw value as the `hwy_tag`.
 
     Args:
         db (PostgreSQL): analysis database
         custom_hierarchy (list): custom list of OSM tag hierarchy, ordered worst to best.
+        edge_table (str): name of the OSM edge table to update, defaults to `osm_edges_drive`
 
     Returns:
-        Updates `public.osm_edges_drive` in-place
+        Updates `edge_table` in-place
     """
 
-    edge_table = "osm_edges_drive"
-
     if custom_hierarchy:
         hierarchy = custom_hierarchy
 
@@ -41,55 +49,53 @@ def scrub_osm_tags(db: Database, custom_hierarchy: list = None) -> None:
             "escape",
         ]
 
-    query = f"""
-        select distinct highway
-        from public.{edge_table}
-        where analyze_sw = 1
-    """
-
-    tag_list = db.query_as_list_of_lists(query)
-
-    results = []
-
-    for tag_tuple in tag_list:
-        all_tags = tag_tuple[0]
-
-        # Split up any comma-delimited tags
-        if "," in all_tags:
-            all_tags = all_tags.replace("{", "").replace("}", "").split(",")
-        else:
-            all_tags = [all_tags]
+    hierarchy_values = ", ".join(f"('{tag}', {idx})" for idx, tag in enumerate(hierarchy))
 
-        lowest_index_number = 999
-
-        for tag in all_tags:
-
-            # Wipe out the "_link" bit
-            tag = tag.replace("_link", "")
-
-            # Get the index of this tag within the pre-defined list
-            tag_idx = hierarchy.index(tag)
-
-            # Use this tag if it's the lowest index found
-            if tag_idx < lowest_index_number:
-                lowest_index_number = tag_idx
+    # Only rank the tags on segments that get analyzed, once `classify_centerlines()` has run
+    if "analyze_sw" in db.columns(edge_table):
+        where_clause = "WHERE analyze_sw = 1"
+    else:
+        where_clause = ""
 
-        results.append((tag_tuple[0], hierarchy[lowest_index_number]))
+    print(f"Updating hwy_tag in {edge_table}")
 
-    db.execute(
-        f"""
+    # Split up any comma-delimited tags, wipe out the "_link" bit,
+    # and keep the lowest-ranked tag for each distinct 'highway' value.
+    # Values without a known tag fall back to the raw 'highway' value.
+    update_query = f"""
         ALTER TABLE {edge_table}
-        ADD COLUMN hwy_tag TEXT;
+        ADD COLUMN IF NOT EXISTS hwy_tag TEXT;
+
+        WITH hierarchy (tag, rank) AS (
+            VALUES {hierarchy_values}
+        ),
+        split_tags AS (
+            SELECT
+                highway,
+                replace(
+                    unnest(string_to_array(trim(both '{{}}' from highway), ',')),
+                    '_link',
+                    ''
+                ) AS tag
+            FROM (
+                SELECT DISTINCT highway
+                FROM {edge_table}
+                {where_clause}
+            ) distinct_tags
+        ),
+        lookup AS (
+            SELECT DISTINCT ON (s.highway)
+                s.highway,
+                coalesce(h.tag, s.highway) AS hwy_tag
+            FROM split_tags s
+            LEFT JOIN hierarchy h
+            ON h.tag = s.tag
+            ORDER BY s.highway, h.rank NULLS LAST
+        )
+        UPDATE {edge_table} e
+        SET hwy_tag = l.hwy_tag
+        FROM lookup l
+        WHERE e.highway = l.highway
+        AND e.hwy_tag IS DISTINCT FROM l.hwy_tag;
     """
-    )
-
-    for original_tag, simple_tag in results:
-
-        print(f"Updating {original_tag} as {simple_tag}")
-
-        update_query = f"""
-            UPDATE {edge_table}
-            SET hwy_tag = '{simple_tag}'
-            WHERE highway = '{original_tag}';
-        """
-        db.execute(update_query)
+    db.execute(update_query)
@@ -0,0 +1,220 @@
+"""
+isochrone_cache.py
+------------------
+
+Content-addressed cache for isochrone polygons.
+
+Each polygon is stored along with everything that went into it: the POI ID,
+the network (edge or result table) the nodes came from, a fingerprint of the
+qualifying node set, the cutoff and the buffer distance. Re-running an
+isochrone process only builds polygons for keys that are new or whose node
+set has changed.
+
+"""
+from __future__ import annotations
+
+import hashlib
+from typing import Callable
+
+import pandas as pd
+import geopandas as gpd
+import shapely
+
+from pg_data_etl import Database
+
+from network_routing.database.bulk_import import import_dataframe
+
+
+KEY_COLUMNS = ["poi_uid", "cutoff_minutes"]
+
+
+def node_fingerprint(node_ids) -> str:
+    """
+    - Hash a set of node IDs, in the same way as `node_fingerprint_sql()`
+
+    Arguments:
+        node_ids (iterable): node IDs that qualify for a single isochrone
+
+    Returns:
+        str: md5 hash of the sorted, comma-delimited IDs
+    """
+    text = ",".join(sorted(str(x) for x in node_ids))
+    return hashlib.md5(text.encode()).hexdigest()
+
+
+def node_fingerprint_sql(node_id_col: str) -> str:
+    """
+    - SQL aggregate that hashes a group of node IDs, in the same way as `node_fingerprint()`
+    - IDs are sorted as text with the "C" collation so that the order matches Python's
+    """
+    return f"""md5(string_agg({node_id_col}::text, ',' order by {node_id_col}::text collate "C"))"""
+
+
+class IsochroneCache:
+    """
+    - Store isochrone polygons keyed on POI ID, network, node set fingerprint, cutoff and buffer
+
+    Attributes:
+        db (Database): analysis database
+        tablename (str): name of the cache table, with schema. Defaults to `data_viz.isochrone_cache`
+    """
+
+    def __init__(self, db: Database, tablename: str = "data_viz.isochrone_cache"):
+        self.db = db
+        self.tablename = tablename
+
+        schema, _ = tablename.split(".")
+
+        self.db.execute(
+            f"""
+            CREATE SCHEMA IF NOT EXISTS {schema};
+
+            CREATE TABLE IF NOT EXISTS {tablename} (
+                poi_uid TEXT NOT NULL,
+                network TEXT NOT NULL,
+                cutoff_minutes FLOAT NOT NULL,
+                buffer_meters FLOAT NOT NULL,
+                fingerprint TEXT NOT NULL,
+                geom GEOMETRY,
+                PRIMARY KEY (poi_uid, network, cutoff_minutes, buffer_meters)
+            );
+        """
+        )
+
+    def _cached_rows(self, network: str, buffer_meters: float, columns: str) -> str:
+        return f"""
+            select {columns}
+            from {self.tablename}
+            where network = '{network}'
+            and buffer_meters = {buffer_meters}
+        """
+
+    def stale(self, network: str, buffer_meters: float, fingerprints: pd.DataFrame) -> pd.DataFrame:
+        """
+        - Filter a set of isochrone keys down to the ones that are missing or out of date
+
+        Arguments:
+            network (str): name of the edge or result table the nodes came from
+            buffer_meters (float): buffer distance used for the isochrones
+            fingerprints (pd.DataFrame): with `poi_uid`, `cutoff_minutes` and `fingerprint` columns
+
+        Returns:
+            pd.DataFrame: the rows of `fingerprints` that need to be built
+        """
+        cached = self.db.df(
+            self._cached_rows(network, buffer_meters, "poi_uid, cutoff_minutes, fingerprint")
+        )
+
+        merged = fingerprints.merge(
+            cached, on=KEY_COLUMNS, how="left", suffixes=("", "_cached")
+        )
+
+        return merged[merged["fingerprint"] != merged["fingerprint_cached"]][fingerprints.columns]
+
+    def save(self, network: str, buffer_meters: float, gdf: gpd.GeoDataFrame) -> None:
+        """
+        - Insert or replace isochrones in the cache
+
+        Arguments:
+            network (str): name of the edge or result table the nodes came from
+            buffer_meters (float): buffer distance used for the isochrones
+            gdf (gpd.GeoDataFrame): with `poi_uid`, `cutoff_minutes`, `fingerprint` and geometry columns
+        """
+        if gdf.empty:
+            return
+
+        staging_table = f"{self.tablename}_staging"
+
+        # Stage the geometries as WKB so that mixed geometry types load without any fuss
+        df = pd.DataFrame(
+            {
+                "poi_uid": gdf["poi_uid"].astype(str).to_numpy(),
+                "cutoff_minutes": gdf["cutoff_minutes"].to_numpy(),
+                "fingerprint": gdf["fingerprint"].to_numpy(),
+                "wkb": shapely.to_wkb(gdf.geometry.values, hex=True),
+            }
+        )
+
+        import_dataframe(self.db, df, staging_table, if_exists="replace", index=False)
+
+        self.db.execute(
+            f"""
+            INSERT INTO {self.tablename}
+                (poi_uid, network, cutoff_minutes, buffer_meters, fingerprint, geom)
+            SELECT
+                poi_uid,
+                '{network}',
+                cutoff_minutes,
+                {buffer_meters},
+                fingerprint,
+                st_setsrid(st_geomfromwkb(decode(wkb, 'hex')), {gdf.crs.to_epsg()})
+            FROM {staging_table}
+            ON CONFLICT (poi_uid, network, cutoff_minutes, buffer_meters)
+            DO UPDATE SET
+                fingerprint = excluded.fingerprint,
+                geom = excluded.geom;
+
+            DROP TABLE {staging_table};
+        """
+        )
+
+    def load(
+        self, network: str, buffer_meters: float, fingerprints: pd.DataFrame
+    ) -> gpd.GeoDataFrame:
+        """
+        - Get the cached isochrones that match a set of keys and fingerprints
+
+        Arguments:
+            network (str): name of the edge or result table the nodes came from
+            buffer_meters (float): buffer distance used for the isochrones
+            fingerprints (pd.DataFrame): with `poi_uid`, `cutoff_minutes` and `fingerprint` columns
+
+        Returns:
+            gpd.GeoDataFrame: all columns from `fingerprints` along with the `geom`
+        """
+        gdf = self.db.gdf(
+            self._cached_rows(network, buffer_meters, "poi_uid, cutoff_minutes, fingerprint, geom")
+        )
+
+        return gdf.merge(fingerprints, on=KEY_COLUMNS + ["fingerprint"])
+
+    def get_or_build(
+        self,
+        network: str,
+        buffer_meters: float,
+        fingerprints: pd.DataFrame,
+        build: Callable[[pd.DataFrame], gpd.GeoDataFrame],
+    ) -> gpd.GeoDataFrame:
+        """
+        - Build any isochrones that are missing from the cache, then return the full set
+
+        Arguments:
+            network (str): name of the edge or result table the nodes came from
+            buffer_meters (float): buffer distance used for the isochrones
+            fingerprints (pd.DataFrame): with `poi_uid`, `cutoff_minutes` and `fingerprint` columns
+            build (Callable): takes the stale rows of `fingerprints` and returns a geodataframe
+                with `poi_uid`, `cutoff_minutes` and geometry columns
+
+        Returns:
+            gpd.GeoDataFrame: all columns from `fingerprints` along with the `geom`
+        """
+        stale = self.stale(network, buffer_meters, fingerprints)
+
+        print(f"{network}: {len(fingerprints) - len(stale)} cached, {len(stale)} to build")
+
+        if len(stale) > 0:
+            built = build(stale)
+            built["poi_uid"] = built["poi_uid"].astype(str)
+            built = built.merge(stale[KEY_COLUMNS + ["fingerprint"]], on=KEY_COLUMNS)
+
+            self.save(network, buffer_meters, built)
+
+        return self.load(network, buffer_meters, fingerprints)
+
+    def clear(self, network: str | None = None) -> None:
+        """
+        - Delete cached isochrones for a single network, or everything if `network` is None
+        """
+        where = f"WHERE network = '{network}'" if network else ""
+
+        self.db.execute(f"DELETE FROM {self.tablename} {where};")
@@ -1,17 +1,178 @@
-import pandas as pd
+from __future__ import annotations
+
 import geopandas as gpd
-from tqdm import tqdm
 
 from pg_data_etl import Database
 
+from network_routing.database.bulk_import import import_geodataframe
+from network_routing.gaps.data_viz.isochrone_cache import IsochroneCache, node_fingerprint_sql
+
+
+def _banded_nodes_sql(
+    analysis_result_table: str, poi_ids: list, bands: dict, id_column: str
+) -> str:
+    """
+    - Build the CTEs that unpivot the result table once out to the largest cutoff,
+    and then repeat each row for every band that it falls within
+
+    Returns:
+        str: SQL with a `banded` CTE that has `poi_uid`, `poi_order`, `node_id`, `geom`,
+        `miles` and `cutoff_minutes` columns
+    """
+
+    band_values = ", ".join(f"({miles}, {minutes})" for miles, minutes in bands.items())
+
+    # Unpivot every n_1_* column in a single pass over the result table
+    unpivot_values = ",\n".join(
+        f"('{poi_uid}', {idx}, t.n_1_{poi_uid})" for idx, poi_uid in enumerate(poi_ids)
+    )
+
+    return f"""
+        with unpivoted as (
+            select u.poi_uid, u.poi_order, u.minutes, t.{id_column} as node_id, t.geom
+            from {analysis_result_table} t
+            cross join lateral (
+                values {unpivot_values}
+            ) as u(poi_uid, poi_order, minutes)
+            where u.minutes <= {max(bands.values())}
+        ),
+        banded as (
+            select u.poi_uid, u.poi_order, u.node_id, u.geom, b.miles, b.cutoff_minutes
+            from unpivoted u
+            join (values {band_values}) as b(miles, cutoff_minutes)
+            on u.minutes <= b.cutoff_minutes
+        )
+    """
+
+
+def nested_hulls_sql(rings_sql: str, num_bands: int, buffer_meters: float) -> str:
+    """
+    - Build nested, buffered concave hulls for every POI in one statement
+    - The smallest band is hulled from its own nodes. Each larger band is hulled from only the
+    nodes it adds plus the vertices of the hull inside it, and is then unioned with the smaller
+    band's polygon. Every node is hulled once, so the cost stays close to that of the largest
+    band alone, and every band contains the ones inside it.
+
+    Arguments:
+        rings_sql (str): query with `poi_uid`, `poi_order`, `band` and `geom` columns, where
+            `band` is the position (from 0) of the smallest band that each node falls within
+        num_bands (int): number of bands
+        buffer_meters (float): distance to buffer each hull by
+
+    Returns:
+        str: SQL with one row per POI and band, with `poi_uid`, `poi_order`, `band` and `geom`
+    """
+
+    # If there's only one or two points we want to extract
+    # the point or linestring from the concavehull operation.
+    # Otherwise, grab the polygon instead
+    # See: https://postgis.net/docs/ST_CollectionExtract.html
+    def polygon(hull: str, num_nodes: str) -> str:
+        return f"""
+            st_buffer(
+                st_collectionextract(
+                    {hull},
+                    case when {num_nodes} = 1 then 1 when {num_nodes} = 2 then 2 else 3 end),
+                {buffer_meters})
+        """
+
+    ctes = [f"rings as ({rings_sql})"]
+
+    for band in range(num_bands):
+        points = f"select poi_uid, poi_order, 1 as num_nodes, geom from rings where band = {band}"
+
+        if band > 0:
+            # The smaller hull's vertices stand in for its nodes, which carry over as a count
+            points += f"""
+                union all
+                select h.poi_uid, h.poi_order, 0, d.geom
+                from hull_{band - 1} h, st_dumppoints(h.hull) d
+                union all
+                select poi_uid, poi_order, num_nodes, null from hull_{band - 1}
+            """
+
+        ctes.append(
+            f"""
+            hull_{band} as (
+                select
+                    poi_uid,
+                    min(poi_order) as poi_order,
+                    sum(num_nodes) as num_nodes,
+                    st_concavehull(st_collect(geom), 0.99) as hull
+                from ({points}) p
+                group by poi_uid
+            )
+        """
+        )
+
+        new_polygon = polygon("h.hull", "h.num_nodes")
+        nested, smaller = new_polygon, ""
+
+        if band > 0:
+            nested = f"""
+                case
+                    when s.geom is null then {new_polygon}
+                    else st_union({new_polygon}, s.geom)
+                end
+            """
+            smaller = f"left join band_{band - 1} s on s.poi_uid = h.poi_uid"
+
+        ctes.append(
+            f"""
+            band_{band} as (
+                select h.poi_uid, h.poi_order, {band} as band, {nested} as geom
+                from hull_{band} h
+                {smaller}
+            )
+        """
+        )
+
+    selects = " union all ".join(f"select * from band_{band}" for band in range(num_bands))
+
+    return f"""
+        with {", ".join(ctes)}
+        select * from ({selects}) b
+    """
+
+
+def _rings_sql(analysis_result_table: str, poi_ids: list, bands: dict) -> str:
+    """
+    - Unpivot the result table once out to the largest cutoff,
+    and label each row with the smallest band that it falls within
+    """
+    band_case = " ".join(
+        f"when u.minutes <= {minutes} then {band}" for band, minutes in enumerate(bands.values())
+    )
+
+    unpivot_values = ",\n".join(
+        f"('{poi_uid}', {idx}, t.n_1_{poi_uid})" for idx, poi_uid in enumerate(poi_ids)
+    )
+
+    return f"""
+        select u.poi_uid, u.poi_order, case {band_case} end as band, t.geom
+        from {analysis_result_table} t
+        cross join lateral (
+            values {unpivot_values}
+        ) as u(poi_uid, poi_order, minutes)
+        where u.minutes <= {max(bands.values())}
+    """
+
 
 def generate_isochrones_for_single_table(
     db: Database,
     analysis_result_table: str,
-    mileage_cutoff: float,
+    mileage_cutoff: float | list,
+    id_column: str = "node_id",
+    cache: IsochroneCache | None = None,
 ) -> gpd.GeoDataFrame:
     """
-    - Generate a single isochrone for each analysis POI.
+    - Generate a single isochrone for each analysis POI, or a nested set of
+    bands when a list of mileage cutoffs is provided.
+    - The result table is unpivoted and scanned once, and every hull is built
+    by one statement instead of two queries per POI.
+    - Nodes are only unpivoted out to the largest cutoff. The bands are built with
+    `nested_hulls_sql()`, so each node is hulled once and every band contains the ones inside it.
+    - When a `cache` is provided, only the POIs whose node sets changed are rebuilt.
 
     To use this process, you need to analyze the POIs by unique ID
     instead of by categories.
@@ -19,16 +180,25 @@ def generate_isochrones_for_single_table(
     Args:
         db (PostgreSQL): analysis database
         analysis_result_table (str): table with network accessibility results
-        mileage_cutoff (float): distance in miles to use as cutoff for isochrone shape
+        mileage_cutoff (float | list): distance in miles to use as cutoff for isochrone shape, or a list of them
+        id_column (str): name of the node ID column in the result table, used to fingerprint the node sets
+        cache (IsochroneCache | None): optional cache of previously-built isochrones
 
     Returns:
-        gpd.GeoDataFrame
+        gpd.GeoDataFrame: with a `miles` column identifying the band
     """
 
-    # Convert mileage cutoff to minutes
-    time_cutoff = mileage_cutoff * 60 / 2.5
+    if isinstance(mileage_cutoff, (int, float)):
+        mileage_cutoff = [mileage_cutoff]
+
+    # Convert mileage cutoffs to minutes
+    bands = {miles: miles * 60 / 2.5 for miles in sorted(set(mileage_cutoff))}
 
-    all_results = []
+    buffer_meters = 45
+
+    band_values = ", ".join(
+        f"({band}, {miles}, {minutes})" for band, (miles, minutes) in enumerate(bands.items())
+    )
 
     print(f"Generating isochrone for {analysis_result_table.upper()}")
 
@@ -36,48 +206,45 @@ def generate_isochrones_for_single_table(
 
     all_ids = [x[4:] for x in result_cols if "n_1_" in x]
 
-    for poi_uid in tqdm(all_ids, total=len(all_ids)):
-        # Figure out if there's results
-        node_count_query = f"""
-            SELECT COUNT(node_id)
-            FROM {analysis_result_table}
-            WHERE n_1_{poi_uid} <= {time_cutoff}
+    def hull_query(poi_ids: list) -> str:
+        rings = _rings_sql(analysis_result_table, poi_ids, bands)
+
+        return f"""
+            select h.geom, h.poi_uid, b.miles, b.cutoff_minutes
+            from ({nested_hulls_sql(rings, len(bands), buffer_meters)}) h
+            join (values {band_values}) as b(band, miles, cutoff_minutes) on b.band = h.band
+            order by h.poi_order, b.miles
         """
-        node_count = db.query_as_singleton(node_count_query)
-
-        # Only make isochrones if there's nodes below the threshold
-        if node_count > 0:
-
-            # If there's only two points we want to extract
-            # the linestring from the concavehull operation
-            if node_count == 2:
-                geom_idx = 2
-            # Otherwise, grab the polygon instead
-            # See: https://postgis.net/docs/ST_CollectionExtract.html
-            else:
-                geom_idx = 3
-
-            query = f"""
-                select  st_buffer(
-                            st_collectionextract(
-                                st_concavehull(st_collect(geom), 0.99),
-                                {geom_idx}),
-                            45) as geom
-                from {analysis_result_table}
-                where n_1_{poi_uid} <= {time_cutoff}
-            """
-            gdf = db.gdf(query)
 
-            gdf["schema"] = analysis_result_table.split(".")[0]
-            gdf["poi_uid"] = poi_uid
+    if cache is None:
+        gdf = db.gdf(hull_query(all_ids))
+
+    else:
+        fingerprint_query = f"""
+            {_banded_nodes_sql(analysis_result_table, all_ids, bands, id_column)}
+            select
+                poi_uid,
+                min(poi_order) as poi_order,
+                miles,
+                cutoff_minutes,
+                {node_fingerprint_sql("node_id")} as fingerprint
+            from banded
+            group by poi_uid, miles, cutoff_minutes
+        """
+        fingerprints = db.df(fingerprint_query)
+
+        def build(stale):
+            gdf = db.gdf(hull_query(list(stale["poi_uid"].unique())))
+            return gdf.merge(stale[["poi_uid", "cutoff_minutes"]])
 
-            gdf = gdf.rename(columns={"geom": "geometry"}).set_geometry("geometry")
+        gdf = cache.get_or_build(analysis_result_table, buffer_meters, fingerprints, build)
+        gdf = gdf.sort_values(["poi_order", "miles"])
 
-            all_results.append(gdf)
+    gdf["schema"] = analysis_result_table.split(".")[0]
 
-    merged_gdf = pd.concat(all_results)
+    gdf = gdf.rename(columns={"geom": "geometry"}).set_geometry("geometry")
 
-    return merged_gdf
+    return gdf[["geometry", "schema", "poi_uid", "miles"]]
 
 
 if __name__ == "__main__":
@@ -87,4 +254,4 @@ if __name__ == "__main__":
 
     gdf = generate_isochrones_for_single_table(db, "delco.trailheads_results", 2)
 
-    db.import_geodataframe(gdf, "data_viz.delco_isochrones_2miles_v2")
+    import_geodataframe(db, gdf, "data_viz.delco_isochrones_2miles_v2")
@@ -1,9 +1,12 @@
+from __future__ import annotations
+
 import pandas as pd
-from tqdm import tqdm
 
 from pg_data_etl import Database
 
+from network_routing.database.bulk_import import import_geodataframe
 from network_routing.gaps.data_viz.make_single_isochrone import generate_isochrones_for_single_table
+from network_routing.gaps.data_viz.isochrone_cache import IsochroneCache
 
 
 def generate_isochrones(
@@ -11,12 +14,16 @@ def generate_isochrones(
     sidewalk_result_table: str = "access_score_sw.sw_results",
     osm_result_table: str = "access_score_osm.osm_results",
     output_tablename: str = "data_viz.accessscore_results",
-    sw_cutoff: float = 1.0,
-    osm_cutoff: float = 1.0,
+    sw_cutoff: float | list = 1.0,
+    osm_cutoff: float | list = 1.0,
+    use_cache: bool = True,
 ) -> None:
     """
     - Using the results of the OSM and Sidewalk ridescore analyses,
     generate two isochrones for each station (one OSM, one sidewalk).
+    - Provide a list of cutoffs to get a set of nested bands for each station in one pass,
+    identified by the `miles` column.
+    - With `use_cache=True`, isochrones are only rebuilt for POIs whose node sets changed since the last run.
 
     To use this process, you need to analyze the POIs by unique ID
     instead of by categories.
@@ -26,8 +33,9 @@ def generate_isochrones(
         sidewalk_result_table (str): table with sidewalk network results
         osm_result_table (str): table with OpenStreetMap results
         output_tablename (str): name of the output table, with schema
-        sw_cutoff (float): the distance in miles to use for the sidewalk isochrones
-        osm_cutoff (float): the distance in miles to use for the OSM isochrones
+        sw_cutoff (float | list): the distance in miles to use for the sidewalk isochrones
+        osm_cutoff (float | list): the distance in miles to use for the OSM isochrones
+        use_cache (bool): flag to reuse isochrones from `data_viz.isochrone_cache`
 
     Returns:
         New SQL table is created named `output_tablename`
@@ -39,6 +47,8 @@ def generate_isochrones(
     sql_query = f"CREATE SCHEMA IF NOT EXISTS {output_schema};"
     db.execute(sql_query)
 
+    cache = IsochroneCache(db) if use_cache else None
+
     all_results = []
 
     ridescore_results = [
@@ -58,13 +68,14 @@ def generate_isochrones(
             db,
             result_config["tablename"],
             mileage_cutoff=result_config["cutoff"],
+            cache=cache,
         )
 
         all_results.append(gdf)
 
     merged_gdf = pd.concat(all_results)
 
-    db.import_geodataframe(merged_gdf, output_tablename)
+    import_geodataframe(db, merged_gdf, output_tablename)
 
 
 def calculate_sidewalkscore(
@@ -101,24 +112,25 @@ def calculate_sidewalkscore(
 
     gdf = db.gdf(poi_query)
 
-    gdf[osm_schema] = 0.0
-    gdf[sw_schema] = 0.0
-
-    for idx, row in tqdm(gdf.iterrows(), total=gdf.shape[0]):
+    # Get the area of every isochrone in one query. Bands are nested,
+    # so the largest area for each station/schema is the outermost band
+    query = f"""
+        select {uid_col}::text as uid, schema, max(st_area(geom)) as area
+        from {iso_table}
+        group by {uid_col}, schema
+    """
 
-        # Find all isochrones for this station
-        query = f"""
-            select schema, st_area(geom) as area
-            from {iso_table}
-            where {uid_col} = '{row.poi_uid}'
-        """
+    areas = db.df(query).pivot(index="uid", columns="schema", values="area")
 
-        result = db.query_as_list_of_lists(query)
+    poi_ids = gdf["poi_uid"].astype(str)
 
-        # Drop each result into the appropriate column
-        for colname, iso_area in result:
-            gdf.at[idx, colname] = iso_area
+    # Drop each result into the appropriate column
+    for colname in sorted(set(areas.columns) | {osm_schema, sw_schema}):
+        if colname in areas.columns:
+            gdf[colname] = poi_ids.map(areas[colname]).fillna(0.0)
+        else:
+            gdf[colname] = 0.0
 
     gdf["sidewalkscore"] = gdf[sw_schema] / gdf[osm_schema]
 
-    db.import_geodataframe(gdf, output_tablename)
+    import_geodataframe(db, gdf, output_tablename)
@@ -9,6 +9,7 @@ from pg_data_etl.database.actions.query.simple import query_as_list_of_lists
 
 from network_routing import pg_db_connection
 from network_routing.database.setup.make_nodes import generate_nodes
+from network_routing.database.bulk_import import import_geodataframe
 
 
 def add_segmentation_to_new_lines(
@@ -211,7 +212,7 @@ def draw_missing_links_to_new_lines(
 
     temp_line_connectors = "temp_line_connectors"
 
-    db.import_geodataframe(combined_gdf, temp_line_connectors, gpd_kwargs={"if_exists": "replace"})
+    import_geodataframe(db, combined_gdf, temp_line_connectors, if_exists="replace")
 
     # Update (/overwrite!) the edge network to include these new connectors
     query = f"""
@@ -228,7 +229,7 @@ def draw_missing_links_to_new_lines(
 
     gdf = db.gdf(query)
 
-    db.import_geodataframe(gdf, edge_table, gpd_kwargs={"if_exists": "replace"})
+    import_geodataframe(db, gdf, edge_table, if_exists="replace")
 
     return [temp_line_connectors]
 
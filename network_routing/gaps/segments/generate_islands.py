@@ -1,23 +1,97 @@
-from tqdm import tqdm
-from random import randint
+from __future__ import annotations
 
 from pg_data_etl import Database
 
 
-def random_rgb(a: float = 1.0) -> str:
+def rgba_from_id_sql(id_col: str, a: float = 1.0) -> str:
     """
-    - Generate a random RGB value, with an option for transparency. This is used to
-    assign a unique RGB value to each island.
+    - Build a SQL expression that turns an ID column into an RGB value, with an option for
+    transparency. This is used to assign a stable, unique-ish RGB value to each island.
+
+    - The red/green/blue values are taken from the first three bytes of the md5 hash of the ID,
+    so every row gets its color within the same statement and re-runs produce the same colors.
 
     Args:
+        id_col (str): name of the ID column (or any SQL expression) to hash
         a (float): transparency value
 
     Returns:
-        something like `'rgba(5, 167, 230, 1.0)'`
+        SQL text that evaluates to something like `'rgba(5, 167, 230, 1.0)'`
+
+    """
+    hashed = f"decode(md5({id_col}::text), 'hex')"
+
+    return f"""
+        concat(
+            'rgba(',
+            get_byte({hashed}, 0), ', ',
+            get_byte({hashed}, 1), ', ',
+            get_byte({hashed}, 2), ', ',
+            {a}, ')'
+        )
+    """
+
+
+def update_island_attributes(db: Database, islands: str, uids: list | None = None) -> None:
+    """
+    - Find the intersecting municipalities for each island with a single grouped spatial join,
+    and write the muni names/count and a hashed rgb code back with one UPDATE statement
 
+    Args:
+        db (Database): analysis database
+        islands (str): name of the islands table, with schema
+        uids (list | None): island IDs to update, or None to update every island
     """
-    r, g, b = randint(0, 255), randint(0, 255), randint(0, 255)
-    return f"rgba({r}, {g}, {b}, {a})"
+    if uids is not None and not uids:
+        return None
+
+    uid_filter = f"WHERE uid IN ({', '.join(str(uid) for uid in uids)})" if uids else ""
+
+    db.execute(
+        f"""
+        WITH selected AS (
+            SELECT uid, geom FROM {islands} {uid_filter}
+        ),
+        muni_share AS (
+            SELECT
+                i.uid,
+                m.mun_name,
+                st_length(st_intersection(i.geom, m.geom)) / st_length(i.geom) * 100 as pct_covered
+            FROM
+                selected i
+            JOIN
+                municipalboundaries m
+            ON
+                st_intersects(m.geom, i.geom)
+        ),
+        muni_summary AS (
+            SELECT
+                uid,
+                string_agg(
+                    concat(mun_name, ': ', round(pct_covered::numeric, 1), ','),
+                    '' ORDER BY pct_covered DESC
+                ) as muni_names,
+                count(*) as muni_count
+            FROM
+                muni_share
+            GROUP BY
+                uid
+        )
+        UPDATE {islands} i
+        SET
+            muni_names = coalesce(s.muni_names, ''),
+            muni_count = coalesce(s.muni_count, 0),
+            rgba = {rgba_from_id_sql("i.uid")}
+        FROM (
+            SELECT i2.uid, ms.muni_names, ms.muni_count
+            FROM selected i2
+            LEFT JOIN muni_summary ms
+            ON ms.uid = i2.uid
+        ) s
+        WHERE
+            i.uid = s.uid
+    """
+    )
 
 
 def generate_islands(
@@ -30,7 +104,7 @@ def generate_islands(
     """
     Merge intersecting sidewalk geometries to create "islands" of connectivity.
 
-    The output is a layer with one feature per 'island', and has a column for size of island and a randomly-generated RGB value.
+    The output is a layer with one feature per 'island', and has a column for size of island and an RGB value hashed from its ID.
 
     Args:
         db (Database): analysis database
@@ -92,42 +166,7 @@ def generate_islands(
     """
     )
 
-    # Iterate over each feature. Make a random rgb code and find intersecting municipalities
-    query = f"SELECT uid FROM {output_schema}.{islands}"
-    uids = db.df(query)
-    for idx, row in tqdm(uids.iterrows(), total=uids.shape[0]):
-        # Query the intersecting municipalities
-        query = f"""
-            SELECT
-                mun_name,
-                st_length(st_intersection(i.geom, m.geom)) / st_length(i.geom) * 100 as pct_covered
-            FROM
-                municipalboundaries m,
-                {output_schema}.{islands} i
-            WHERE
-                    st_intersects(m.geom, i.geom)
-                AND
-                    i.uid = {row.uid}
-            ORDER BY
-                pct_covered DESC
-        """
-        munis = db.query_as_list_of_lists(query)
-
-        # Record the muni names and the percent covered
-        result = ""
-        for muni_name, pct_covered in munis:
-            result += f"{muni_name}: {round(pct_covered, 1)},"
-
-        update = f"""
-            UPDATE {output_schema}.{islands}
-            SET
-                muni_names = '{result}',
-                muni_count = {len(munis)},
-                rgba = '{random_rgb()}'
-            WHERE
-                uid = {row.uid}
-        """
-        db.execute(update)
+    update_island_attributes(db, f"{output_schema}.{islands}")
 
 
 if __name__ == "__main__":
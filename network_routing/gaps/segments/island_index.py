@@ -0,0 +1,342 @@
+"""
+island_index.py
+---------------
+
+Keep the 'islands' layer from `gaps identify-islands` up to date as new
+edges get added, without re-clustering the entire sidewalk network.
+
+The union-find state (which original island now belongs to which surviving
+island) is saved to disk as JSON so that repeated batches can be evaluated
+interactively.
+
+"""
+from __future__ import annotations
+
+import json
+from pathlib import Path
+
+from pg_data_etl import Database
+
+from network_routing.gaps.segments.generate_islands import update_island_attributes
+
+
+def sql_literal(value) -> str:
+    """
+    - Quote a value as a SQL string literal, so that text and uuid IDs can be inlined
+    """
+    return "'" + str(value).replace("'", "''") + "'"
+
+
+class IslandIndex:
+    """
+    - Incrementally merge islands of connectivity as batches of new edges are added
+    - Each batch only touches the island rows that change: merged islands are collected into
+    the island with the lowest `uid`, absorbed rows are deleted, and the size, muni names/count
+    and color of every changed or new island are updated
+
+    Attributes:
+        db (Database): analysis database
+        islands (str): name of the island table, with schema. Defaults to `data_viz.islands`
+        state_path (str): filepath to the JSON file that holds the union-find state
+        tolerance (float): search distance between new edges and islands, in meters. Defaults to 0
+    """
+
+    def __init__(
+        self,
+        db: Database,
+        islands: str = "data_viz.islands",
+        state_path: str = "./data/island_index.json",
+        tolerance: float = 0.0,
+    ):
+        self.db = db
+        self.islands = islands
+        self.state_path = Path(state_path)
+        self.tolerance = tolerance
+
+        self.parent = {}
+
+        if self.state_path.exists():
+            self.load()
+
+        # If the island table was rebuilt from scratch since the state was saved,
+        # the saved uids no longer mean anything and we need to start over
+        table_uids = set(self.island_uids())
+        roots = {self.find(uid) for uid in self.parent}
+
+        if roots != table_uids:
+            if self.parent:
+                print(f"{self.islands} changed since the last save. Rebuilding the island index")
+            self.parent = {uid: uid for uid in table_uids}
+            self.save()
+
+    def island_uids(self) -> list:
+        """
+        - Get a list of every unique ID currently within the island table
+        """
+        return self.db.query_as_list_of_singletons(f"select uid from {self.islands}")
+
+    def load(self) -> None:
+        """
+        - Read the union-find state from `self.state_path`
+        """
+        with open(self.state_path, "r") as f:
+            state = json.load(f)
+
+        self.parent = {int(k): int(v) for k, v in state["parent"].items()}
+
+    def save(self) -> None:
+        """
+        - Write the union-find state to `self.state_path`
+        """
+        self.state_path.parent.mkdir(parents=True, exist_ok=True)
+
+        with open(self.state_path, "w") as f:
+            json.dump({"islands": self.islands, "parent": self.parent}, f)
+
+    def find(self, uid: int) -> int:
+        """
+        - Get the `uid` of the island that `uid` has been merged into, compressing the path as we go
+
+        Arguments:
+            uid (int): island ID, either current or from a previous version of the island table
+
+        Returns:
+            int: ID of the island that currently holds `uid`
+        """
+        root = uid
+        while self.parent[root] != root:
+            root = self.parent[root]
+
+        while self.parent[uid] != root:
+            self.parent[uid], uid = root, self.parent[uid]
+
+        return root
+
+    def column_type(self, tablename: str, column: str) -> str:
+        """
+        - Get the postgres type of a column, i.e. `integer` or `uuid`
+        """
+        return self.db.query_as_singleton(
+            f"""
+            SELECT format_type(atttypid, atttypmod)
+            FROM pg_attribute
+            WHERE attrelid = to_regclass('{tablename}') AND attname = '{column}'
+        """
+        )
+
+    def components(self, edge_table: str, id_col: str = "uid", where: str | None = None) -> list:
+        """
+        - Group a batch of new edges with the islands they connect
+
+        Arguments:
+            edge_table (str): name of the table with the new edges
+            id_col (str): name of the unique ID column in `edge_table`
+            where (str | None): optional filter for the edge table
+
+        Returns:
+            list: of `(island_uids, edge_ids)` tuples, one for each group of connected features
+        """
+
+        edge_filter = f"where {where}" if where else ""
+
+        edges = f"(select {id_col} as edge_id, geom from {edge_table} {edge_filter})"
+
+        island_pairs = self.db.query_as_list_of_lists(
+            f"""
+            select e.edge_id, i.uid
+            from {edges} e
+            join {self.islands} i
+            on st_dwithin(e.geom, i.geom, {self.tolerance})
+        """
+        )
+
+        edge_pairs = self.db.query_as_list_of_lists(
+            f"""
+            select a.edge_id, b.edge_id
+            from {edges} a
+            join {edges} b
+            on a.edge_id < b.edge_id
+            and st_dwithin(a.geom, b.geom, {self.tolerance})
+        """
+        )
+
+        edge_ids = self.db.query_as_list_of_singletons(f"select edge_id from {edges} e")
+
+        # Union-find over this batch only, with islands and edges as separate keys
+        batch = {("edge", edge_id): ("edge", edge_id) for edge_id in edge_ids}
+
+        def batch_find(key):
+            batch.setdefault(key, key)
+            while batch[key] != key:
+                batch[key] = batch[batch[key]]
+                key = batch[key]
+            return key
+
+        def batch_union(a, b):
+            root_a, root_b = batch_find(a), batch_find(b)
+            if root_a != root_b:
+                batch[root_b] = root_a
+
+        for edge_id, island_uid in island_pairs:
+            batch_union(("edge", edge_id), ("island", self.find(island_uid)))
+
+        for edge_a, edge_b in edge_pairs:
+            batch_union(("edge", edge_a), ("edge", edge_b))
+
+        groups = {}
+        for key in list(batch):
+            groups.setdefault(batch_find(key), []).append(key)
+
+        result = []
+        for members in groups.values():
+            island_uids = sorted(v for k, v in members if k == "island")
+            group_edges = sorted(v for k, v in members if k == "edge")
+            result.append((island_uids, group_edges))
+
+        return result
+
+    def add_edges(
+        self,
+        edge_table: str,
+        id_col: str = "uid",
+        where: str | None = None,
+        dry_run: bool = False,
+    ) -> dict:
+        """
+        - Merge a batch of new edges into the island table
+        - Islands connected by the new edges are collected into the island with the lowest `uid`
+        - Edges that don't touch any island become new islands
+        - Use `dry_run=True` to see how many islands a project would merge without changing anything
+
+        Arguments:
+            edge_table (str): name of the table with the new edges
+            id_col (str): name of the unique ID column in `edge_table`
+            where (str | None): optional filter for the edge table, e.g. `groupid = 'project a'`
+            dry_run (bool): flag to skip all writes to the database and state file
+
+        Returns:
+            dict: summary of the batch, including the number of islands merged away
+        """
+
+        groups = self.components(edge_table, id_col, where)
+        new_uids = set()
+
+        island_map = []
+        edge_map = []
+        new_island_groups = []
+        absorbed = []
+
+        for island_uids, edge_ids in groups:
+            if not island_uids:
+                new_island_groups.append(edge_ids)
+                continue
+
+            keep = island_uids[0]
+            island_map += [(uid, keep) for uid in island_uids]
+            edge_map += [(edge_id, keep) for edge_id in edge_ids]
+
+            if len(island_uids) > 1:
+                absorbed += island_uids[1:]
+
+        summary = {
+            "islands_before": len({self.find(uid) for uid in self.parent}),
+            "islands_merged": len(absorbed),
+            "islands_changed": len({keep for _, keep in island_map}),
+            "new_islands": len(new_island_groups),
+        }
+        summary["islands_after"] = (
+            summary["islands_before"] - summary["islands_merged"] + summary["new_islands"]
+        )
+
+        if dry_run:
+            return summary
+
+        id_type = self.column_type(edge_table, id_col)
+
+        if island_map:
+            island_values = ", ".join(f"({uid}, {keep})" for uid, keep in island_map)
+            edge_values = ", ".join(
+                f"({sql_literal(edge_id)}::{id_type}, {keep})" for edge_id, keep in edge_map
+            )
+
+            edge_cte = f"""
+                edge_map (edge_id, keep) AS (VALUES {edge_values}),
+            """
+            edge_union = f"""
+                UNION ALL
+                SELECT m.keep, e.geom
+                FROM {edge_table} e
+                JOIN edge_map m ON e.{id_col} = m.edge_id
+            """
+            if not edge_map:
+                edge_cte, edge_union = "", ""
+
+            self.db.execute(
+                f"""
+                WITH island_map (uid, keep) AS (VALUES {island_values}),
+                {edge_cte}
+                merged AS (
+                    SELECT m.keep, i.geom
+                    FROM {self.islands} i
+                    JOIN island_map m ON i.uid = m.uid
+                    {edge_union}
+                ),
+                collected AS (
+                    SELECT keep, st_multi(st_collectionextract(st_collect(geom), 2)) AS geom
+                    FROM merged
+                    GROUP BY keep
+                )
+                UPDATE {self.islands} i
+                SET
+                    geom = c.geom,
+                    size_miles = st_length(c.geom) * 0.000621371
+                FROM collected c
+                WHERE i.uid = c.keep;
+            """
+            )
+
+        if absorbed:
+            self.db.execute(
+                f"""
+                DELETE FROM {self.islands}
+                WHERE uid IN ({", ".join(str(uid) for uid in absorbed)});
+            """
+            )
+
+            for uid, keep in island_map:
+                self.parent[self.find(uid)] = keep
+
+        if new_island_groups:
+            group_values = ", ".join(
+                f"({sql_literal(edge_id)}::{id_type}, {idx})"
+                for idx, edge_ids in enumerate(new_island_groups)
+                for edge_id in edge_ids
+            )
+
+            self.db.execute(
+                f"""
+                WITH edge_groups (edge_id, grp) AS (VALUES {group_values}),
+                collected AS (
+                    SELECT st_multi(st_collectionextract(st_collect(e.geom), 2)) AS geom
+                    FROM {edge_table} e
+                    JOIN edge_groups g ON e.{id_col} = g.edge_id
+                    GROUP BY g.grp
+                )
+                INSERT INTO {self.islands} (geom, size_miles)
+                SELECT geom, st_length(geom) * 0.000621371
+                FROM collected;
+            """
+            )
+
+            new_uids = set(self.island_uids()) - {self.find(uid) for uid in self.parent}
+
+            for uid in new_uids:
+                self.parent[uid] = uid
+
+        # Refresh the muni names/count and color of every island that changed or was added
+        changed_uids = sorted({keep for _, keep in island_map} | new_uids)
+        update_island_attributes(self.db, self.islands, changed_uids)
+
+        self.save()
+
+        return summary
@@ -4,6 +4,8 @@ from tqdm import tqdm
 from pg_data_etl import Database
 
 from network_routing import pg_db_connection
+from network_routing.database.bulk_import import import_geodataframe, import_geofile
+from network_routing.database.indexes import provision_indexes, table_indexes
 
 # This silences the geopandas warning: "UserWarning: Geometry column does not contain geometry."
 import warnings
@@ -21,6 +23,14 @@ def feature_engineering(erase, split):
 
     db = pg_db_connection()
 
+    provision_indexes(
+        db,
+        table_indexes("improvements.all_possible_geoms", keys=["uid"])
+        + table_indexes("improvements.cleaned_montgomery", keys=["uid"])
+        + table_indexes("pedestriannetwork_lines")
+        + table_indexes("regional_counties", keys=["co_name"]),
+    )
+
     if erase:
         erase_features(db)
 
@@ -146,11 +156,12 @@ def erase_features(db: Database, tablename: str = "improvements.all_possible_geo
 
         # After iterating, write a single table with all of the results to PostGIS
         print("Writing to postgis")
-        db.import_gis(
-            filepath=shp_path,
-            sql_tablename=f"improvements.{county_name.lower()}_erased",
+        import_geofile(
+            db,
+            shp_path,
+            f"improvements.{county_name.lower()}_erased",
+            if_exists="replace",
             explode=True,
-            gpd_kwargs={"if_exists": "replace"},
         )
 
 
@@ -214,7 +225,7 @@ def split_features(db: Database, src_table: str = "improvements.cleaned_montgome
 
     merged_gdf = pd.concat(all_gdfs)
 
-    db.import_geodataframe(merged_gdf, "improvements.montgomery_split")
+    import_geodataframe(db, merged_gdf, "improvements.montgomery_split")
 
 
 if __name__ == "__main__":
@@ -15,6 +15,8 @@ import warnings
 
 from pg_data_etl import Database
 from network_routing import pg_db_connection
+from network_routing.database.bulk_import import import_geofile
+from network_routing.database.indexes import provision_indexes, table_indexes
 
 warnings.filterwarnings("ignore")
 
@@ -26,6 +28,12 @@ def draw_missing_network_links(county):
 
     db = pg_db_connection()
 
+    provision_indexes(
+        db,
+        table_indexes("osm_edges_drive_no_motorway", keys=["uid"])
+        + table_indexes("regional_counties", keys=["co_name"]),
+    )
+
     generate_missing_network(db, county_name=county)
 
 
@@ -121,12 +129,7 @@ def generate_missing_network(
     merged_gdf.to_file(shp_path)
 
     print("Writing to postgis")
-    db.import_gis(
-        filepath=shp_path,
-        sql_tablename=output_table,
-        explode=True,
-        gpd_kwargs={"if_exists": "replace"},
-    )
+    import_geofile(db, shp_path, output_table, if_exists="replace", explode=True)
 
 
 if __name__ == "__main__":
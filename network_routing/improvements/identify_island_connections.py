@@ -2,6 +2,7 @@ from tqdm import tqdm
 import pg_data_etl as pg
 
 from network_routing import pg_db_connection
+from network_routing.database.bulk_import import import_geodataframe
 
 
 def count_islands_connected_by_new_sidewalk(
@@ -47,10 +48,11 @@ def count_islands_connected_by_new_sidewalk(
     if clipped_island_tablename not in db.tables(spatial_only=True):
         gdf = db.gdf(island_clip_query)
 
-        db.import_geodataframe(
+        import_geodataframe(
+            db,
             gdf,
             clipped_island_tablename,
-            gpd_kwargs={"if_exists": "replace"},
+            if_exists="replace",
             explode=True,
         )
 
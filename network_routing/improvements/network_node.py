@@ -9,6 +9,8 @@ from tqdm import tqdm
 from pg_data_etl import Database
 
 from network_routing import pg_db_connection
+from network_routing.database.bulk_import import import_geodataframe
+from network_routing.database.indexes import provision_indexes, table_indexes
 
 
 @click.command()
@@ -33,6 +35,14 @@ def reconnect_nodes(connect_to: str):
         "old_edges": "pedestriannetwork_lines",
     }
 
+    provision_indexes(
+        db,
+        table_indexes(kwargs["new_nodes"], keys=[kwargs["new_node_uid_col"]])
+        + table_indexes(kwargs["old_nodes"], keys=[kwargs["old_node_uid_col"]])
+        + table_indexes(kwargs["new_edges"])
+        + table_indexes(kwargs["old_edges"]),
+    )
+
     nn = NetworkNodes(db, **kwargs)
     nn.draw_lines(to_table=connect_to.lower())
 
@@ -242,6 +252,4 @@ class NetworkNodes:
         print("Merging results")
         merged_gdf = pd.concat(all_results)
         output_tablename = "improvements.montgomery_connectors_to_" + to_tablename.replace(".", "_")
-        self.db.import_geodataframe(
-            merged_gdf, output_tablename, gpd_kwargs={"if_exists": "replace"}
-        )
+        import_geodataframe(self.db, merged_gdf, output_tablename, if_exists="replace")
@@ -0,0 +1,105 @@
+import csv
+import io
+
+import geopandas as gpd
+import pandas as pd
+import pytest
+from shapely.geometry import LineString, Point
+
+from network_routing.database import bulk_import
+from network_routing.database.bulk_import import array_literal, copy_dataframe
+
+
+class FakeCursor:
+    def __init__(self, copied: list):
+        self.copied = copied
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+    def execute(self, query, params=None):
+        pass
+
+    def fetchone(self):
+        return (False,)
+
+    def copy_expert(self, sql, buffer):
+        self.copied.append(buffer.read())
+
+
+class FakeConnection:
+    def __init__(self, copied: list):
+        self.copied = copied
+
+    def cursor(self):
+        return FakeCursor(self.copied)
+
+    def commit(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class FakeDatabase:
+    uri = "postgresql://localhost/test"
+
+    def execute(self, query):
+        pass
+
+
+@pytest.fixture
+def copied(monkeypatch):
+    copied = []
+    monkeypatch.setattr(bulk_import.psycopg2, "connect", lambda uri: FakeConnection(copied))
+    return copied
+
+
+def copied_rows(copied: list) -> list:
+    return list(csv.reader(io.StringIO("".join(copied))))
+
+
+def test_array_literal_matches_postgres_array_text():
+    assert array_literal(["residential", "trunk_link"]) == "{residential,trunk_link}"
+    assert array_literal([123, 456]) == "{123,456}"
+    assert array_literal(["Main St", 'say "hi"', "a,b", None]) == (
+        '{"Main St","say \\"hi\\"","a,b",NULL}'
+    )
+
+
+def test_list_columns_are_copied_as_postgres_arrays(copied):
+    df = pd.DataFrame(
+        {
+            "highway": [["residential", "trunk_link"], "primary", None],
+            "osmid": [(1, 2), 3, 4],
+        }
+    )
+
+    prepared = bulk_import._prepare_columns(df, index=False, index_label=None)
+    copy_dataframe(FakeDatabase(), prepared, "test_table", {"highway": "TEXT", "osmid": "TEXT"})
+
+    rows = copied_rows(copied)
+
+    assert rows[0] == ["{residential,trunk_link}", "{1,2}"]
+    assert rows[1] == ["primary", "3"]
+    assert rows[2][0] == "\\N"
+
+    # This is how scrub_osm_tags splits the highway tags back apart
+    assert rows[0][0].strip("{}").split(",") == ["residential", "trunk_link"]
+
+
+def test_mixed_geometry_types_raise(copied):
+    gdf = gpd.GeoDataFrame(
+        {"name": ["a", "b"]},
+        geometry=[Point(0, 0), LineString([(0, 0), (1, 1)])],
+        crs="EPSG:26918",
+    )
+
+    with pytest.raises(ValueError, match="mix of geometry types"):
+        bulk_import.import_geodataframe(FakeDatabase(), gdf, "test_table")
+
+    bulk_import.import_geodataframe(FakeDatabase(), gdf, "test_table", geom_type="GEOMETRY")
+    assert len(copied_rows(copied)) == 2
@@ -0,0 +1,47 @@
+import geopandas as gpd
+import numpy as np
+from shapely.geometry import Point
+
+from network_routing.accessibility.logic_isochrones import nested_concave_hulls, nested_node_sets
+
+
+def node_gdf_from_xy(xy: np.ndarray) -> gpd.GeoDataFrame:
+    return gpd.GeoDataFrame(
+        index=np.arange(1, len(xy) + 1), geometry=[Point(x, y) for x, y in xy], crs=26918
+    )
+
+
+def test_bands_nest_when_the_smallest_band_is_collinear():
+    # The first three nodes are on one line, which PostGIS turns into an empty polygon
+    node_gdf = node_gdf_from_xy(np.array([[0, 0], [100, 0], [200, 0], [100, 150], [100, -150]]))
+    minutes = np.array([1, 2, 3, 8, 9], dtype=float)
+
+    bands = nested_node_sets(node_gdf.index.to_numpy(), minutes, [5, 10])
+    hulls = nested_concave_hulls(node_gdf, {"poi": bands}, buffer_meters=10)
+
+    small, large = hulls[("poi", 5)], hulls[("poi", 10)]
+
+    assert small.is_empty
+    assert not large.is_empty
+    assert small.difference(large.buffer(1e-6)).is_empty
+    assert all(large.contains(point) for point in node_gdf.geometry)
+
+
+def test_every_band_contains_the_smaller_ones():
+    rng = np.random.default_rng(0)
+    node_gdf = node_gdf_from_xy(rng.uniform(0, 2000, size=(400, 2)))
+    cutoffs = [5, 10, 15, 20]
+
+    node_sets = {
+        poi: nested_node_sets(node_gdf.index.to_numpy(), rng.uniform(0, 25, size=400), cutoffs)
+        for poi in ["a", "b", "c"]
+    }
+
+    hulls = nested_concave_hulls(node_gdf, node_sets, buffer_meters=20, workers=2)
+
+    assert list(hulls.index) == [(poi, cutoff) for poi in node_sets for cutoff in cutoffs]
+
+    for poi in node_sets:
+        for smaller, larger in zip(cutoffs, cutoffs[1:]):
+            outside = hulls[(poi, smaller)].difference(hulls[(poi, larger)].buffer(1e-6))
+            assert outside.is_empty
@@ -0,0 +1,111 @@
+import geopandas as gpd
+import numpy as np
+import pandana as pdna
+import pytest
+from shapely.geometry import LineString, Point
+
+from network_routing.accessibility.logic_analyze import analyze_single_poi
+from network_routing.accessibility.routable_network import RoutableNetwork
+
+
+EPSG = 26918
+SPACING = 100
+WALKING_METERS_PER_MINUTE = 2.5 * 1609.34 / 60
+
+
+class FakeDatabase:
+    """Hands back the POI rows that `analyze_single_poi()` asks for"""
+
+    def __init__(self, poi_gdf: gpd.GeoDataFrame):
+        self.poi_gdf = poi_gdf
+
+    def gdf(self, query):
+        return self.poi_gdf
+
+
+@pytest.fixture
+def grid_network():
+    """
+    - A 5 x 5 grid of nodes 100m apart, with integer node IDs like `construct_network()` makes
+    """
+    coords = {
+        row * 5 + col + 1: (485_000 + col * SPACING, 4_425_000 + row * SPACING)
+        for row in range(5)
+        for col in range(5)
+    }
+
+    node_gdf = gpd.GeoDataFrame(
+        {"node_id": list(coords)},
+        geometry=[Point(xy) for xy in coords.values()],
+        crs=EPSG,
+    )
+    lonlat = node_gdf.geometry.to_crs(4326)
+    node_gdf["x"], node_gdf["y"] = lonlat.x, lonlat.y
+    node_gdf = node_gdf.set_index("node_id")
+
+    pairs = [(n, n + 1) for n in coords if n % 5 != 0] + [(n, n + 5) for n in coords if n <= 20]
+    edge_gdf = gpd.GeoDataFrame(
+        {
+            "start_id": [a for a, _ in pairs],
+            "end_id": [b for _, b in pairs],
+            "minutes": SPACING / WALKING_METERS_PER_MINUTE,
+        },
+        geometry=[LineString([coords[a], coords[b]]) for a, b in pairs],
+        crs=EPSG,
+    )
+
+    network = pdna.Network(
+        node_gdf["x"],
+        node_gdf["y"],
+        edge_gdf["start_id"],
+        edge_gdf["end_id"],
+        edge_gdf[["minutes"]],
+        twoway=True,
+    )
+    network.precompute(10)
+
+    routable = RoutableNetwork.__new__(RoutableNetwork)
+    routable.network, routable.edge_gdf, routable.node_gdf = network, edge_gdf, node_gdf
+    routable.isochrone_workers = 1
+
+    # One POI on the center node, analyzed like `compute_every_poi_into_one_postgres_table()`
+    center = node_gdf.loc[[13]].reset_index(drop=True)
+    center["poi_uid"] = 7
+    _, result_df = analyze_single_poi(
+        FakeDatabase(center), network, 7, "pois", "poi_uid", "edges", 45, 10, 1
+    )
+
+    routable.store_results([result_df])
+
+    return routable
+
+
+def test_results_are_indexed_like_the_nodes(grid_network):
+    assert grid_network.result_df.index.dtype == grid_network.node_gdf.index.dtype
+    assert grid_network.result_df.index.isin(grid_network.node_gdf.index).all()
+
+
+def test_isochrones_from_analyzed_results(grid_network):
+    isochrones = grid_network.make_isochrones([2, 4])
+
+    assert list(isochrones["minutes"]) == [2, 4]
+    assert not isochrones.geometry.is_empty.any()
+    assert isochrones.geometry.iloc[1].area > isochrones.geometry.iloc[0].area
+
+
+def test_walksheds_from_analyzed_results(grid_network):
+    lines, polygons = grid_network.make_walksheds(2, buffer_meters=10)
+
+    assert list(lines["poi_uid"]) == ["7"]
+    # The four edges out of the center node are reached in full, and the next ones in part
+    assert lines.geometry.iloc[0].length > 4 * SPACING
+    assert polygons.geometry.iloc[0].area > 0
+
+
+def test_grid_from_analyzed_results(grid_network):
+    grid, header = grid_network.make_grid(cell_size=SPACING)
+
+    assert header["bands"] == ["least_minutes"]
+    # Every node is within 10 minutes of the center, so every node's cell gets a value
+    assert np.count_nonzero(~np.isnan(grid)) == len(grid_network.node_gdf)
+    assert np.nanmin(grid) == 0